@@ -0,0 +1,185 @@
+#! /usr/bin/env python3
+'''Benchmark of pycewise.
+
+Time compute_regression in all the modes on the files of test_data and on synthetic datasets of increasing sizes
+(made of linear segments, like in the tests), as well as the operations made on the resulting regressions (flatify,
+simplify, auto_simplify, predict and predict_many). Each operation is run several times, then once more under
+tracemalloc to measure its peak memory (not included in the timings, tracemalloc slows down the allocations).
+The results are written as CSV, one row per dataset, mode and operation, with the version of pycewise, so that the
+outputs of several versions can be concatenated to track the scaling curves:
+
+    ./benchmark.py -o bench.csv
+    ./benchmark.py --datasets synthetic --sizes 1000 10000 100000 --modes BIC --option engine="'numpy'"
+
+The complete run is long: the log mode (with the default gradient solver) needs tens of seconds for a thousand points,
+so the largest synthetic datasets are better measured with a restricted list of modes.
+'''
+
+import argparse
+import ast
+import csv
+import gc
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pycewise import compute_regression, __version__, __git_version__
+
+MODES = ['AIC', 'BIC', 'log', 'weighted']
+FILES = ['pingpong_loopback', 'pingpong_remote', 'ringrong_loopback', 'ringrong_remote', 'memcpy_small']
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data')
+ALL_FILES = sorted(os.path.splitext(name)[0] for name in os.listdir(DATA_DIR))
+SIZES = [10**3, 10**4, 10**5, 10**6]
+OPERATIONS = ['compute_regression', 'flatify', 'simplify', 'auto_simplify', 'predict', 'predict_many']
+FIELDS = ['version', 'git_version', 'python', 'dataset', 'size', 'mode', 'options', 'operation', 'repeat', 'time_min',
+          'time_median', 'time_max', 'peak_memory', 'nb_breakpoints']
+
+
+def generate_dataset(intercept, coeff, size, min_x, max_x):
+    '''Return a list of size pairs (x, y) on the line of the given intercept and coefficient, with x drawn uniformly
+    between min_x and max_x (same as in the tests).'''
+    dataset = []
+    for _ in range(size):
+        x = random.uniform(min_x, max_x)
+        dataset.append((x, x*coeff + intercept))
+    return dataset
+
+
+def read_csv(filename):
+    '''Return the values (x, y) of the columns size and duration of the given file of test_data.'''
+    with open(os.path.join(DATA_DIR, filename)) as f:
+        reader = csv.DictReader(f)
+        x, y = [], []
+        for row in reader:
+            x.append(float(row['size']))
+            y.append(float(row['duration']))
+    return x, y
+
+
+def synthetic_dataset(size, nb_segments=4, noise=0.05, seed=42):
+    '''Return a dataset of the given size, made of nb_segments linear segments of equal sizes (as in the tests), with
+    a multiplicative gaussian noise of the given relative standard deviation.'''
+    random.seed(seed)
+    dataset = []
+    for i in range(1, nb_segments+1):
+        dataset.extend(generate_dataset(intercept=i, coeff=i, size=size//nb_segments, min_x=(i-1)*10, max_x=i*10))
+    x = [xx for xx, _ in dataset]
+    y = [yy*random.gauss(1, noise) for _, yy in dataset]
+    return x, y
+
+
+def datasets(names, sizes, noise):
+    '''Yield the name and the values (x, y) of the given datasets.'''
+    for name in names:
+        if name == 'synthetic':
+            for size in sizes:
+                yield 'synthetic_%d' % size, synthetic_dataset(size, noise=noise)
+        else:
+            yield name, read_csv('%s.csv' % name)
+
+
+def measure(func, repeat, memory):
+    '''Call func repeat times, return its last result, the durations of the calls and the peak memory of an additional
+    call (None if memory is False).'''
+    durations = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, durations, peak
+
+
+def run(names, sizes, modes, operations, repeat=3, memory=True, noise=0.05, options=None, output=sys.stdout):
+    '''Run the benchmark and write the results as CSV in the output file.'''
+    options = options or {}
+    writer = csv.DictWriter(output, fieldnames=FIELDS)
+    writer.writeheader()
+    for name, (x, y) in datasets(names, sizes, noise):
+        for mode in modes:
+            reg = None
+            for operation in operations:
+                if operation == 'compute_regression':
+                    def func(): return compute_regression(x, y, mode=mode, **options)
+                else:
+                    if reg is None:
+                        reg = compute_regression(x, y, mode=mode, **options)
+                    if operation == 'predict':
+                        def func(): return [reg.predict(xx) for xx in x]
+                    elif operation == 'predict_many':
+                        def func(): return reg.predict_many(x)
+                    else:
+                        func = getattr(reg, operation)
+                print('%s (%d points), %s mode: %s' % (name, len(x), mode, operation), file=sys.stderr)
+                result, durations, peak = measure(func, repeat, memory)
+                if operation == 'compute_regression':
+                    reg = result
+                writer.writerow({
+                    'version': __version__,
+                    'git_version': __git_version__,
+                    'python': platform.python_version(),
+                    'dataset': name,
+                    'size': len(x),
+                    'mode': mode,
+                    'options': ' '.join('%s=%r' % opt for opt in sorted(options.items())),
+                    'operation': operation,
+                    'repeat': repeat,
+                    'time_min': min(durations),
+                    'time_median': statistics.median(durations),
+                    'time_max': max(durations),
+                    'peak_memory': peak,
+                    'nb_breakpoints': len(reg.breakpoints),
+                })
+                output.flush()
+
+
+def parse_option(option):
+    '''Parse an option key=value of compute_regression, the value being a Python literal.'''
+    key, sep, value = option.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError('Expected key=value, got %s.' % option)
+    try:
+        return key, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        raise argparse.ArgumentTypeError('The value of %s must be a Python literal, got %s.' % (key, value))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Benchmark of pycewise.')
+    parser.add_argument('--datasets', nargs='+', choices=ALL_FILES + ['synthetic'], default=FILES + ['synthetic'],
+                        help='datasets to use (files of test_data, or synthetic datasets)')
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES, help='sizes of the synthetic datasets')
+    parser.add_argument('--noise', type=float, default=0.05, help='relative noise of the synthetic datasets')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES, help='modes of the regressions')
+    parser.add_argument('--operations', nargs='+', choices=OPERATIONS, default=OPERATIONS,
+                        help='operations to measure')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each operation')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure the peak memory')
+    parser.add_argument('--option', action='append', type=parse_option, default=[],
+                        help='additional option key=value given to compute_regression (e.g. engine="\'numpy\'")')
+    parser.add_argument('-o', '--output', help='output CSV file (default: standard output)')
+    args = parser.parse_args(args)
+    if args.repeat < 1:
+        parser.error('The number of runs must be at least 1.')
+    kwargs = dict(repeat=args.repeat, memory=not args.no_memory, noise=args.noise, options=dict(args.option))
+    if args.output is None:
+        run(args.datasets, args.sizes, args.modes, args.operations, **kwargs)
+    else:
+        with open(args.output, 'w', newline='') as output:
+            run(args.datasets, args.sizes, args.modes, args.operations, output=output, **kwargs)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
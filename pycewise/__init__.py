@@ -1,5 +1,7 @@
-from .reg import Node, Leaf, IncrementalStat, Config, FlatRegression, compute_regression
+from .reg import Node, Leaf, FloatLeaf, GroupedLeaf, IncrementalStat, Moments, FloatMoments, GroupedMoments, Config, \
+    Profile, FlatRegression, FrozenRegression, WindowedRegression, compute_regression, read_dataset
 from .version import __version__, __git_version__
 
-__all__ = ['Node', 'Leaf', 'IncrementalStat', 'FlatRegression',
-           'Config', 'compute_regression', '__version__', '__git_version__']
+__all__ = ['Node', 'Leaf', 'FloatLeaf', 'GroupedLeaf', 'IncrementalStat', 'Moments', 'FloatMoments', 'GroupedMoments',
+           'FlatRegression', 'FrozenRegression', 'WindowedRegression', 'Config', 'Profile', 'compute_regression',
+           'read_dataset', '__version__', '__git_version__']
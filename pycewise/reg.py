@@ -1,11 +1,19 @@
-from collections import namedtuple, Counter
+from collections import namedtuple, Counter, defaultdict, deque
+import concurrent.futures
+import bisect
+import csv
+import heapq
 import itertools
 import math
+import os
+import time
 from abc import ABC, abstractmethod
-from copy import deepcopy
+from copy import copy
 from decimal import Decimal, InvalidOperation
 from fractions import Fraction
-from typing import TypeVar, Generic, List, Generator, Callable, Union, Tuple, Dict
+from typing import TypeVar, Generic, List, Generator, Callable, Union, Tuple, Dict, MutableSequence, Sequence, Any, \
+    Type
+from array import array
 try:
     import pandas
 except ImportError:
@@ -37,36 +45,169 @@ else:
 Number = TypeVar('Number', float, Fraction, Decimal)
 ExtNumber = Union[Number, int]
 
+# Immutable summary of a regression (see the summary methods). The parameters and the statistics are None when they are
+# undefined. For a Leaf, the statistics are the tuple (n, mean_x, mean_y, M2_x, M2_y, C_xy), where M2 are the sums of
+# squared deviations from the mean and C_xy is the sum of the products of the deviations of x and y.
+Summary = namedtuple('Summary', ['error', 'nb_points', 'coeff', 'intercept', 'stats'])
+
+# Group of pairs (x, y) sharing the same x (see Moments.add_group). The mean and the sum of squared deviations from the
+# mean (M2) of the y values are None when they are not computed yet.
+Group = namedtuple('Group', ['x', 'y_values', 'mean_y', 'M2_y'])
+
 
 class Config:
     allowed_modes = ('AIC', 'BIC', 'log', 'weighted')
-
-    def __init__(self, mode: str, epsilon: float) -> None:
+    allowed_engines = ('python', 'numpy')
+    allowed_log_solvers = ('gradient', 'lm')
+    allowed_binnings = ('quantile', 'log')
+    allowed_orders = ('depth', 'breadth', 'largest')
+
+    def __init__(self, mode: str, epsilon: float, engine: str = 'python', log_solver: str = 'gradient',
+                 aggregate: bool = False, nb_bins: Union[None, int] = None, binning: str = 'quantile',
+                 refine: bool = False, max_depth: Union[None, int] = None,
+                 min_points_per_segment: Union[None, int] = None, min_distinct_x_per_segment: Union[None, int] = None,
+                 max_breakpoints: Union[None, int] = None, order: str = 'depth',
+                 profile: Union[None, 'Profile'] = None) -> None:
         if mode not in self.allowed_modes:
             raise ValueError('Unknown mode %s. Authorized modes: %s.' %
                              (mode, ', '.join(self.allowed_modes)))
+        if engine not in self.allowed_engines:
+            raise ValueError('Unknown engine %s. Authorized engines: %s.' %
+                             (engine, ', '.join(self.allowed_engines)))
+        if engine == 'numpy' and numpy is None:
+            raise ImportError('No module named "numpy".')
+        if log_solver not in self.allowed_log_solvers:
+            raise ValueError('Unknown log solver %s. Authorized log solvers: %s.' %
+                             (log_solver, ', '.join(self.allowed_log_solvers)))
+        if binning not in self.allowed_binnings:
+            raise ValueError('Unknown binning %s. Authorized binnings: %s.' %
+                             (binning, ', '.join(self.allowed_binnings)))
+        if nb_bins is not None and nb_bins < 2:
+            raise ValueError('The number of bins must be at least 2.')
+        if order not in self.allowed_orders:
+            raise ValueError('Unknown order %s. Authorized orders: %s.' %
+                             (order, ', '.join(self.allowed_orders)))
+        for name, value, minimum in [('max_depth', max_depth, 0), ('max_breakpoints', max_breakpoints, 0),
+                                     ('min_points_per_segment', min_points_per_segment, 1),
+                                     ('min_distinct_x_per_segment', min_distinct_x_per_segment, 1)]:
+            if value is not None and value < minimum:
+                raise ValueError('The value of %s must be at least %d.' % (name, minimum))
         self.mode = mode
         self.epsilon = epsilon
+        self.engine = engine
+        self.log_solver = log_solver
+        self.aggregate = aggregate
+        self.nb_bins = nb_bins
+        self.binning = binning
+        self.refine = refine
+        self.max_depth = max_depth
+        self.min_points_per_segment = min_points_per_segment
+        self.min_distinct_x_per_segment = min_distinct_x_per_segment
+        self.max_breakpoints = max_breakpoints
+        self.order = order
+        self.profile = profile  # not part of the configuration, see Profile
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Config):
             return False
-        return self is other or (self.mode == other.mode and self.epsilon == other.epsilon)
+        return self is other or (self.mode == other.mode and self.epsilon == other.epsilon and
+                                 self.engine == other.engine and self.log_solver == other.log_solver and
+                                 self.aggregate == other.aggregate and self.nb_bins == other.nb_bins and
+                                 self.binning == other.binning and self.refine == other.refine and
+                                 self.max_depth == other.max_depth and
+                                 self.min_points_per_segment == other.min_points_per_segment and
+                                 self.min_distinct_x_per_segment == other.min_distinct_x_per_segment and
+                                 self.max_breakpoints == other.max_breakpoints and self.order == other.order)
+
+    def __repr__(self) -> str:
+        options = ''
+        if self.aggregate:
+            options += ', aggregate'
+        if self.nb_bins is not None:
+            options += ', %d %s bins%s' % (self.nb_bins, self.binning, ' refined' if self.refine else '')
+        for name in ['max_depth', 'min_points_per_segment', 'min_distinct_x_per_segment', 'max_breakpoints']:
+            if getattr(self, name) is not None:
+                options += ', %s=%d' % (name, getattr(self, name))
+        if self.order != 'depth':
+            options += ', %s first' % self.order
+        return '%s(%s, %.2e, %s, %s%s)' % (self.__class__.__name__, self.mode, self.epsilon, self.engine,
+                                           self.log_solver, options)
+
+
+class Profile:
+    '''Counters and cumulative times (in seconds) of the operations made by a regression, to find out where the time
+    of a slow fit goes (see the profile parameter of compute_regression). During the fit, the profile is held by the
+    configuration, which is shared by all the nodes and leaves of the regression. When it is None (the default), the
+    instrumented methods only check this attribute. It is detached from the configuration once the fit is done, so
+    that the later operations on the regression (e.g. extend) are neither slowed down nor counted.
+    The counts and times are indexed by the name of the operation:
+    - 'move': moves of the last group of points from a leaf of a node to the other one, during the split searches
+      ('points moved' counts the points, it is not timed),
+    - 'error AIC', 'error BIC', 'error log', 'error weighted': evaluations of the error of a regression (in this mode),
+    - 'log parameters': fits of the parameters of a leaf in log mode, 'log iterations' and 'log line search steps'
+      count the iterations of the solver and the evaluations made by its line searches (gradient descent) or by its
+      adjustments of the damping (Levenberg-Marquardt),
+    - 'node' and 'leaf': allocations of nodes and leaves (not timed).
+    The times of nested operations overlap, e.g. the error of a leaf in log mode includes the fit of its parameters.
+    The levels and level_counts give the time spent on the nodes at each depth of the tree (the split search, or the
+    decision not to split) and the number of these nodes.'''
+
+    def __init__(self) -> None:
+        self.counts: Dict[str, int] = Counter()
+        self.times: Dict[str, float] = defaultdict(float)
+        self.levels: Dict[int, float] = defaultdict(float)
+        self.level_counts: Dict[int, int] = Counter()
+
+    def count(self, name: str, count: int = 1) -> None:
+        self.counts[name] += count
+
+    def add(self, name: str, start: float, count: int = 1) -> None:
+        '''Count the operation, which started at the given time (from time.perf_counter).'''
+        self.times[name] += time.perf_counter() - start
+        self.counts[name] += count
+
+    def add_level(self, depth: int, start: float) -> None:
+        '''Count a node at the given depth, whose search started at the given time (from time.perf_counter).'''
+        self.levels[depth] += time.perf_counter() - start
+        self.level_counts[depth] += 1
 
     def __repr__(self) -> str:
-        return '%s(%s, %.2e)' % (self.__class__.__name__, self.mode, self.epsilon)
+        return '%s(%d moves, %d error evaluations, %d levels)' % (
+            self.__class__.__name__, self.counts['move'],
+            sum(count for name, count in self.counts.items() if name.startswith('error ')), len(self.levels))
+
+    def to_pandas(self):
+        '''Return a DataFrame with the count and the time of each operation, then of each level of the tree.'''
+        if pandas is None:
+            raise ImportError('No module named "pandas".')
+        rows = [{'name': name, 'count': count, 'time': self.times.get(name)} for name, count in self.counts.items()]
+        rows.extend({'name': 'level %d' % depth, 'count': self.level_counts[depth], 'time': self.levels[depth]}
+                    for depth in sorted(self.levels))
+        return pandas.DataFrame(rows, columns=['name', 'count', 'time'])
 
 
 class IncrementalStat(Generic[Number]):
     '''Represent a collection of numbers. Numbers can be added and removed (see methods add and pop).
     Several aggregated values (e.g., mean and variance) can be obtained in constant time.
-    For the algorithms, see https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance'''
+    For the algorithms, see https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance
+    When all the numbers are floats, the values and the history of the aggregated values are stored in compact arrays of
+    doubles (8 bytes per number) instead of lists of Python objects. Otherwise (e.g. Fraction or Decimal), lists are
+    used.'''
 
     def __init__(self, func: Callable[[Number], Number] = lambda x: x) -> None:
-        self.values: List[Number] = []
-        self.Ex: List[Number] = []
-        self.M2: List[Number] = []
+        self.values: MutableSequence[Number] = []
+        self.Ex: MutableSequence[Number] = []
+        self.M2: MutableSequence[Number] = []
         self.func: Callable[[Number], Number] = func
+        self.__compact = False
+
+    def __use_arrays(self) -> None:
+        self.values, self.Ex, self.M2 = array('d'), array('d'), array('d')  # type: ignore
+        self.__compact = True
+
+    def __use_lists(self) -> None:
+        self.values, self.Ex, self.M2 = list(self.values), list(self.Ex), list(self.M2)
+        self.__compact = False
 
     def __len__(self) -> int:
         return len(self.values)
@@ -81,13 +222,22 @@ class IncrementalStat(Generic[Number]):
         '''Add a new element to the collection.'''
         original_value = val
         val = self.func(val)
-        if len(self) == 0:
+        n = len(self.values)
+        if n == 0:
+            is_float = original_value.__class__ is float and val.__class__ is float
+            if is_float != self.__compact:
+                if is_float:
+                    self.__use_arrays()
+                else:
+                    self.__use_lists()
             new_Ex = val
             new_M2 = val.__class__(0)
         else:
+            if self.__compact and (original_value.__class__ is not float or val.__class__ is not float):
+                self.__use_lists()
             Ex = self.Ex[-1]
             M2 = self.M2[-1]
-            n = len(self)+1
+            n += 1
             new_Ex = Ex + (val-Ex)/n
             new_M2 = M2 + (val - Ex)*(val - new_Ex)
         self.values.append(original_value)
@@ -106,11 +256,46 @@ class IncrementalStat(Generic[Number]):
 
     def pop(self) -> Number:
         '''Remove the last element that was added to the collection and return it.'''
+        if len(self.Ex) != len(self.values):  # obtained with __add__, the history of the aggregated values is missing
+            self.__rebuild_history()
         val = self.values.pop()
         self.Ex.pop()
         self.M2.pop()
         return val
 
+    def __rebuild_history(self) -> None:
+        '''Compute the aggregated values after the addition of each element by adding them again one at a time.'''
+        replay: IncrementalStat[Number] = IncrementalStat(self.func)
+        for val in self.values:
+            replay.add(val)
+        self.Ex, self.M2 = replay.Ex, replay.M2
+
+    def __add__(self, other: 'IncrementalStat[Number]') -> 'IncrementalStat[Number]':
+        '''Return a new collection holding the elements of self followed by the elements of other (with the function of
+        self). The aggregated values are combined in constant time, the elements are copied by block. The history of
+        the aggregated values, needed by pop, is rebuilt only when an element is removed.
+        See https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm'''
+        result: IncrementalStat[Number] = IncrementalStat(self.func)
+        if isinstance(self.values, array) and isinstance(other.values, array):
+            result.values = self.values + other.values
+        else:
+            result.values = list(self.values) + list(other.values)
+        n1, n2 = len(self), len(other)
+        if n1 == 0 or n2 == 0:
+            last = self if n2 == 0 else other
+            Ex, M2 = last.Ex[-1:], last.M2[-1:]
+        else:
+            n = n1 + n2
+            delta = other.mean - self.mean
+            Ex = [self.mean + delta*n2/n]
+            M2 = [self.M2[-1] + other.M2[-1] + delta*delta*n1*n2/n]
+        if isinstance(result.values, array):
+            result.Ex, result.M2 = array('d', Ex), array('d', M2)  # type: ignore
+            result.__compact = True
+        else:
+            result.Ex, result.M2 = list(Ex), list(M2)
+        return result
+
     @property
     def mean(self) -> Number:
         '''Return the mean of all the elements of the collection.'''
@@ -135,10 +320,470 @@ class IncrementalStat(Generic[Number]):
         return self.mean*len(self)
 
 
+class Moments(Generic[Number]):
+    '''Represent a collection of pairs (x, y) with their sufficient statistics: the means of x and y, the sums of
+    squared deviations from the means (M2) and the co-moment of x and y (sum of the products of the deviations).
+    All these statistics are updated together in a single step when a pair is added. Pairs can be removed in the reverse
+    order of their addition (see methods add and pop), the state before each addition is kept so that a removal
+    restores it exactly.
+    In weighted mode, the same statistics are also maintained for u = 1/x and v = y/x (and the co-moments of x and u, y
+    and u, u and v).
+    Each pair is stored only once. When all the numbers are floats, the pairs and the history of the statistics are
+    stored in compact arrays of doubles, otherwise (e.g. Fraction or Decimal) in lists.
+    For the algorithms, see https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance'''
+
+    statistics = ('mean_x', 'mean_y', 'M2_x', 'M2_y', 'C_xy')
+    weighted_statistics = ('mean_u', 'mean_v', 'M2_u', 'M2_v', 'C_xu', 'C_yu', 'C_uv')
+
+    def __init__(self, weighted: bool = False) -> None:
+        self.weighted = weighted
+        self.stride = 12 if weighted else 5  # number of statistics saved in the history for each pair
+        self.x_values: MutableSequence[Number] = []
+        self.y_values: MutableSequence[Number] = []
+        self.history: MutableSequence[Any] = []
+        self.__compact = False
+        self.mean_x: Any = 0
+        self.mean_y: Any = 0
+        self.M2_x: Any = 0
+        self.M2_y: Any = 0
+        self.C_xy: Any = 0
+        if weighted:
+            self.mean_u: Any = 0
+            self.mean_v: Any = 0
+            self.M2_u: Any = 0
+            self.M2_v: Any = 0
+            self.C_xu: Any = 0
+            self.C_yu: Any = 0
+            self.C_uv: Any = 0
+
+    def __use_arrays(self) -> None:
+        self.x_values, self.y_values, self.history = array('d'), array('d'), array('d', self.history)  # type: ignore
+        self.__compact = True
+
+    def __use_lists(self) -> None:
+        self.x_values, self.y_values, self.history = list(self.x_values), list(self.y_values), list(self.history)
+        self.__compact = False
+
+    def __len__(self) -> int:
+        return len(self.x_values)
+
+    def __iter__(self) -> Generator[Tuple[Number, Number], None, None]:
+        yield from zip(self.x_values, self.y_values)
+
+    def __reviter__(self) -> Generator[Tuple[Number, Number], None, None]:
+        yield from zip(reversed(self.x_values), reversed(self.y_values))
+
+    def add(self, x: Number, y: Number) -> None:
+        '''Add the pair (x, y) to the collection.'''
+        if self.__compact:
+            if x.__class__ is not float or y.__class__ is not float:
+                self.__use_lists()
+        elif len(self.x_values) == 0 and x.__class__ is float and y.__class__ is float:
+            self.__use_arrays()
+        n = len(self.x_values) + 1
+        mean_x = self.mean_x
+        mean_y = self.mean_y
+        self.history.extend((mean_x, mean_y, self.M2_x, self.M2_y, self.C_xy))
+        dx = x - mean_x
+        dy = y - mean_y
+        mean_x += dx/n
+        mean_y += dy/n
+        self.mean_x = mean_x
+        self.mean_y = mean_y
+        self.M2_x += dx*(x - mean_x)
+        self.M2_y += dy*(y - mean_y)
+        self.C_xy += dx*(y - mean_y)
+        if self.weighted:
+            self._add_weighted(x, y, n, dx, mean_y)
+        self.x_values.append(x)
+        self.y_values.append(y)
+
+    def _add_weighted(self, x: Number, y: Number, n: int, dx: Number, mean_y: Number) -> None:
+        '''Update the statistics of u = 1/x and v = y/x for the addition of the pair (x, y), given the new size n, the
+        deviation dx of x from the previous mean of x and the new mean of y.'''
+        if x == 0:  # infinite weight, the weighted statistics are meaningless as long as this pair is here
+            u = v = x
+        else:
+            u = 1/x
+            v = y/x
+        mean_u = self.mean_u
+        mean_v = self.mean_v
+        self.history.extend((mean_u, mean_v, self.M2_u, self.M2_v, self.C_xu, self.C_yu, self.C_uv))
+        du = u - mean_u
+        dv = v - mean_v
+        mean_u += du/n
+        mean_v += dv/n
+        self.mean_u = mean_u
+        self.mean_v = mean_v
+        self.M2_u += du*(u - mean_u)
+        self.M2_v += dv*(v - mean_v)
+        self.C_xu += dx*(u - mean_u)
+        self.C_yu += du*(y - mean_y)
+        self.C_uv += du*(v - mean_v)
+
+    def pop(self) -> Tuple[Number, Number]:
+        '''Remove and return the last pair (x, y) that was added to the collection.'''
+        history = self.history
+        if not history:
+            history = self._rebuild_history()
+        state = history[-self.stride:]
+        del history[-self.stride:]
+        self.mean_x, self.mean_y, self.M2_x, self.M2_y, self.C_xy = state[:5]
+        if self.weighted:
+            self.mean_u, self.mean_v, self.M2_u, self.M2_v, self.C_xu, self.C_yu, self.C_uv = state[5:]
+        return self.x_values.pop(), self.y_values.pop()
+
+    def add_group(self, group: Group) -> None:
+        '''Add the pairs (group.x, y) for all the y of group.y_values, in this order.'''
+        x = group.x
+        for y in group.y_values:
+            self.add(x, y)
+
+    def pop_group(self, size: int) -> Group:
+        '''Remove the last size pairs, which must share the same x, and return them as a group (with the y values in
+        their order of removal). The statistics of the group are not computed.'''
+        y_values = []
+        for _ in range(size):
+            x, y = self.pop()
+            y_values.append(y)
+        return Group(x, y_values, None, None)
+
+    def _rebuild_history(self) -> MutableSequence[Any]:
+        '''Compute the states of the statistics before the addition of each pair, by adding them again one at a time,
+        and return the new history. This is needed for a collection obtained with combine, which has no history.'''
+        replay = self.__class__(weighted=self.weighted)
+        for x, y in self:
+            replay.add(x, y)
+        self.history = replay.history
+        return self.history
+
+    def sort(self, reverse: bool = False) -> None:
+        '''Sort the pairs in increasing order (decreasing if reverse is True). The statistics do not depend on the
+        order, but the history does: it is dropped and will be rebuilt if a pair is removed.'''
+        pairs = sorted(zip(self.x_values, self.y_values), reverse=reverse)
+        self.x_values = self.x_values[:0]
+        self.y_values = self.y_values[:0]
+        self.x_values.extend(p[0] for p in pairs)
+        self.y_values.extend(p[1] for p in pairs)
+        self.history = self.history[:0]
+
+    def insert(self, x: Number, y: Number, reverse: bool = False) -> None:
+        '''Add the pair (x, y) at its position in the pairs, which must be sorted in increasing order (decreasing if
+        reverse is True). The statistics are updated like in add, the position is found with a binary search and the
+        pair is inserted with a single move of the following ones. The history does not match the new order anymore:
+        it is dropped and will be rebuilt if a pair is removed.'''
+        x_values, y_values = self.x_values, self.y_values
+        low, high = 0, len(x_values)
+        while low < high:  # bisect.bisect_right on the pairs, without copying them
+            middle = (low + high) // 2
+            pair = (x_values[middle], y_values[middle])
+            if (pair < (x, y)) if reverse else (pair > (x, y)):
+                high = middle
+            else:
+                low = middle + 1
+        self.add(x, y)
+        del self.x_values[-1]  # the values may have been converted to lists by add
+        del self.y_values[-1]
+        self.x_values.insert(low, x)
+        self.y_values.insert(low, y)
+        self.history = self.history[:0]
+
+    def combine(self, other: 'Moments[Number]', order: int = 1, other_order: int = 1) -> 'Moments[Number]':
+        '''Return a new collection holding the pairs of self followed by the pairs of other, each one in reverse order
+        if its order is -1.
+        The statistics are combined in constant time. The pairs are copied by block (slices of the arrays or lists),
+        without any computation, and the history needed by pop is rebuilt only when a pair is removed.
+        See https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm'''
+        result = self.__class__(weighted=self.weighted)
+        x1, y1 = self.x_values[::order], self.y_values[::order]
+        x2, y2 = other.x_values[::other_order], other.y_values[::other_order]
+        if len(x1) == 0:  # an empty collection has lists, it must not force the other side to use lists
+            x1, y1 = x2[:0], y2[:0]
+        elif len(x2) == 0:
+            x2, y2 = x1[:0], y1[:0]
+        if isinstance(x1, array) and isinstance(x2, array) and isinstance(y1, array) and isinstance(y2, array):
+            result.x_values, result.y_values = x1 + x2, y1 + y2
+        else:
+            result.x_values, result.y_values = list(x1) + list(x2), list(y1) + list(y2)
+        if isinstance(result.x_values, array):
+            result.history = array('d')
+            result.__compact = True
+        for name in self.statistics + self.weighted_statistics if self.weighted else self.statistics:
+            setattr(result, name, getattr(self, name))
+        result.merge_statistics(other, len(self), len(other))
+        return result
+
+    def merge_statistics(self, other: 'Moments[Number]', n1: int, n2: int) -> None:
+        '''Replace the statistics of this collection, taken as those of n1 pairs, by the statistics of these pairs and
+        of the n2 pairs of the other collection, in constant time (see combine). The pairs themselves are not used.'''
+        names = self.statistics + self.weighted_statistics if self.weighted else self.statistics
+        if n1 == 0 or n2 == 0:
+            if n1 == 0:
+                for name in names:
+                    setattr(self, name, getattr(other, name))
+            return
+        n = n1 + n2
+        delta = {}
+        for var in ('xyuv' if self.weighted else 'xy'):
+            mean1 = getattr(self, 'mean_%s' % var)
+            delta[var] = getattr(other, 'mean_%s' % var) - mean1
+            setattr(self, 'mean_%s' % var, mean1 + delta[var]*n2/n)
+            setattr(self, 'M2_%s' % var, getattr(self, 'M2_%s' % var) + getattr(other, 'M2_%s' % var) +
+                    delta[var]*delta[var]*n1*n2/n)
+        for name in names:
+            if name.startswith('C_'):
+                var1, var2 = name[2], name[3]
+                setattr(self, name, getattr(self, name) + getattr(other, name) + delta[var1]*delta[var2]*n1*n2/n)
+
+
+class FloatMoments(Moments[float]):
+    '''Specialization of Moments for floats: the pairs and the history are always stored in compact arrays of doubles
+    and the updates do not check the type of the values. All the values must be floats.
+    The operations are the same than in Moments, so the statistics are identical.'''
+
+    def __init__(self, weighted: bool = False) -> None:
+        super().__init__(weighted)
+        self.x_values = array('d')
+        self.y_values = array('d')
+        self.history = array('d')
+
+    def add(self, x: float, y: float) -> None:
+        '''Add the pair (x, y) to the collection.'''
+        x_values = self.x_values
+        n = len(x_values) + 1
+        mean_x = self.mean_x
+        mean_y = self.mean_y
+        self.history.extend((mean_x, mean_y, self.M2_x, self.M2_y, self.C_xy))
+        dx = x - mean_x
+        dy = y - mean_y
+        mean_x += dx/n
+        mean_y += dy/n
+        self.mean_x = mean_x
+        self.mean_y = mean_y
+        res_y = y - mean_y
+        self.M2_x += dx*(x - mean_x)
+        self.M2_y += dy*res_y
+        self.C_xy += dx*res_y
+        if self.weighted:
+            self._add_weighted(x, y, n, dx, mean_y)
+        x_values.append(x)
+        self.y_values.append(y)
+
+    def pop(self) -> Tuple[float, float]:
+        '''Remove and return the last pair (x, y) that was added to the collection.'''
+        if self.weighted:
+            return super().pop()
+        history = self.history
+        if not history:
+            history = self._rebuild_history()
+        self.C_xy = history.pop()
+        self.M2_y = history.pop()
+        self.M2_x = history.pop()
+        self.mean_y = history.pop()
+        self.mean_x = history.pop()
+        return self.x_values.pop(), self.y_values.pop()
+
+
+class GroupedMoments(Moments[Number]):
+    '''Variant of Moments where the pairs sharing the same x are added and removed by groups (see add_group and
+    pop_group) in constant time, whatever the size of the group. The statistics of a group (its size, the mean and the
+    M2 of its y, the other ones being null since x is constant) are computed once and combined with those of the
+    collection with the parallel formulas of combine, and the history holds a single state per group.
+    The pairs are still stored one by one (in lists), so that the collection can be iterated like any other. A single
+    pair is added or removed as a group of one pair.'''
+
+    def __init__(self, weighted: bool = False) -> None:
+        super().__init__(weighted)
+        self.groups: List[Tuple[Number, int, Number, Number]] = []  # (x, size, mean_y, M2_y) for each state
+
+    @staticmethod
+    def group_statistics(y_values: Sequence[Number]) -> Tuple[Number, Number]:
+        '''Return the mean and the M2 of the given values.'''
+        mean: Any = 0
+        M2: Any = 0
+        for n, y in enumerate(y_values, start=1):
+            delta = y - mean
+            mean += delta/n
+            M2 += delta*(y - mean)
+        return mean, M2
+
+    @staticmethod
+    def split_groups(x: Sequence[Number], y: Sequence[Number]) -> Generator[Group, None, None]:
+        '''Yield the groups of consecutive pairs sharing the same x (without their statistics).'''
+        start = 0
+        for i in range(1, len(x)+1):
+            if i == len(x) or x[i] != x[start]:
+                yield Group(x[start], list(y[start:i]), None, None)
+                start = i
+
+    def add(self, x: Number, y: Number) -> None:
+        '''Add the pair (x, y) to the collection.'''
+        self.add_group(Group(x, [y], y, 0))
+
+    def add_group(self, group: Group) -> None:
+        '''Add the pairs (group.x, y) for all the y of group.y_values, in this order.'''
+        x, y_values, mean_g, M2_g = group
+        size = len(y_values)
+        if size == 0:
+            return
+        if mean_g is None:
+            mean_g, M2_g = self.group_statistics(y_values)
+        n1 = len(self.x_values)
+        n = n1 + size
+        mean_x = self.mean_x
+        mean_y = self.mean_y
+        self.history.extend((mean_x, mean_y, self.M2_x, self.M2_y, self.C_xy))
+        dx = x - mean_x
+        dy = mean_g - mean_y
+        self.mean_x = mean_x + dx*size/n
+        self.mean_y = mean_y + dy*size/n
+        self.M2_x += dx*dx*n1*size/n
+        self.M2_y += M2_g + dy*dy*n1*size/n
+        self.C_xy += dx*dy*n1*size/n
+        if self.weighted:
+            if x == 0:  # infinite weight, see Moments._add_weighted
+                u = mean_vg = M2_vg = x
+            else:
+                u = 1/x
+                mean_vg = mean_g/x
+                M2_vg = M2_g/(x*x)
+            mean_u = self.mean_u
+            mean_v = self.mean_v
+            self.history.extend((mean_u, mean_v, self.M2_u, self.M2_v, self.C_xu, self.C_yu, self.C_uv))
+            du = u - mean_u
+            dv = mean_vg - mean_v
+            self.mean_u = mean_u + du*size/n
+            self.mean_v = mean_v + dv*size/n
+            self.M2_u += du*du*n1*size/n
+            self.M2_v += M2_vg + dv*dv*n1*size/n
+            self.C_xu += dx*du*n1*size/n
+            self.C_yu += dy*du*n1*size/n
+            self.C_uv += du*dv*n1*size/n
+        self.x_values.extend([x]*size)
+        self.y_values.extend(y_values)
+        self.groups.append((x, size, mean_g, M2_g))
+
+    def pop_group(self, size: int) -> Group:
+        '''Remove the last size pairs, which must share the same x, and return them as a group (with the y values in
+        their order of removal).'''
+        history = self.history
+        if not history:
+            history = self._rebuild_history()
+        x, group_size, mean_y, M2_y = self.groups.pop()
+        state = history[-self.stride:]
+        del history[-self.stride:]
+        self.mean_x, self.mean_y, self.M2_x, self.M2_y, self.C_xy = state[:5]
+        if self.weighted:
+            self.mean_u, self.mean_v, self.M2_u, self.M2_v, self.C_xu, self.C_yu, self.C_uv = state[5:]
+        y_values = self.y_values[-group_size:]
+        y_values.reverse()
+        del self.x_values[-group_size:]
+        del self.y_values[-group_size:]
+        assert group_size <= size
+        if group_size < size:  # several groups with this x (e.g. pairs added one at a time)
+            other = self.pop_group(size - group_size)
+            assert other.x == x
+            y_values.extend(other.y_values)
+            mean_y, M2_y = self.group_statistics(y_values)
+        return Group(x, y_values, mean_y, M2_y)
+
+    def pop(self) -> Tuple[Number, Number]:
+        '''Remove and return the last pair (x, y) that was added to the collection.'''
+        if not self.history:
+            self._rebuild_history()
+        x, size, _, _ = self.groups[-1]
+        group = self.pop_group(size)
+        if size > 1:  # the other pairs of the group are added back, in their order of addition
+            self.add_group(Group(x, group.y_values[:0:-1], None, None))
+        return x, group.y_values[0]
+
+    def _rebuild_history(self) -> MutableSequence[Any]:
+        '''Compute the states of the statistics before the addition of each group of consecutive pairs sharing the
+        same x, by adding them again one group at a time, and return the new history.'''
+        replay = self.__class__(weighted=self.weighted)
+        for group in self.split_groups(self.x_values, self.y_values):
+            replay.add_group(group)
+        self.history = replay.history
+        self.groups = replay.groups
+        return self.history
+
+    def sort(self, reverse: bool = False) -> None:
+        super().sort(reverse)
+        self.groups = []
+
+    def insert(self, x: Number, y: Number, reverse: bool = False) -> None:
+        super().insert(x, y, reverse)  # type: ignore
+        self.groups = []
+
+
+class MomentsView(Generic[Number]):
+    '''A read-only view of the x (or y) values of a Moments object, with the same interface than IncrementalStat.'''
+
+    def __init__(self, moments: Moments[Number], name: str) -> None:
+        assert name in ('x', 'y')
+        self.moments: Moments[Number] = moments
+        self.name = name
+
+    @property
+    def values(self) -> MutableSequence[Number]:
+        return getattr(self.moments, '%s_values' % self.name)
+
+    def __len__(self) -> int:
+        return len(self.moments)
+
+    def __iter__(self) -> Generator[Number, None, None]:
+        yield from self.values
+
+    def __reviter__(self) -> Generator[Number, None, None]:
+        yield from reversed(self.values)
+
+    @property
+    def last(self) -> Number:
+        '''Return the last element that was added to the collection.'''
+        return self.values[-1]
+
+    @property
+    def first(self) -> Number:
+        '''Return the first element that was added to the collection.'''
+        return self.values[0]
+
+    @property
+    def mean(self) -> Number:
+        '''Return the mean of all the elements of the collection.'''
+        assert len(self) > 0
+        return getattr(self.moments, 'mean_%s' % self.name)
+
+    @property
+    def M2(self) -> Number:
+        '''Return the sum of the squared deviations from the mean.'''
+        return getattr(self.moments, 'M2_%s' % self.name)
+
+    @property
+    def var(self) -> Number:
+        '''Return the variance of all the elements of the collection.'''
+        n = len(self)
+        assert n > 1
+        return self.M2/(n-1)
+
+    @property
+    def std(self) -> float:
+        '''Return the standard deviation of all the elements of the collection.'''
+        return math.sqrt(self.var)
+
+    @property
+    def sum(self) -> Number:
+        '''Return the sum of all the elements of the collection.'''
+        return self.mean*len(self)
+
+
 class AbstractReg(ABC, Generic[Number]):
     '''An abstract class factorizing some common methods of Leaf and Node.
     '''
     config: Config
+    # Trace of the split search that gave this node or leaf (see Node.find_split), None if it was not searched.
+    errors: Union[None, 'Node.Error'] = None
+    # Operations of the fit that gave this regression (see the profile parameter of compute_regression), if profiled.
+    profile: Union[None, Profile] = None
 
     def __repr__(self) -> str:
         return str(self)
@@ -167,7 +812,7 @@ class AbstractReg(ABC, Generic[Number]):
     def rss_equal(self, a: Number, b: Number) -> bool:
         return math.isclose(a, b, abs_tol=self.config.epsilon**2)
 
-    def error_equal(self, a: Number, b: Number) -> bool:
+    def error_equal(self, a: float, b: float) -> bool:
         assert self.config.mode in self.config.allowed_modes
         eps = abs(math.log2(self.config.epsilon**2))
         return math.isclose(a, b, abs_tol=eps)
@@ -185,6 +830,15 @@ class AbstractReg(ABC, Generic[Number]):
     @property
     def error(self) -> float:
         '''Return an error, depending on the chosen mode. Lowest is better.'''
+        profile = self.config.profile
+        if profile is None:
+            return self._error()
+        start = time.perf_counter()
+        error = self._error()
+        profile.add('error %s' % self.config.mode, start)
+        return error
+
+    def _error(self) -> float:
         try:
             if self.config.mode == 'AIC':
                 return self.AIC
@@ -203,6 +857,64 @@ class AbstractReg(ABC, Generic[Number]):
     def predict(self, x: Number) -> Number:
         pass
 
+    @abstractmethod
+    def _leaves(self) -> List['Leaf']:
+        '''Return the leaves of the regression, in increasing order of x.'''
+        pass
+
+    def predict_many(self, xs):
+        '''Return the predictions of y for all the variables x of the given sequence, which can be a list or a numpy
+        array. This is equivalent to calling predict on each x, but the breakpoints and the parameters of the segments
+        are fetched only once, then the segment of each x is found by a binary search in the sorted breakpoints.
+        With a numpy array of numbers, the whole computation is vectorized (with floats) and a numpy array is returned.
+        Segments whose regression is undefined (e.g. too few points) give NaN in the vectorized case and raise the
+        same error than predict otherwise.
+        '''
+        leaves = self._leaves()
+        coeffs, intercepts = [], []
+        for leaf in leaves:
+            try:
+                coeff, intercept = leaf.coeff, leaf.intercept
+            except (AssertionError, ArithmeticError, ValueError):
+                coeff = intercept = None
+            coeffs.append(coeff)
+            intercepts.append(intercept)
+
+        def undefined(i, x):
+            return leaves[i].predict(x)  # raises the error
+        return predict_segments(self.breakpoints, coeffs, intercepts, xs, undefined)
+
+    def update(self, x: Number, y: Number) -> 'AbstractReg[Number]':
+        '''Add the pair (x, y) to the regression, see extend.'''
+        return self.extend([(x, y)])
+
+    def extend(self, points) -> 'AbstractReg[Number]':
+        '''Add the given pairs (x, y) to the regression and return the updated regression, which has to be used instead
+        of this one (e.g. a leaf whose new points justify a split becomes a Node).
+        Each pair is inserted in the leaf of the segment that contains its x. The leaves are updated in place, except
+        those shared with the regressions given by flatify, which are copied first. A split of the tree is kept as long
+        as it still decreases the error compared to a single regression of the points on both sides (computed from the
+        statistics of the leaves, except in log mode), otherwise the subtree is fitted again. The split search of a leaf
+        is run again only if its new points do not follow its regression (see Leaf._extend), so the cost of an update
+        depends on the number of new points and of leaves, not on the size of the dataset.'''
+        x, y = convert_floats([p[0] for p in points], [p[1] for p in points])
+        return self._extend(sorted(zip(x, y)), increasing=True)
+
+    @abstractmethod
+    def _extend(self, points, increasing: bool) -> 'AbstractReg[Number]':
+        '''Add the given sorted pairs (x, y) to this subtree and return the updated subtree. Its points are stored in
+        increasing or decreasing order, depending on its position in the tree (see Node.__init__).'''
+        pass
+
+    def freeze(self) -> 'FrozenRegression':
+        '''Return an immutable and compact version of the regression, see FrozenRegression.'''
+        return FrozenRegression(self.config, self.breakpoints, [leaf.summary() for leaf in self._leaves()],
+                                self.summary())
+
+    def summary(self) -> Summary:
+        '''Return an immutable summary of the regression, which does not hold any reference to the data.'''
+        return Summary(error=self.error, nb_points=len(self), coeff=None, intercept=None, stats=None)
+
     @property
     def MSE(self) -> Number:
         '''Return the mean squared error (MSE) of the linear regression.'''
@@ -213,7 +925,7 @@ class AbstractReg(ABC, Generic[Number]):
             RSS = float(self.RSS)
         except ZeroDivisionError:
             return float('inf')
-        if self.null_RSS:
+        if RSS <= 0 or math.isclose(RSS, 0, abs_tol=self.config.epsilon**2):
             # RSS cannot be null or negative
             RSS = math.ldexp(1.0, -1000)
         return param_penalty + len(self)*math.log(RSS/len(self))
@@ -252,10 +964,16 @@ class AbstractReg(ABC, Generic[Number]):
     def compute_weighted_BIC(self) -> float:
         '''Return a custom error metric based on the weighted RSS.
         Warning: this computation has a O(n) complexity.'''
+        try:
+            return self._weighted_BIC(self.compute_weighted_RSS())
+        except ZeroDivisionError:
+            return float('inf')
+
+    def _weighted_BIC(self, WRSS: ExtNumber) -> float:
+        '''Return the metric of compute_weighted_BIC, given the weighted RSS.'''
         N = len(self)
         try:
             param_penalty = math.log(N) * self.nb_params
-            WRSS = self.compute_weighted_RSS()
             if WRSS <= 0:
                 WRSS = math.ldexp(1., -1000)
             return param_penalty + N*math.log(WRSS/N)
@@ -265,10 +983,17 @@ class AbstractReg(ABC, Generic[Number]):
     def compute_BIClog(self) -> float:
         '''Return a custom error metric which is hopefully better suited to exponential scales.
         Warning: this computation has a O(n) complexity.'''
+        try:
+            return self._BIClog(self.compute_RSSlog())
+        except ZeroDivisionError:
+            return float('inf')
+
+    def _BIClog(self, RSSlog: float) -> float:
+        '''Return the metric of compute_BIClog, given the RSSlog.'''
         try:
             N = len(self)
             param_penalty = math.log(N) * self.nb_params
-            return param_penalty + N*self.compute_RSSlog()
+            return param_penalty + N*RSSlog
         except ZeroDivisionError:
             return float('inf')
 
@@ -362,6 +1087,8 @@ class AbstractReg(ABC, Generic[Number]):
     def plot_error(self, log=False, log_x=False, log_y=False, alpha=1):
         if plt is None:
             raise ImportError('No module named "matplotlib".')
+        if self.errors is None or not self.errors.split:
+            raise ValueError('No split was evaluated for this regression.')
         plt.figure(figsize=(20, 20))
         plt.subplot(2, 1, 1)
         x = []
@@ -388,12 +1115,8 @@ class AbstractReg(ABC, Generic[Number]):
         pass
 
     def flatify(self):
-        all_x = []
-        all_y = []
-        for x, y in self:
-            all_x.append(x)
-            all_y.append(y)
-        return FlatRegression(all_x, all_y, config=self.config, breakpoints=self.breakpoints)
+        '''Return a FlatRegression with the same segments. The leaves are shared, not copied.'''
+        return FlatRegression.from_leaves(self._leaves(), self.breakpoints)
 
     def simplify(self, RSSlog=False):
         return self.flatify().simplify(RSSlog=RSSlog)
@@ -428,23 +1151,42 @@ class Leaf(AbstractReg[Number]):
     Several aggregated values can be obtained in constant time (e.g. covariance, coefficient and intercept
     of the linear regression).
     '''
+    moments_class: type = Moments
+    search_growth = 0.1  # relative size of the tail of a leaf after which extend searches its split again anyway
 
     def __init__(self, x: List[Number], y: List[Number], config: Config) -> None:
         assert len(x) == len(y)
-        self.config = config
-        self.__modified = True
-        self.x: IncrementalStat[Number] = IncrementalStat()
-        self.y: IncrementalStat[Number] = IncrementalStat()
-        self.counter_x: Dict[Number, int] = Counter()
-        self.cov_sum: IncrementalStat[Number] = IncrementalStat()
-        self.xy: IncrementalStat[Number] = IncrementalStat()
-        self.x2: IncrementalStat[Number] = IncrementalStat(lambda x: x*x)
-        self.y2: IncrementalStat[Number] = IncrementalStat(lambda x: x*x)
+        # The weighted regression (weights 1/x) needs the statistics of u = 1/x and v = y/x.
+        self.__setup(config, self.moments_class(weighted=config.mode == 'weighted'))
+        self.__counter_x: Union[None, Dict[Number, int]] = Counter()
         for xx, yy in zip(x, y):
             self.add(xx, yy)
 
+    def __setup(self, config: Config, stats: Moments[Number]) -> None:
+        if config.profile is not None:
+            config.profile.count('leaf')
+        self.config = config
+        self.__modified = True
+        self.__log_start: Union[None, Tuple[float, float]] = None
+        self.__counter_x = None  # built on the first access, see counter_x
+        self.shared = False  # see FlatRegression.from_leaves
+        # pairs added by extend since the last split search, and statistics of the leaf before them, see _extend
+        self.tail: Union[None, Leaf[Number]] = None
+        self.base: Union[None, Leaf[Number]] = None
+        self.stats: Moments[Number] = stats
+        self.x: MomentsView[Number] = MomentsView(self.stats, 'x')
+        self.y: MomentsView[Number] = MomentsView(self.stats, 'y')
+
+    @property
+    def counter_x(self) -> Dict[Number, int]:
+        '''Return the number of pairs of each x value. A leaf obtained with __add__ has no counter yet, it is built from
+        the pairs (in O(n)) on its first access.'''
+        if self.__counter_x is None:
+            self.__counter_x = Counter(self.stats.x_values)
+        return self.__counter_x
+
     def __len__(self) -> int:
-        return len(self.x)
+        return len(self.stats)
 
     def __str__(self) -> str:
         if len(self) <= 1:
@@ -455,21 +1197,32 @@ class Leaf(AbstractReg[Number]):
         dot.node(str(id(self)), str(self))
 
     def __iter__(self) -> Generator[Tuple[Number, Number], None, None]:
-        yield from zip(self.x, self.y)
+        yield from self.stats
 
     def __reviter__(self) -> Generator[Tuple[Number, Number], None, None]:
-        yield from zip(self.x.__reviter__(), self.y.__reviter__())
+        yield from self.stats.__reviter__()
+
+    def _order(self) -> int:
+        '''Return -1 if the pairs (x, y) were added in decreasing order (e.g. the right leaf of a Node), 1 otherwise.'''
+        if len(self) > 0 and (self.x.first, self.y.first) > (self.x.last, self.y.last):
+            return -1
+        return 1
+
+    def sorted_iter(self) -> Generator[Tuple[Number, Number], None, None]:
+        '''Iterate over the pairs (x, y) in increasing order, assuming that they were added either in increasing or in
+        decreasing order (e.g. the right leaf of a Node).'''
+        if self._order() < 0:
+            yield from self.__reviter__()
+        else:
+            yield from self
 
     def __add__(self, other):
-        x1 = self.x.values
-        y1 = self.y.values
-        x2 = other.x.values
-        y2 = other.y.values
-        if x2[0] > x2[-1]:
-            assert y2[0] > y2[-1]
-            x2 = list(reversed(x2))
-            y2 = list(reversed(y2))
-        return self.__class__(x1+x2, y1+y2, config=self.config)
+        '''Return a new leaf holding the pairs of self followed by the pairs of other, each one in increasing order.
+        The statistics are combined in constant time (see Moments.combine), the counter of the x values is built only
+        when it is needed.'''
+        leaf = self.__class__.__new__(self.__class__)
+        leaf.__setup(self.config, self.stats.combine(other.stats, self._order(), other._order()))
+        return leaf
 
     @property
     def first(self) -> Number:
@@ -505,7 +1258,8 @@ class Leaf(AbstractReg[Number]):
     def cov(self) -> Number:
         '''Return the covariance between the elements x and the elements y.'''
         n = len(self)
-        return self.cov_sum.mean * n / (n-1)
+        assert n > 1
+        return self.stats.C_xy / (n-1)
 
     @property
     def corr(self) -> float:
@@ -513,8 +1267,8 @@ class Leaf(AbstractReg[Number]):
 
         See https://en.wikipedia.org/wiki/Pearson_correlation_coefficient#For_a_sample
         '''
-        n = len(self)
-        return float(self.xy.sum - n * self.mean_x * self.mean_y) / ((n - 1) * self.std_x * self.std_y)
+        assert len(self) > 1
+        return float(self.stats.C_xy) / math.sqrt(self.stats.M2_x * self.stats.M2_y)
 
     def _compute_weighted_parameters(self, weights):
         '''Return the tuple (intercept, coefficient) of the linear regression with the given weights.
@@ -541,11 +1295,44 @@ class Leaf(AbstractReg[Number]):
         return coeff, intercept
 
     def compute_weighted_parameters(self):
-        if self.__modified:
-            weights = [1/x for x in self.x]
-            self.__wcoeff, self.__wintercept = self._compute_weighted_parameters(weights)
-            self.__modified = False
-        return self.__wcoeff, self.__wintercept
+        '''Return the tuple (coefficient, intercept) of the linear regression with the weights 1/x.
+        This is the same regression than _compute_weighted_parameters, but it is computed in constant time from the
+        incrementally maintained statistics.
+        With u = 1/x and v = y/x, the weighted means of x and y are 1/mean(u) and mean(v)/mean(u), the coefficient is
+        cov(y, u)/cov(x, u) and the intercept is (mean(v) - coefficient)/mean(u).
+        '''
+        if len(self) <= 1 or 0 in self.counter_x:
+            raise ZeroDivisionError
+        coeff = self.stats.C_yu / self.stats.C_xu
+        intercept = (self.stats.mean_v - coeff) / self.stats.mean_u
+        return coeff, intercept
+
+    def compute_weighted_RSS(self) -> ExtNumber:
+        '''Return the *weighted* residual sum of squares.
+        In weighted mode, this is done in constant time: with u = 1/x and v = y/x, each weighted residual (y-αx-β)/x is
+        equal to v-α-βu, so the sum of their squares can be obtained from the means and co-moments of u and v.'''
+        n = len(self)
+        if n == 0:
+            return 0
+        if self.config.mode != 'weighted':  # O(n), but the parameters are computed only once
+            coeff = self.coeff
+            intercept = self.intercept
+            return sum([((y - (coeff*x + intercept))/x)**2 for x, y in self])
+        coeff, intercept = self.compute_weighted_parameters()
+        stats = self.stats
+        mean_residual = stats.mean_v - coeff - intercept*stats.mean_u
+        return stats.M2_v - 2*intercept*stats.C_uv + intercept**2*stats.M2_u + n*mean_residual**2
+
+    def compute_RSSlog(self) -> float:
+        '''Warning: this computation has O(n) complexity.'''
+        if len(self) == 0:
+            return 0
+        coeff = self.coeff
+        intercept = self.intercept
+        try:
+            return sum([(math.log(y) - math.log(coeff*x + intercept))**2 for x, y in self])
+        except ValueError:
+            return float('inf')
 
     def _compute_log_parameters(self, start_coeff=10, start_intercept=10, eps=1e-12,
                                 max_iter=1000, return_search=False,
@@ -600,6 +1387,7 @@ class Leaf(AbstractReg[Number]):
         intercept = start_intercept
         error = function(coeff, intercept, x_val, y_val)
         i = 0
+        nb_steps = 0  # evaluations of the derivative made by the line searches
         if return_search:
             search_list = []
             search_list.append({'coefficient': coeff, 'intercept': intercept, 'error': error, 'index': i})
@@ -619,6 +1407,7 @@ class Leaf(AbstractReg[Number]):
             # First, we search for the upper bound of our binary search with an exponential increase.
             step = 1.
             while True:
+                nb_steps += 1
                 delta_coeff = D_coefficient*step
                 delta_int = D_intercept*step
                 try:
@@ -638,6 +1427,7 @@ class Leaf(AbstractReg[Number]):
                 step = (interval[0] + interval[1])/2
                 if step == interval[0] or step == interval[1]:
                     break
+                nb_steps += 1
                 delta_coeff = D_coefficient*step
                 delta_int = D_intercept*step
                 try:
@@ -672,21 +1462,144 @@ class Leaf(AbstractReg[Number]):
                                     'index': i,
                                     'final_step': step, 'D': D, 'new_D': new_D,
                                     'D_coeff': D_coefficient, 'D_inter': D_intercept})
+        if self.config.profile is not None:
+            self.config.profile.count('log iterations', i)
+            self.config.profile.count('log line search steps', nb_steps)
+        if return_search:
+            return pandas.DataFrame(search_list)
+        return coeff, intercept
+
+    def _compute_log_parameters_lm(self, start_coeff=10, start_intercept=10, eps=1e-6, max_iter=100,
+                                   return_search=False,
+                                   forbid_negative_intercept=True, forbid_negative_coefficient=True):
+        '''Return the tuple (coefficient, intercept) of the linear regression where the error function is logarithmic
+        (i.e. we use the BIClog and RSSlog functions instead of BIC and RSS).
+        This is a non-linear least squares problem with only two parameters, solved with the Levenberg-Marquardt
+        algorithm, which converges in a few iterations instead of hundreds for the gradient descent.
+        The iterations stop when the relative decrease of RSSlog or the relative length of the step is below eps.
+        Warning: O(Kn) complexity, with K small.
+        See https://en.wikipedia.org/wiki/Levenberg%E2%80%93Marquardt_algorithm
+        '''
+        if numpy is None:
+            raise ImportError('No module named "numpy".')
+        if len(self) <= 1:
+            raise ZeroDivisionError
+
+        def feasible(coeff, intercept):
+            return not ((forbid_negative_intercept and intercept <= 0) or (forbid_negative_coefficient and coeff <= 0))
+
+        def function(coeff, intercept, x, log_y):
+            '''Compute the value of RSSlog in the given point.'''
+            if not feasible(coeff, intercept):
+                return float('inf')
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                error = ((log_y - numpy.log(x*coeff+intercept))**2).sum()
+            return float('inf') if numpy.isnan(error) else error
+
+        x_val = numpy.array([float(x) for x in self.x])
+        log_y = numpy.log(numpy.array([float(y) for y in self.y]))
+        coeff = float(start_coeff)
+        intercept = float(start_intercept)
+        error = function(coeff, intercept, x_val, log_y)
+        damping = 1e-3
+        i = 0
+        nb_steps = 0  # evaluations of the error made by the adjustments of the damping
+        if return_search:
+            search_list = []
+            search_list.append({'coefficient': coeff, 'intercept': intercept, 'error': error, 'index': i,
+                                'damping': damping})
+        while i < max_iter and error < float('inf'):
+            i += 1
+            # The residuals are r = log(y) - log(pred), their derivatives are -x/pred and -1/pred.
+            inv_pred = 1/(x_val*coeff + intercept)
+            residuals = log_y + numpy.log(inv_pred)
+            J_coeff = x_val*inv_pred
+            J_intercept = inv_pred
+            A11 = (J_coeff**2).sum()
+            A12 = (J_coeff*J_intercept).sum()
+            A22 = (J_intercept**2).sum()
+            g1 = (J_coeff*residuals).sum()
+            g2 = (J_intercept*residuals).sum()
+            if A11 <= 0 or A22 <= 0:
+                break
+            # Scaling the system by the diagonal of JᵀJ (Marquardt's variant), to cope with the very different
+            # magnitudes of the coefficient and the intercept.
+            s1 = math.sqrt(A11)
+            s2 = math.sqrt(A22)
+            B12 = A12/(s1*s2)
+            h1 = g1/s1
+            h2 = g2/s2
+            while True:
+                nb_steps += 1
+                det = (1+damping)**2 - B12**2
+                if det <= 0:
+                    damping *= 10
+                    continue
+                delta_coeff = ((1+damping)*h1 - B12*h2)/det/s1
+                delta_int = ((1+damping)*h2 - B12*h1)/det/s2
+                # Positivity constraints: keep the direction, but stop half-way to the boundary.
+                scale = 1.
+                if forbid_negative_coefficient and coeff + delta_coeff <= 0:
+                    scale = min(scale, coeff/(-delta_coeff)/2)
+                if forbid_negative_intercept and intercept + delta_int <= 0:
+                    scale = min(scale, intercept/(-delta_int)/2)
+                new_coeff = coeff + delta_coeff*scale
+                new_intercept = intercept + delta_int*scale
+                new_error = function(new_coeff, new_intercept, x_val, log_y)
+                if new_error <= error or damping > 1e16:
+                    break
+                damping *= 10
+            if new_error > error:  # no descent direction could be found, we are at the minimum
+                break
+            step = max(abs(new_coeff-coeff)/abs(new_coeff), abs(new_intercept-intercept)/abs(new_intercept))
+            decrease = error - new_error
+            coeff, intercept, error = new_coeff, new_intercept, new_error
+            damping = max(damping/10, 1e-12)
+            if return_search:
+                search_list.append({'coefficient': coeff, 'intercept': intercept, 'error': error, 'index': i,
+                                    'damping': damping})
+            if decrease <= eps*error or step <= eps:
+                break
+        if self.config.profile is not None:
+            self.config.profile.count('log iterations', i)
+            self.config.profile.count('log line search steps', nb_steps)
         if return_search:
             return pandas.DataFrame(search_list)
         return coeff, intercept
 
     def compute_log_parameters(self):
+        '''Return the tuple (coefficient, intercept) of the linear regression for the log mode.
+        With the Levenberg-Marquardt solver, the search starts from the last parameters computed for this leaf, if any.
+        When the leaf is modified by a few points at a time (e.g. during the split search of Node.compute_best_fit),
+        they are close to the new optimum, so one or two iterations are enough. The gradient descent always starts from
+        the parameters of the classical linear regression: its stopping criterion is too loose for a warm start, the
+        parameters would drift away from the optimum over successive calls.'''
         if self.__modified:
-            self.__lcoeff, self.__lintercept = self._compute_log_parameters(
-                    start_coeff=max(1e-300, abs(self._compute_classical_coeff())),
-                    start_intercept=max(1e-300, abs(self._compute_classical_intercept())),
-                    eps=1e-3)
+            profile = self.config.profile
+            if profile is not None:
+                start = time.perf_counter()
+            if self.config.log_solver == 'lm':
+                if self.__log_start is not None:
+                    start_coeff, start_intercept = self.__log_start
+                else:
+                    start_coeff = max(1e-300, abs(self._compute_classical_coeff()))
+                    start_intercept = max(1e-300, abs(self._compute_classical_intercept()))
+                self.__lcoeff, self.__lintercept = self._compute_log_parameters_lm(
+                        start_coeff=start_coeff, start_intercept=start_intercept, eps=1e-4)
+                self.__log_start = self.__lcoeff, self.__lintercept
+            else:
+                self.__lcoeff, self.__lintercept = self._compute_log_parameters(
+                        start_coeff=max(1e-300, abs(self._compute_classical_coeff())),
+                        start_intercept=max(1e-300, abs(self._compute_classical_intercept())),
+                        eps=1e-3)
+            if profile is not None:
+                profile.add('log parameters', start)
             self.__modified = False
         return self.__lcoeff, self.__lintercept
 
     def _compute_classical_coeff(self):
-        return self.cov / self.x.var
+        assert len(self) > 1
+        return self.stats.C_xy / self.stats.M2_x
 
     def _compute_classical_intercept(self):
         return self.mean_y - self._compute_classical_coeff()*self.mean_x
@@ -724,7 +1637,9 @@ class Leaf(AbstractReg[Number]):
     def MSE(self) -> Number:
         '''Return the mean squared error (MSE) of the linear regression.'''
         n = len(self)
-        return self.y.var * (n-1) / n - (self.cov * (n-1) / n)**2 / (self.x.var * (n-1) / n)
+        assert n > 1
+        stats = self.stats
+        return (stats.M2_y - stats.C_xy**2 / stats.M2_x) / n
 
     @property
     def nb_params(self) -> int:
@@ -744,34 +1659,107 @@ class Leaf(AbstractReg[Number]):
     def predict_statsmodels(self, x):
         return self.statsmodels_coeff*x + self.statsmodels_intercept
 
+    def _leaves(self) -> List['Leaf']:
+        return [self]
+
     def add(self, x: Number, y: Number) -> None:
         '''Add the pair (x, y) to the collection.'''
         self.__modified = True
-        if len(self) == 0:
-            dx = x
-        else:
-            dx = x - self.mean_x
-        self.x.add(x)
+        self.stats.add(x, y)
         self.counter_x[x] += 1
-        self.y.add(y)
-        self.xy.add(x*y)
-        self.x2.add(x)
-        self.y2.add(y)
-        # For the covariance, see https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Online.
-        self.cov_sum.add(dx*(y - self.mean_y))
 
     def pop(self) -> Tuple[Number, Number]:
         '''Remove and return the last pair (x, y) that was added to the collection.'''
         self.__modified = True
-        self.cov_sum.pop()
-        self.xy.pop()
-        self.x2.pop()
-        self.y2.pop()
-        x = self.x.pop()
+        x, y = self.stats.pop()
         self.counter_x[x] -= 1
         if self.counter_x[x] == 0:
             del self.counter_x[x]
-        return x, self.y.pop()
+        return x, y
+
+    def add_group(self, group: Group) -> None:
+        '''Add the pairs (group.x, y) for all the y of the group, in this order.'''
+        self.__modified = True
+        self.stats.add_group(group)
+        self.counter_x[group.x] += len(group.y_values)
+
+    def pop_group(self) -> Group:
+        '''Remove and return the last set of pairs sharing the same x (see pop_all), as a group.'''
+        self.__modified = True
+        return self.stats.pop_group(self.counter_x.pop(self.stats.x_values[-1]))
+
+    def move_group(self, other: 'Leaf[Number]') -> None:
+        '''Move the last set of pairs sharing the same x (see pop_all) to the other leaf.'''
+        for x, y in self.pop_all():
+            other.add(x, y)
+
+    def _insert(self, points) -> 'Leaf[Number]':
+        '''Insert the given pairs at their positions in the pairs of the leaf, keeping their order (see _order and
+        Moments.insert), and return the leaf. A FloatLeaf receiving other values than floats is replaced by a Leaf.'''
+        x = [p[0] for p in points]
+        y = [p[1] for p in points]
+        reverse = self._order() < 0
+        if self.__class__ is not leaf_class(x, y) and self.__class__ is FloatLeaf:  # not only floats anymore
+            pairs = sorted(itertools.chain(self, points), reverse=reverse)
+            return Leaf([p[0] for p in pairs], [p[1] for p in pairs], config=self.config)
+        self.__modified = True
+        counter_x = self.__counter_x
+        for xx, yy in points:
+            self.stats.insert(xx, yy, reverse)
+            if counter_x is not None:
+                counter_x[xx] += 1
+        return self
+
+    def _copy(self) -> 'Leaf[Number]':
+        '''Return a copy of the leaf, holding the same pairs in the same order (see Moments.combine).'''
+        leaf = self.__class__.__new__(self.__class__)
+        leaf.__setup(self.config, self.stats.combine(self.stats.__class__(weighted=self.stats.weighted)))
+        return leaf
+
+    def _unshared(self) -> 'Leaf[Number]':
+        '''Return the leaf, or a copy of it if it is shared with another regression (see FlatRegression.from_leaves),
+        so that the result can be modified in place without changing the other regression.'''
+        if not self.shared:
+            return self
+        leaf = self._copy()
+        if self.tail is not None:
+            leaf.tail, leaf.base = self.tail._copy(), self.base
+        return leaf
+
+    def _extend(self, points, increasing: bool) -> AbstractReg[Number]:
+        '''The pairs are inserted in the leaf and added to its tail, which holds the pairs added since its last split
+        search. The split is searched again as soon as two regressions, one of the tail and one of the pairs of the
+        leaf before it (its base), decrease the error compared to a single regression (see Node._split_decreases_error),
+        i.e. as soon as the new pairs do not follow the regression of the leaf (e.g. a new regime). The base is kept as
+        statistics (see StatisticsLeaf), so this check takes a constant time, except in log mode where it needs the
+        pairs. A few pairs that the check cannot tell apart from the tail (e.g. the pairs of the next segment close to
+        the breakpoint) are handled by searching the leaf again anyway once the tail has grown by search_growth, which
+        amortizes the cost of the searches over the added pairs.'''
+        leaf = self._unshared()
+        tail, base = leaf.tail, leaf.base
+        if tail is None:
+            tail = Leaf([], [], config=self.config)
+            base = None if self.config.mode == 'log' else StatisticsLeaf([leaf])
+        for x, y in points:
+            tail.add(x, y)
+        leaf = leaf._insert(points)  # may be a new leaf, see _insert
+        leaf.tail, leaf.base = tail, base
+        if base is None:  # log mode, the base is the leaf without the pairs of its tail
+            remaining = Counter(tail)
+            pairs = []
+            for pair in leaf:
+                if remaining[pair] > 0:
+                    remaining[pair] -= 1
+                else:
+                    pairs.append(pair)
+            base = Leaf([p[0] for p in pairs], [p[1] for p in pairs], config=self.config)
+        if len(tail) < self.search_growth*len(leaf) and base.error < float('inf') and \
+                not Node._split_decreases_error(base, tail):
+            return leaf
+        leaf.tail = leaf.base = None
+        empty = leaf.__class__([], [], config=self.config)
+        node = Node(leaf, empty) if leaf._order() > 0 else Node(empty, leaf)
+        return node.compute_best_fit()
 
     def pop_all(self) -> List[Tuple[Number, Number]]:
         '''Remove and return the last set of pairs (x_i, y_i) such that all x_i are equal and there is no more point in
@@ -792,6 +1780,30 @@ class Leaf(AbstractReg[Number]):
     def merge(self):
         return self  # nothing to do, already a single line
 
+    def sufficient_statistics(self) -> Union[None, Tuple[int, Number, Number, Number, Number, Number]]:
+        '''Return the tuple (n, mean_x, mean_y, M2_x, M2_y, C_xy) of the sufficient statistics of the leaf (see
+        Summary), or None if the leaf is empty.'''
+        n = len(self)
+        if n == 0:
+            return None
+        stats = self.stats
+        return (n, stats.mean_x, stats.mean_y, stats.M2_x, stats.M2_y, stats.C_xy)
+
+    def summary(self) -> Summary:
+        '''Return an immutable summary of the leaf: its error, the parameters of its regression and its sufficient
+        statistics. Unlike the leaf, it does not hold any reference to the data.'''
+        n = len(self)
+        coeff: Union[None, Number]
+        intercept: Union[None, Number]
+        try:
+            coeff, intercept = self.coeff, self.intercept
+        except (AssertionError, ArithmeticError, ValueError):
+            coeff = intercept = None
+        if n == 0:
+            return Summary(error=float('inf'), nb_points=0, coeff=None, intercept=None, stats=None)
+        return Summary(error=self.error, nb_points=n, coeff=coeff, intercept=intercept,
+                       stats=self.sufficient_statistics())
+
     def compute_statsmodels_reg(self) -> None:
         self.statsmodels_reg = statsmodels.ols(
             formula='y~x', data={'x': [float(x) for x in self.x.values],
@@ -807,9 +1819,127 @@ class Leaf(AbstractReg[Number]):
         return self.statsmodels_reg.ssr
 
 
+class FloatLeaf(Leaf[float]):
+    '''Specialization of Leaf for floats, used by compute_regression when all the values are floats. The statistics are
+    maintained by FloatMoments and the RSS is computed without the indirections of the generic implementation, but
+    with the same operations: the results are identical to those of a Leaf holding the same floats.
+    All the values must be floats. The generic Leaf remains the one to use for Fraction or Decimal values.'''
+    moments_class = FloatMoments
+
+    def __len__(self) -> int:
+        return len(self.stats.x_values)
+
+    @property
+    def RSS(self) -> float:
+        '''Return the residual sum of squares (RSS) of the linear regression y = αx + β.'''
+        stats = self.stats
+        n = len(stats.x_values)
+        assert n > 1
+        return (stats.M2_y - stats.C_xy**2 / stats.M2_x) / n * n  # same as MSE*n
+
+
+class GroupedLeaf(Leaf[Number]):
+    '''Variant of Leaf for datasets where each x is repeated many times (e.g. several measures for each message size).
+    The pairs sharing the same x are collapsed into groups when the leaf is created, and the groups are moved between
+    the leaves of a Node in constant time (see GroupedMoments), so the split search depends on the number of distinct x
+    values instead of the number of pairs. The statistics are those of the pairs, only computed in a different order:
+    the regressions are the same than with Leaf (exactly for Fraction values, up to rounding errors for floats).'''
+    moments_class = GroupedMoments
+
+    def __init__(self, x: List[Number], y: List[Number], config: Config) -> None:
+        assert len(x) == len(y)
+        super().__init__([], [], config=config)
+        for group in GroupedMoments.split_groups(x, y):
+            self.add_group(group)
+
+    def move_group(self, other: Leaf[Number]) -> None:
+        '''Move the last group of pairs sharing the same x to the other leaf, in constant time.'''
+        other.add_group(self.pop_group())
+
+
+class StatisticsLeaf(Leaf[Number]):
+    '''Leaf holding the statistics of the pairs of several leaves, but not the pairs themselves, to compute the error of
+    a single regression of all these pairs in constant time per leaf (see Node._split_pays_off). Only this error is
+    meant to be used (except in log mode, which needs the pairs), most of the other methods need the pairs.'''
+
+    def __init__(self, leaves: List[Leaf[Number]]) -> None:
+        config = leaves[0].config
+        super().__init__([], [], config=config)
+        self.nb_pairs = 0
+        self.has_zero = False  # the weighted regression is undefined with x = 0, see compute_weighted_parameters
+        for leaf in leaves:
+            self.stats.merge_statistics(leaf.stats, self.nb_pairs, len(leaf))
+            self.nb_pairs += len(leaf)
+            if config.mode == 'weighted' and not self.has_zero:
+                self.has_zero = leaf.has_zero if isinstance(leaf, StatisticsLeaf) else 0 in leaf.counter_x
+
+    def __len__(self) -> int:
+        return self.nb_pairs
+
+    def compute_weighted_parameters(self):
+        if self.has_zero:
+            raise ZeroDivisionError
+        return super().compute_weighted_parameters()
+
+
+def convert_floats(x: List[Any], y: List[Any]) -> Tuple[List[Any], List[Any]]:
+    '''Return the given values converted to floats if they are all floats or integers exactly representable as floats
+    (so that the specialized FloatLeaf can be used), unchanged otherwise.'''
+    if all(isinstance(val, float) or (isinstance(val, int) and float(val) == val) for val in itertools.chain(x, y)):
+        return [float(xx) for xx in x], [float(yy) for yy in y]
+    return x, y
+
+
+def leaf_class(x: List[Number], y: List[Number], config: Union[None, Config] = None) -> type:
+    '''Return the class of leaves to use for the given values: GroupedLeaf if the configuration aggregates the pairs
+    sharing the same x, otherwise FloatLeaf if they are all floats, Leaf otherwise.'''
+    if config is not None and config.aggregate:
+        return GroupedLeaf
+    if all(val.__class__ is float for val in itertools.chain(x, y)):
+        return FloatLeaf
+    return Leaf
+
+
+class SearchQueue:
+    '''Priority queue of the nodes whose split has to be searched, used to build the tree without recursion (see
+    Node.compute_best_fit). Each node comes with the parent and the side where the result of its search goes, and with
+    its path from the root (0 for the left side, 1 for the right side). The nodes are popped in the given order:
+        - 'depth': depth-first, left side first (i.e. the order of a recursive search),
+        - 'breadth': level by level, from left to right,
+        - 'largest': the nodes with the most points first (then in breadth-first order).
+    '''
+
+    def __init__(self, order: str) -> None:
+        assert order in Config.allowed_orders
+        self.order = order
+        self.heap: List[Tuple[Any, ...]] = []
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def push(self, node: 'Node', parent: Union[None, 'Node'], side: Union[None, str], path: Tuple[int, ...]) -> None:
+        if self.order == 'depth':
+            key: Tuple[Any, ...] = path  # the lexicographic order of the paths is the preorder
+        elif self.order == 'breadth':
+            key = (len(path), path)
+        else:
+            key = (-len(node), len(path), path)
+        # the paths are unique, the nodes are never compared
+        heapq.heappush(self.heap, (key, node, parent, side, path))
+
+    def pop(self) -> Tuple['Node', Union[None, 'Node'], Union[None, str], Tuple[int, ...]]:
+        return heapq.heappop(self.heap)[1:]
+
+    def __iter__(self) -> Generator[Tuple['Node', Union[None, 'Node'], Union[None, str], Tuple[int, ...]], None, None]:
+        '''Iterate over the nodes of the queue in the order in which they would be popped, without removing them.'''
+        for entry in sorted(self.heap):
+            yield entry[1:]
+
+
 class Node(AbstractReg[Number]):
     STR_LJUST = 30
     Error = namedtuple('Error', ['nosplit', 'split', 'minsplit'])
+    Error.__qualname__ = 'Node.Error'  # needed to pickle the fitted regressions
 
     def __init__(self, left_node: AbstractReg, right_node: AbstractReg, *, no_check: bool = False) -> None:
         '''Assumptions:
@@ -822,87 +1952,163 @@ class Node(AbstractReg[Number]):
         self.right = right_node
         assert self.left.config == self.right.config
         self.config = self.left.config
+        if self.config.profile is not None:
+            self.config.profile.count('node')
         if len(self.right) == 0:
-            self.nosplit = deepcopy(self.left)
+            self.nosplit = self.left.summary()
             self.left_to_right = True
         else:
             assert no_check or len(self.left) == 0
-            self.nosplit = deepcopy(self.right)
+            self.nosplit = self.right.summary()
             self.left_to_right = False
 
+    # The methods walking through the tree are iterative, so that they work with trees of any depth (see
+    # compute_best_fit). The sums over the leaves are done from left to right.
+
+    def __copy__(self) -> 'Node[Number]':
+        node = self.__class__.__new__(self.__class__)
+        node.__dict__.update(self.__dict__)
+        return node
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # pickle and deepcopy would recurse through the nested nodes: the state of a node holds the states of all the
+        # nodes of its subtree (without their children) and its leaves, in a flat list in pre-order
+        tree: List[Any] = []
+        stack: List[AbstractReg] = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Node):
+                state = dict(node.__dict__)
+                del state['left'], state['right']
+                tree.append(state)
+                stack.append(node.right)
+                stack.append(node.left)
+            else:
+                tree.append(node)
+        return {'tree': tree}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        tree = iter(state['tree'])
+        self.__dict__.update(next(tree))
+        sides: List[Tuple[Node, str]] = [(self, 'right'), (self, 'left')]  # the sides to fill, in pre-order
+        for item in tree:
+            parent, side = sides.pop()
+            if isinstance(item, dict):
+                node = Node.__new__(Node)
+                node.__dict__.update(item)
+                sides.append((node, 'right'))
+                sides.append((node, 'left'))
+                item = node
+            setattr(parent, side, item)
+
     def __len__(self) -> int:
-        return len(self.left) + len(self.right)
+        if isinstance(self.left, Leaf) and isinstance(self.right, Leaf):  # during the search of a split
+            return len(self.left) + len(self.right)
+        return sum(len(leaf) for leaf in self._leaves())
 
     def __iter__(self) -> Generator[Tuple[Number, Number], None, None]:
-        if isinstance(self.right, Leaf):
-            yield from itertools.chain(self.left, self.right.__reviter__())
-        else:
-            yield from itertools.chain(self.left, self.right)
+        # the leaves on the right side of their parent hold their elements in decreasing order
+        stack: List[Tuple[AbstractReg, bool]] = [(self, False)]
+        while stack:
+            node, is_right = stack.pop()
+            if isinstance(node, Node):
+                stack.append((node.right, True))
+                stack.append((node.left, False))
+            else:
+                assert isinstance(node, Leaf)
+                yield from node.__reviter__() if is_right else node
 
     @property
     def min(self) -> Number:
         '''Return the smallest element of the node (if the assumptions are satisfied.)'''
-        if isinstance(self.left, Node):
-            return self.left.min
-        elif isinstance(self.left, Leaf):
-            return self.left.first
-        else:
+        node = self.left
+        while isinstance(node, Node):
+            node = node.left
+        if not isinstance(node, Leaf):
             raise ValueError()
+        return node.first
 
     @property
     def max(self) -> Number:
         '''Return the largest element of the node (if the assumptions are satisfied.)'''
-        if isinstance(self.right, Node):
-            return self.right.max
-        elif isinstance(self.right, Leaf):
-            return self.right.first
-        else:
+        node = self.right
+        while isinstance(node, Node):
+            node = node.right
+        if not isinstance(node, Leaf):
             raise ValueError()
+        return node.first
 
     @property
     def RSS(self) -> Number:
         '''Return the residual sum of squares (RSS) of the segmented linear regression.'''
-        return self.left.RSS + self.right.RSS
+        leaves = self._leaves()
+        rss = leaves[0].RSS
+        for leaf in leaves[1:]:
+            rss += leaf.RSS
+        return rss
+
+    def compute_weighted_RSS(self) -> ExtNumber:
+        '''Return the *weighted* residual sum of squares of the segmented linear regression.'''
+        return sum(leaf.compute_weighted_RSS() for leaf in self._leaves())
+
+    def compute_RSSlog(self) -> float:
+        '''Warning: this computation has O(n) complexity.'''
+        return sum(leaf.compute_RSSlog() for leaf in self._leaves())
 
     def compute_statsmodels_reg(self):
-        self.left.compute_statsmodels_reg()
-        self.right.compute_statsmodels_reg()
+        for leaf in self._leaves():
+            leaf.compute_statsmodels_reg()
 
     def compute_statsmodels_RSS(self):
-        return self.left.compute_statsmodels_RSS() + self.right.compute_statsmodels_RSS()
+        return sum(leaf.compute_statsmodels_RSS() for leaf in self._leaves())
 
     @property
     def nb_params(self) -> int:
         '''Return the number of parameters of the model.'''
-        return self.left.nb_params + self.right.nb_params + 1  # one additional parameter: the breakpoint
+        leaves = self._leaves()
+        # one additional parameter for each breakpoint
+        return sum(leaf.nb_params for leaf in leaves) + len(leaves) - 1
 
     def move_left_to_right(self) -> None:
         '''Move the last element(s) of the left node to the right node.'''
         assert isinstance(self.left, Leaf)
         assert isinstance(self.right, Leaf)
-        for x, y in self.left.pop_all():
-            self.right.add(x, y)
+        self.left.move_group(self.right)
 
     def move_right_to_left(self) -> None:
         '''Move the last element(s) of the right node to the left node.'''
         assert isinstance(self.left, Leaf)
         assert isinstance(self.right, Leaf)
-        for x, y in self.right.pop_all():
-            self.left.add(x, y)
+        self.right.move_group(self.left)
 
     def move_forward(self) -> None:
         '''Move element(s) from the node that was full at instantiation to the node that was empty at instantiation.'''
+        profile = self.config.profile
+        if profile is not None:
+            start, size = time.perf_counter(), len(self.left)
         if self.left_to_right:
             self.move_left_to_right()
         else:
             self.move_right_to_left()
+        if profile is not None:
+            self._profile_move(profile, start, size)
 
     def move_backward(self) -> None:
         '''Move element(s) from the node that was empty at instantiation to the node that was full at instantiation.'''
+        profile = self.config.profile
+        if profile is not None:
+            start, size = time.perf_counter(), len(self.left)
         if self.left_to_right:
             self.move_right_to_left()
         else:
             self.move_left_to_right()
+        if profile is not None:
+            self._profile_move(profile, start, size)
+
+    def _profile_move(self, profile: Profile, start: float, size: int) -> None:
+        '''Count a move that started at the given time, when the left leaf had the given size.'''
+        profile.add('move', start)
+        profile.count('points moved', abs(len(self.left) - size))
 
     @property
     def can_move(self) -> bool:
@@ -923,28 +2129,22 @@ class Node(AbstractReg[Number]):
             assert isinstance(self.left, Leaf)
             return self.left.last
 
-    @staticmethod
-    def tabulate(string: str, pad: str = '    ', except_first: bool = False) -> str:
-        '''Used for the string representation.'''
-        substrings = string.split('\n')
-        for i, s in enumerate(substrings):
-            if i > 0 or not except_first:
-                substrings[i] = pad + s
-        return '\n'.join(substrings)
-
     def __str__(self) -> str:
-        split = 'x ≤ %.3e?' % float(self.split)
-        left_str = str(self.left)
-        left_str = self.tabulate(left_str, '│', True)
-        left_str = '└──' + left_str
-        left_str = self.tabulate(left_str)
-
-        right_str = str(self.right)
-        right_str = self.tabulate(right_str, ' ', True)
-        right_str = '└──' + right_str
-        right_str = self.tabulate(right_str)
-
-        return '%s\n%s\n%s' % (split, left_str, right_str)
+        # the split, then the string of each side indented below it (the lines of the left side after its first one
+        # are prefixed by a vertical bar), built with an explicit stack of the nodes and of the prefixes of their lines
+        lines = []
+        stack: List[Tuple[AbstractReg, str, str]] = [(self, '', '')]  # node, prefix of its first line and of the others
+        while stack:
+            node, first, rest = stack.pop()
+            if isinstance(node, Node):
+                lines.append(first + 'x ≤ %.3e?' % float(node.split))
+                stack.append((node.right, rest + '    └──', rest + '     '))
+                stack.append((node.left, rest + '    └──', rest + '    │'))
+            else:
+                substrings = str(node).split('\n')
+                lines.append(first + substrings[0])
+                lines.extend(rest + substring for substring in substrings[1:])
+        return '\n'.join(lines)
 
     def to_graphviz(self):
         if graphviz is None:
@@ -954,65 +2154,545 @@ class Node(AbstractReg[Number]):
         return dot
 
     def _to_graphviz(self, dot):
-        dot.node(str(id(self)), 'x ≤ %.3e?' % float(self.split), shape='box')
-        self.left._to_graphviz(dot)
-        self.right._to_graphviz(dot)
-        dot.edge(str(id(self)), str(id(self.left)), 'yes')
-        dot.edge(str(id(self)), str(id(self.right)), 'no')
+        # each node, then its left and right subtrees, then its edges
+        stack: List[Tuple[AbstractReg, bool]] = [(self, False)]  # node, True if its subtrees are already done
+        while stack:
+            node, done = stack.pop()
+            if not isinstance(node, Node):
+                node._to_graphviz(dot)
+            elif done:
+                dot.edge(str(id(node)), str(id(node.left)), 'yes')
+                dot.edge(str(id(node)), str(id(node.right)), 'no')
+            else:
+                dot.node(str(id(node)), 'x ≤ %.3e?' % float(node.split), shape='box')
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+
+    @staticmethod
+    def _numpy_prefix_RSS(x, y):
+        '''Return an array whose i-th element is the RSS of the linear regression of y[:i+1] over x[:i+1].
+        The central moments are the cumulative sums of the increments of Welford's algorithm, themselves computed from
+        the cumulative means, so this is about as accurate as the incremental computation done by the Leaf class.'''
+        size = numpy.arange(1, len(x)+1)
+        mean_x = numpy.cumsum(x) / size
+        mean_y = numpy.cumsum(y) / size
+        dx = numpy.zeros(len(x))
+        dy = numpy.zeros(len(y))
+        dx[1:] = x[1:] - mean_x[:-1]
+        dy[1:] = y[1:] - mean_y[:-1]
+        M2x = numpy.cumsum(dx*(x - mean_x))
+        M2y = numpy.cumsum(dy*(y - mean_y))
+        cov_sum = numpy.cumsum(dx*(y - mean_y))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return M2y - cov_sum**2 / M2x
+
+    def _numpy_split_errors(self):
+        '''Return the list of pairs (split, error) for all the splits of the dataset, in the order in which they would
+        be visited by successive calls to move_forward.
+        Only for the AIC and BIC modes, where the RSS of both sides can be obtained from cumulative sums.'''
+        assert self.config.mode in ('AIC', 'BIC')
+        assert isinstance(self.left, Leaf)
+        assert isinstance(self.right, Leaf)
+        full = self.left if self.left_to_right else self.right
+        points = list(full) if self.left_to_right else list(full.__reviter__())
+        all_x = numpy.array([float(p[0]) for p in points])
+        all_y = numpy.array([float(p[1]) for p in points])
+        size = len(points)
+        # ends[k] is the index of the last point of the (k+1)-th group of equal x, i.e. the last point on the left side
+        # of the (k+1)-th split
+        ends = numpy.flatnonzero(all_x[1:] != all_x[:-1])
+        if len(ends) == 0:
+            return []
+        left_RSS = self._numpy_prefix_RSS(all_x, all_y)[ends]
+        right_RSS = self._numpy_prefix_RSS(all_x[::-1], all_y[::-1])[size - ends - 2]
+        nb_groups = len(ends) + 1
+        left_groups = numpy.arange(1, nb_groups)
+        # a side with a single distinct x has an undefined regression, hence an infinite error
+        valid = (left_groups > 1) & (nb_groups - left_groups > 1)
+        RSS = left_RSS + right_RSS
+        null_RSS = (RSS <= 0) | (numpy.abs(RSS) <= self.config.epsilon**2)
+        RSS[null_RSS] = math.ldexp(1.0, -1000)
+        nb_params = 2*full.nb_params + 1
+        if self.config.mode == 'AIC':
+            param_penalty = 2*nb_params
+        else:
+            param_penalty = math.log(size) * nb_params
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            errors = param_penalty + size*numpy.log(RSS/size)
+        errors[~valid | numpy.isnan(errors)] = float('inf')
+        result = [(points[i][0], float(err)) for i, err in zip(ends, errors)]
+        if self.left_to_right:
+            result.reverse()
+        return result
+
+    def _split_at(self, split: Number) -> None:
+        '''Replace the two leaves of the node by the leaves obtained when the whole dataset is split at the given
+        value. This is equivalent to moving the elements one group at a time until the split is reached.'''
+        assert isinstance(self.left, Leaf)
+        assert isinstance(self.right, Leaf)
+        points = list(self.left) + list(self.right.__reviter__())
+        all_x = [p[0] for p in points]
+        all_y = [p[1] for p in points]
+        index = bisect.bisect_right(all_x, split)
+        leaf_cls = self.left.__class__
+        self.left = leaf_cls(all_x[:index], all_y[:index], config=self.config)
+        self.right = leaf_cls(all_x[:index-1:-1], all_y[:index-1:-1], config=self.config)
+
+    def _may_split(self, depth: int, remaining: Union[None, int]) -> bool:
+        '''Return True if a node at the given depth can be split, given the number of breakpoints that can still be
+        added (None if unlimited), see the max_depth and max_breakpoints of the configuration.'''
+        if self.config.max_depth is not None and depth >= self.config.max_depth:
+            return False
+        return remaining is None or remaining > 0
+
+    def _full_leaf(self) -> Leaf:
+        '''Return the leaf holding the whole dataset, when the node cannot be split. No split is searched.'''
+        leaf = self.left if self.left_to_right else self.right
+        assert isinstance(leaf, Leaf)
+        leaf.errors = self.Error(self.nosplit.error, [], float('inf'))
+        return leaf
+
+    def _unsplit(self) -> None:
+        '''Move all the elements back to the leaf that held them when the node was created, e.g. when the split made by
+        find_split is not used.'''
+        moved = self.right if self.left_to_right else self.left
+        while len(moved) > 0:
+            self.move_backward()
+            moved = self.right if self.left_to_right else self.left
+
+    def _children(self) -> Tuple['Node', 'Node']:
+        '''Return the two nodes whose split is searched after the split of this node, one for each side.'''
+        assert isinstance(self.left, Leaf)
+        leaf_cls: Type[Leaf] = self.left.__class__
+        return (Node(self.left, leaf_cls([], [], config=self.config)),
+                Node(leaf_cls([], [], config=self.config), self.right))
 
     def compute_best_fit(self, depth=0):
-        '''Compute recursively the best fit for the dataset of this node, using a greedy algorithm. This can either be:
+        '''Compute the best fit for the dataset of this node, using a greedy algorithm. This can either be:
             - a leaf, representing a single linear regression,
-            - a tree of nodes, representing a segmented linear regressions.'''
+            - a tree of nodes, representing a segmented linear regressions.
+        The tree is built iteratively: the nodes whose split has to be searched are kept in a SearchQueue, in the order
+        of the configuration. Each search gives either a leaf or a node, whose two sides are added to the queue. The
+        resulting tree does not depend on the order (except with max_breakpoints, the splits being made in this order
+        until they are all used, the remaining nodes are not searched), and its depth is not limited by the recursion
+        limit. The nodes deeper than the max_depth of the configuration are not searched.'''
+        root = None
+        remaining = self.config.max_breakpoints  # number of breakpoints that can still be added (None if unlimited)
+        queue = SearchQueue(self.config.order)
+        queue.push(self, None, None, ())
+        profile = self.config.profile
+        while queue:
+            node, parent, side, path = queue.pop()
+            if profile is not None:
+                start = time.perf_counter()
+            if node._may_split(depth + len(path), remaining):
+                result = node.find_split()
+            else:
+                result = node._full_leaf()
+            if profile is not None:
+                profile.add_level(depth + len(path), start)
+            if parent is None:
+                root = result
+            else:
+                setattr(parent, side, result)
+            if result is node:
+                if remaining is not None:
+                    remaining -= 1
+                left, right = node._children()
+                queue.push(left, node, 'left', path + (0,))
+                queue.push(right, node, 'right', path + (1,))
+        return root
+
+    def compute_best_fit_parallel(self, executor, nb_chunks=1):
+        '''Same as compute_best_fit, but the splits of the independent subtrees are searched concurrently by the given
+        executor (from concurrent.futures). With a ProcessPoolExecutor, the subtrees are sent to the worker processes
+        and their results are assembled back into the tree in this process. The resulting regression is the same.
+        With nb_chunks > 1, the split candidates of the root are also evaluated concurrently, see find_split.
+        The searches of the nodes waiting in the queue are launched in advance, in the order of the configuration, but
+        their results are used in this order, like in compute_best_fit: with max_breakpoints, the splits are the same
+        whatever the order in which the searches complete. Only the searches that may still be used are launched (at
+        most the number of breakpoints left), those of the nodes that are finally not searched are discarded.'''
+        root = None
+        queue = SearchQueue(self.config.order)
+        remaining = self.config.max_breakpoints  # number of breakpoints that can still be added (None if unlimited)
+        futures: Dict[Tuple[int, ...], concurrent.futures.Future] = {}  # the searches launched, by path of the node
+
+        def attach(result, parent, side, path):
+            nonlocal root, remaining
+            if parent is None:
+                root = result
+            else:
+                setattr(parent, side, result)
+            if isinstance(result, Node):
+                if remaining is not None:
+                    remaining -= 1
+                left, right = result._children()
+                queue.push(left, result, 'left', path + (0,))
+                queue.push(right, result, 'right', path + (1,))
+
+        def submit():
+            for node, _, _, path in queue:
+                if remaining is not None and len(futures) >= remaining:
+                    break
+                if path not in futures and node._may_split(len(path), remaining):
+                    futures[path] = executor.submit(node.find_split)
+
+        if nb_chunks > 1 and self._may_split(0, remaining):
+            attach(self.find_split(executor=executor, nb_chunks=nb_chunks), None, None, ())
+        else:
+            queue.push(self, None, None, ())
+        while queue:
+            submit()
+            node, parent, side, path = queue.pop()
+            future = futures.pop(path, None)
+            if node._may_split(len(path), remaining):
+                if future is None:
+                    future = executor.submit(node.find_split)
+                attach(future.result(), parent, side, path)
+            else:
+                if future is not None and not future.cancel() and future.result() is node:  # split in place (thread)
+                    node._unsplit()
+                attach(node._full_leaf(), parent, side, path)
+        return root
+
+    def _moves(self) -> List[int]:
+        '''Return the list of the numbers of elements moved by the successive calls to move_forward (i.e. the sizes of
+        the groups of equal x in the full leaf, in the order in which they are moved). The last group is never moved.'''
+        full = self.left if self.left_to_right else self.right
+        assert isinstance(full, Leaf)
+        sizes: List[int] = []
+        previous = None
+        for x, _ in full.__reviter__():
+            if len(sizes) > 0 and x == previous:
+                sizes[-1] += 1
+            else:
+                sizes.append(1)
+            previous = x
+        return sizes[:-1]
+
+    def _feasible_moves(self) -> Tuple[int, int]:
+        '''Return the first and the last numbers of calls to move_forward that give a split where both sides have at
+        least min_points_per_segment points and min_distinct_x_per_segment distinct x values. These splits are
+        contiguous, since one side grows and the other one shrinks. Without these limits, this is (1, len(self)).'''
+        min_points = self.config.min_points_per_segment
+        min_distinct = self.config.min_distinct_x_per_segment
+        if min_points is None and min_distinct is None:
+            return 1, len(self)
+        min_points = min_points or 1
+        min_distinct = min_distinct or 1
+        moves = self._moves()
+        size = len(self)
+        nb_groups = len(moves) + 1
+        first, last = 1, 0
+        nb_moved = 0
+        for i, nb in enumerate(moves, start=1):
+            nb_moved += nb
+            if min(nb_moved, size - nb_moved) >= min_points and min(i, nb_groups - i) >= min_distinct:
+                if last == 0:
+                    first = i
+                last = i
+        return first, last
+
+    def _split_errors(self, nb_moved: int, nb_moves: int) -> List[Tuple[Number, float]]:
+        '''Return the pairs (split, error) of nb_moves successive calls to move_forward, starting from the state where
+        the nb_moved last elements of the full leaf have been moved. The node is not modified: the two leaves are built
+        from scratch at this state, by adding the elements in the same order than the successive moves, so the errors
+        are exactly those of compute_best_fit (except with the warm start of the 'lm' log solver, which depends on the
+        previous fits).'''
+        full = self.left if self.left_to_right else self.right
+        assert isinstance(full, Leaf)
+        points = list(full)
+        kept = points[:len(points)-nb_moved]
+        moved = points[:len(points)-nb_moved-1:-1]
+        leaf_cls: Type[Leaf] = full.__class__
+        node = copy(self)
+        full_leaf = leaf_cls([p[0] for p in kept], [p[1] for p in kept], config=self.config)
+        empty_leaf = leaf_cls([p[0] for p in moved], [p[1] for p in moved], config=self.config)
+        if self.left_to_right:
+            node.left, node.right = full_leaf, empty_leaf
+        else:
+            node.left, node.right = empty_leaf, full_leaf
+        errors = []
+        for _ in range(nb_moves):
+            node.move_forward()
+            errors.append((node.split, node.error))
+        return errors
+
+    def _chunked_split_errors(self, executor, nb_chunks: int, first: int = 1,
+                              last: Union[None, int] = None) -> List[Tuple[Number, float]]:
+        '''Return the list of pairs (split, error) for the splits of the dataset given by the successive calls to
+        move_forward, from the first to the last one (all the splits by default), in this order. The splits are divided
+        in nb_chunks contiguous chunks, evaluated concurrently by the given executor.'''
+        moves = self._moves()
+        nb_moved = [0] + list(itertools.accumulate(moves))
+        last = len(moves) if last is None else min(last, len(moves))
+        bounds = [first-1 + max(last-first+1, 0)*k//nb_chunks for k in range(nb_chunks+1)]
+        futures = [executor.submit(self._split_errors, nb_moved[start], stop-start)
+                   for start, stop in zip(bounds, bounds[1:]) if stop > start]
+        return [error for future in futures for error in future.result()]
+
+    def _candidate_splits(self) -> set:
+        '''Return the set of the splits evaluated by the binned search, for the nb_bins bins of the configuration: the x
+        values at the quantiles of the dataset ('quantile' binning) or the largest x values below log-spaced bounds
+        between the smallest and the largest x ('log' binning, for sizes sampled on an exponential scale).'''
+        full = self.left if self.left_to_right else self.right
+        assert isinstance(full, Leaf)
+        x_values = list(full.sorted_iter())
+        n = len(x_values)
+        nb_bins = self.config.nb_bins
+        assert nb_bins is not None
+        if self.config.binning == 'quantile':
+            splits = {x_values[n*k//nb_bins][0] for k in range(1, nb_bins)}
+        else:
+            low, high = float(x_values[0][0]), float(x_values[-1][0])
+            if low <= 0:
+                raise ValueError('The log binning needs positive x values.')
+            bounds = [(low*(high/low)**(k/nb_bins), math.inf) for k in range(1, nb_bins)]
+            splits = {x_values[max(bisect.bisect_right(x_values, bound) - 1, 0)][0] for bound in bounds}
+        splits.discard(x_values[-1][0])  # nothing on the right side
+        return splits
+
+    def _block_split_errors(self, splits, first: int = 1,
+                            last: Union[None, int] = None) -> Dict[int, Tuple[Number, float]]:
+        '''Return the pairs (split, error) for the given splits, indexed by the number of calls to move_forward giving
+        them (like in find_split), only for the numbers of moves from first to last. The node is not modified: the
+        dataset is cut into blocks at the given splits, and the leaves of each split are obtained by combining the
+        blocks on each side in constant time (see StatisticsLeaf, or Leaf.__add__ in log mode, which needs the pairs).
+        The cost therefore depends on the number of splits, not on the number of elements moved between them. The errors
+        are those of compute_best_fit up to rounding errors.'''
+        full = self.left if self.left_to_right else self.right
+        assert isinstance(full, Leaf)
+        points = list(full.sorted_iter())
+        all_x = [p[0] for p in points]
+        all_y = [p[1] for p in points]
+        nb_groups = len(full.counter_x)
+        last = nb_groups - 1 if last is None else last
+        splits = sorted(splits)
+        bounds = [0] + [bisect.bisect_right(all_x, split) for split in splits] + [len(points)]
+        leaf_cls: Type[Leaf] = full.__class__
+        blocks = [leaf_cls(all_x[start:stop], all_y[start:stop], config=self.config)
+                  for start, stop in zip(bounds, bounds[1:])]
+        if self.config.mode == 'log':
+            lefts = list(itertools.accumulate(blocks[:-1], lambda left, block: left + block))
+            rights = list(itertools.accumulate(blocks[:0:-1], lambda right, block: block + right))
+        else:
+            lefts = list(itertools.accumulate(blocks[:-1], lambda left, block: StatisticsLeaf([left, block])))
+            rights = list(itertools.accumulate(blocks[:0:-1], lambda right, block: StatisticsLeaf([block, right])))
+        node = copy(self)
+        errors = {}
+        nb_distinct = 0  # number of distinct x on the left side
+        for split, start, stop, left, right in zip(splits, bounds, bounds[1:], lefts, reversed(rights)):
+            nb_distinct += len(set(all_x[start:stop]))
+            i = nb_groups - nb_distinct if self.left_to_right else nb_distinct
+            if first <= i <= last:
+                node.left, node.right = left, right
+                errors[i] = (split, node.error)
+        return errors
+
+    def _refined_splits(self, evaluated: Dict[int, Tuple[Number, float]]) -> set:
+        '''Return the set of the splits between the two evaluated splits adjacent to the best one (or the ends of the
+        dataset), not evaluated yet. The largest x is not a split, there would be nothing on the right side.'''
+        splits = sorted(split for split, _ in evaluated.values())
+        best = evaluated[min(sorted(evaluated), key=lambda index: evaluated[index][1])][0]  # first one, like find_split
+        position = splits.index(best)
+        full = self.left if self.left_to_right else self.right
+        assert isinstance(full, Leaf)
+        largest = max(full.counter_x)
+        return {x for x in full.counter_x if (position == 0 or x > splits[position-1]) and
+                (position+1 == len(splits) or x < splits[position+1]) and x not in (best, largest)}
+
+    def find_split(self, executor=None, nb_chunks=1):
+        '''Search the best split for the dataset of this node (a single level of compute_best_fit).
+        If it decreases the error, the left and right leaves are left at this split and the node is returned. Otherwise,
+        the leaf holding the whole dataset is returned.
+        With an executor and nb_chunks > 1, the split candidates are divided in nb_chunks contiguous chunks, evaluated
+        concurrently by the executor (not for the numpy engine, which is already vectorized). The errors are the same
+        than those of the sequential search, so this is not supported with the 'lm' solver of the log mode, whose fits
+        start from the result of the previous one (see Leaf.compute_log_parameters).
+        With the binned search of the configuration (nb_bins), the error is evaluated only for the candidates given by
+        _candidate_splits and, with refine, for all the splits between the two candidates adjacent to the best one. The
+        errors trace only holds the evaluated splits. They are evaluated without moving the elements one group at a time
+        (see _block_split_errors), and this search does not use the numpy engine nor the chunks.
+        With the min_points_per_segment and min_distinct_x_per_segment of the configuration, the splits that leave too
+        few points or distinct x values on a side are skipped: they are not evaluated, and the elements are not moved
+        beyond the last feasible split.'''
         lowest_error = self.error
         lowest_index = 0
-        new_errors = []
-        i = 0
-        while self.can_move:
-            self.move_forward()
-            i += 1
-            new_errors.append((self.split, self.error))
-            if self.error < lowest_error:
-                lowest_error = self.error
-                lowest_split = self.split
-                lowest_index = i
-        # TODO stopping criteria?
+        first, last = self._feasible_moves()
+        use_bins = self.config.nb_bins is not None
+        use_numpy = not use_bins and self.config.engine == 'numpy' and self.config.mode in ('AIC', 'BIC')
+        use_chunks = not use_bins and not use_numpy and executor is not None and nb_chunks > 1
+        if use_chunks and self.config.mode == 'log' and self.config.log_solver == 'lm':
+            raise ValueError('The chunked split search is not supported with the lm solver.')
+        if use_numpy or use_chunks:
+            if use_numpy:
+                new_errors = self._numpy_split_errors()[first-1:last]
+            else:
+                new_errors = self._chunked_split_errors(executor, nb_chunks, first, last)
+            i = 0  # number of elements moved, the leaves are not modified by these searches
+            for index, (split, error) in enumerate(new_errors, start=first):
+                if error < lowest_error:
+                    lowest_error = error
+                    lowest_split = split
+                    lowest_index = index
+        else:
+            evaluated: Dict[int, Tuple[Number, float]] = {}  # number of moves -> (split, error)
+            i = 0
+            if use_bins:  # the leaves are not modified by this search either
+                evaluated = self._block_split_errors(self._candidate_splits(), first, last)
+                if self.config.refine and evaluated:
+                    evaluated.update(self._block_split_errors(self._refined_splits(evaluated), first, last))
+            else:
+                while i < last and self.can_move:
+                    self.move_forward()
+                    i += 1
+                    if i >= first:
+                        evaluated[i] = (self.split, self.error)
+            new_errors = []
+            for index in sorted(evaluated):
+                split, error = evaluated[index]
+                new_errors.append((split, error))
+                if error < lowest_error:
+                    lowest_error = error
+                    lowest_split = split
+                    lowest_index = index
         if lowest_error < self.nosplit.error and not self.error_equal(lowest_error, self.nosplit.error):
-            while i > lowest_index:
-                i -= 1
-                self.move_backward()
+            if use_numpy or use_chunks or use_bins:
+                self._split_at(lowest_split)
+            else:
+                while i > lowest_index:
+                    i -= 1
+                    self.move_backward()
             assert lowest_split == self.split
-            self.left = Node(self.left, Leaf(
-                [], [], config=self.config)).compute_best_fit(depth+1)
-            self.right = Node(Leaf([], [], config=self.config),
-                              self.right).compute_best_fit(depth+1)
             self.errors = self.Error(
                 self.nosplit.error, new_errors, lowest_error)
             return self
         else:
-            self.nosplit.errors = self.Error(
+            # Moving all the elements back restores the leaf in the exact same state as when the node was created.
+            while i > 0:
+                i -= 1
+                self.move_backward()
+            leaf = self.left if self.left_to_right else self.right
+            leaf.errors = self.Error(
                 self.nosplit.error, new_errors, lowest_error)
-            return self.nosplit
+            return leaf
 
     def predict(self, x: Number) -> Number:
         '''Return a prediction of y for the variable x by using the piecewise linear regression.'''
-        if x <= self.split:
-            return self.left.predict(x)
-        else:
-            return self.right.predict(x)
+        node: AbstractReg = self
+        while isinstance(node, Node):
+            node = node.left if x <= node.split else node.right
+        return node.predict(x)
 
     def predict_statsmodels(self, x):
-        if x <= self.split:
-            return self.left.predict_statsmodels(x)
+        node: AbstractReg = self
+        while isinstance(node, Node):
+            node = node.left if x <= node.split else node.right
+        return node.predict_statsmodels(x)
+
+    def _leaves(self) -> List[Leaf]:
+        if isinstance(self.left, Leaf) and isinstance(self.right, Leaf):  # during the search of a split
+            return [self.left, self.right]
+        leaves = []
+        stack: List[AbstractReg] = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Node):
+                stack.append(node.right)
+                stack.append(node.left)
+            else:
+                assert isinstance(node, Leaf)
+                leaves.append(node)
+        return leaves
+
+    def _extend(self, points, increasing: bool) -> AbstractReg[Number]:
+        '''The pairs go down the tree to the leaves of their segments (see Leaf._extend), then the splits of the nodes
+        on their way are checked from the bottom up (see _split_pays_off). A subtree whose split does not pay off
+        anymore is fitted again, the other ones are kept as they are. The tree is walked iteratively, like in
+        compute_best_fit.'''
+        root: AbstractReg[Number] = self
+        path: List[Tuple[Node, Union[None, Node], Union[None, str], bool]] = []  # parents before their children
+        stack: List[Tuple[AbstractReg[Number], Union[None, Node], Union[None, str], Any, bool]] = [
+            (self, None, None, points, increasing)]
+        while stack:
+            node, parent, side, node_points, node_increasing = stack.pop()
+            if isinstance(node, Node):
+                path.append((node, parent, side, node_increasing))
+                index = bisect.bisect_right([p[0] for p in node_points], node.split)
+                if index > 0:
+                    stack.append((node.left, node, 'left', node_points[:index], True))
+                if index < len(node_points):
+                    stack.append((node.right, node, 'right', node_points[index:], False))
+            else:
+                assert parent is not None and side is not None
+                setattr(parent, side, node._extend(node_points, node_increasing))
+        for node, parent, side, node_increasing in reversed(path):
+            if node._split_pays_off():
+                continue
+            result = node._refit(node_increasing)
+            if parent is None:
+                root = result
+            else:
+                assert side is not None
+                setattr(parent, side, result)
+        return root
+
+    def _split_pays_off(self) -> bool:
+        '''Return True if the split of this node still decreases the error, like in find_split: each side counts as a
+        single regression of all its pairs, compared to a single regression of all the pairs of the node. The errors are
+        computed from the statistics of the leaves (see StatisticsLeaf), without touching the pairs, except in log mode
+        where they are needed (the sides are merged).'''
+        if self.config.mode == 'log':
+            return self._split_decreases_error(self.left.merge(), self.right.merge())
+        return self._split_decreases_error(StatisticsLeaf(self.left._leaves()), StatisticsLeaf(self.right._leaves()))
+
+    @staticmethod
+    def _split_decreases_error(left: Leaf[Number], right: Leaf[Number]) -> bool:
+        '''Return True if two regressions, one of the pairs of each given leaf, have a lower error than a single
+        regression of all these pairs (and not an equal one, see error_equal). The leaves can be statistics leaves (see
+        StatisticsLeaf), except in log mode.'''
+        node = Node(left, right, no_check=True)
+        if left.config.mode == 'log':
+            nosplit: Leaf[Number] = left + right
         else:
-            return self.right.predict_statsmodels(x)
+            nosplit = StatisticsLeaf([left, right])
+        split_error, nosplit_error = node.error, nosplit.error
+        return split_error < nosplit_error and not node.error_equal(split_error, nosplit_error)
+
+    def _refit(self, increasing: bool) -> AbstractReg[Number]:
+        '''Return the best fit of the pairs of this node, searched from scratch (see compute_best_fit).'''
+        points = list(self)
+        leaf_cls = leaf_class([p[0] for p in points], [p[1] for p in points], self.config)
+        if not increasing:
+            points.reverse()
+        leaf = leaf_cls([p[0] for p in points], [p[1] for p in points], config=self.config)
+        empty = leaf_cls([], [], config=self.config)
+        node = Node(leaf, empty) if increasing else Node(empty, leaf)
+        return node.compute_best_fit()
 
     @property
     def breakpoints(self) -> List[Number]:
-        return self.left.breakpoints + [self.split] + self.right.breakpoints
+        # in-order traversal of the nodes
+        result: List[Number] = []
+        stack: List[Node] = []
+        node: AbstractReg = self
+        while True:
+            while isinstance(node, Node):
+                stack.append(node)
+                node = node.left
+            if not stack:
+                return result
+            parent = stack.pop()
+            result.append(parent.split)
+            node = parent.right
 
     def merge(self):
-        return self.left.merge() + self.right.merge()
+        leaves = self._leaves()
+        leaf = leaves[0].merge()
+        for other in leaves[1:]:
+            leaf = leaf + other.merge()
+        return leaf
 
 
 class FlatRegression(AbstractReg[Number]):
@@ -1020,23 +2700,41 @@ class FlatRegression(AbstractReg[Number]):
         self.config = config
         assert len(x) == len(y)
         assert list(sorted(set(breakpoints))) == breakpoints
-        intervals: List[Tuple[Union[float, Number], Union[float, Number]]] = []
-        if len(breakpoints) == 0:
-            intervals.append((-float('inf'), float('inf')))
-        else:
-            intervals.append((-float('inf'), breakpoints[0]))
-            for i in range(len(breakpoints)-1):
-                intervals.append((breakpoints[i], breakpoints[i+1]))
-            intervals.append((breakpoints[-1], float('inf')))
-        self.segments: List[Tuple[Tuple[Union[float, Number], Union[float, Number]], Leaf[Number]]] = []
-        points = list(sorted(zip(x, y)))
-        for min_x, max_x in intervals:
-            subx, suby = [], []
-            for xx, yy in points:
-                if min_x < xx <= max_x:
-                    subx.append(xx)
-                    suby.append(yy)
-            self.segments.append(((min_x, max_x), Leaf(subx, suby, config=config)))
+        # single pass over the sorted points, the i-th segment gets the points such that breakpoints[i-1] < x ≤
+        # breakpoints[i]
+        all_x: List[List[Number]] = [[] for _ in range(len(breakpoints)+1)]
+        all_y: List[List[Number]] = [[] for _ in range(len(breakpoints)+1)]
+        i = 0
+        for xx, yy in sorted(zip(x, y)):
+            while i < len(breakpoints) and xx > breakpoints[i]:
+                i += 1
+            all_x[i].append(xx)
+            all_y[i].append(yy)
+        leaf_cls = leaf_class(x, y, config)
+        leaves = [leaf_cls(subx, suby, config=config) for subx, suby in zip(all_x, all_y)]
+        self.segments: List[Tuple[Tuple[Union[float, Number], Union[float, Number]], Leaf[Number]]] = list(
+                zip(self._intervals(breakpoints), leaves))
+
+    @staticmethod
+    def _intervals(breakpoints: List[Number]) -> List[Tuple[Union[float, Number], Union[float, Number]]]:
+        '''Return the list of the intervals (min_x, max_x) delimited by the given breakpoints.'''
+        bounds: List[Union[float, Number]] = [-float('inf')]
+        bounds.extend(breakpoints)
+        bounds.append(float('inf'))
+        return list(zip(bounds, bounds[1:]))
+
+    @classmethod
+    def from_leaves(cls, leaves: List[Leaf[Number]], breakpoints: List[Number]) -> 'FlatRegression[Number]':
+        '''Return a FlatRegression whose segments are the given leaves (not copied), delimited by the given
+        breakpoints. The points of the leaves may have been added either in increasing or decreasing order.
+        The leaves are marked as shared: extend copies them before modifying them (see Leaf._unshared).'''
+        assert len(leaves) == len(breakpoints) + 1
+        for leaf in leaves:
+            leaf.shared = True
+        reg = cls.__new__(cls)
+        reg.config = leaves[0].config
+        reg.segments = list(zip(cls._intervals(breakpoints), leaves))
+        return reg
 
     def __repr__(self) -> str:
         result = []
@@ -1054,6 +2752,14 @@ class FlatRegression(AbstractReg[Number]):
             rss += leaf.RSS
         return rss
 
+    def compute_weighted_RSS(self) -> ExtNumber:
+        '''Return the *weighted* residual sum of squares of the segmented linear regression.'''
+        return sum(leaf.compute_weighted_RSS() for (_, _), leaf in self.segments)
+
+    def compute_RSSlog(self) -> float:
+        '''Warning: this computation has O(n) complexity.'''
+        return sum(leaf.compute_RSSlog() for (_, _), leaf in self.segments)
+
     def compute_statsmodels_reg(self):
         for _, reg in self.segments:
             reg.compute_statsmodels_reg()
@@ -1063,7 +2769,7 @@ class FlatRegression(AbstractReg[Number]):
 
     def __iter__(self) -> Generator[Tuple[Number, Number], None, None]:
         for (_, _), leaf in self.segments:
-            yield from leaf
+            yield from leaf.sorted_iter()
 
     def _to_graphviz(self, dot) -> None:
         dot.node(str(id(self)), str(self))
@@ -1095,13 +2801,34 @@ class FlatRegression(AbstractReg[Number]):
                 break
         return leaf.predict_statsmodels(x)
 
+    def _leaves(self) -> List[Leaf]:
+        return [leaf for (_, _), leaf in self.segments]
+
+    def _extend(self, points, increasing: bool) -> 'FlatRegression[Number]':
+        '''The breakpoints are fixed, the pairs are inserted in the leaves of their segments (see Leaf._insert). Like
+        those of a tree, the leaves are updated in place, except those shared with the tree given by flatify.'''
+        breakpoints = self.breakpoints
+        new_points: Dict[int, List[Tuple[Number, Number]]] = {}
+        for x, y in points:
+            new_points.setdefault(bisect.bisect_left(breakpoints, x), []).append((x, y))
+        for i, segment_points in new_points.items():
+            interval, leaf = self.segments[i]
+            self.segments[i] = interval, leaf._unshared()._insert(segment_points)
+        return self
+
     def merge(self):
-        leaf = Leaf([], [], config=self.config)
-        for x, y in self:
-            leaf.add(x, y)
+        leaf = self.segments[0][1].__class__([], [], config=self.config)
+        for (_, _), segment in self.segments:
+            leaf = leaf + segment
         return leaf
 
     def __simplify(self, RSSlog=False):
+        '''Merge greedily the pair of adjacent segments whose merge increases the least the RSS, until there is a
+        single segment. Return the list of the successive regressions, with their metrics.
+        The merge costs of the adjacent pairs are kept in a priority queue, only the two costs involving the merged
+        segment are computed at each step. The merged leaves are obtained in constant time (see Leaf.__add__), the
+        successive regressions share their unmodified leaves and the metrics of each leaf are computed only once.
+        '''
         def RSS(x):
             if RSSlog or self.config.mode == 'log':
                 return x.compute_RSSlog()
@@ -1109,35 +2836,69 @@ class FlatRegression(AbstractReg[Number]):
                 return x.compute_weighted_RSS()
             else:
                 return x.RSS
+        # The segments are identified by the index of their leftmost original segment, so the order of the identifiers
+        # is the order of the segments. The version of a segment is incremented each time it is merged with its right
+        # neighbour, to discard the outdated entries of the heap.
+        intervals = {i: interval for i, (interval, _) in enumerate(self.segments)}
+        leaves = {i: leaf for i, (_, leaf) in enumerate(self.segments)}
+        rss = {i: RSS(leaf) for i, leaf in leaves.items()}
+        version = {i: 0 for i in leaves}
+        next_id = {i: i+1 for i in range(len(leaves)-1)}
+        previous_id = {i+1: i for i in range(len(leaves)-1)}
+        candidates: Dict[int, Leaf] = {}  # merged leaves built to compute the cost of a pair
+        heap: List[Tuple[Any, int, int, int]] = []
+
+        def push(i):
+            j = next_id[i]
+            candidates[i] = leaves[i] + leaves[j]
+            rss_diff = RSS(candidates[i]) - (rss[i] + rss[j])
+            if rss_diff != rss_diff:  # NaN
+                rss_diff = float('inf')
+            heapq.heappush(heap, (rss_diff, i, version[i], version[j]))
+
+        for i in next_id:
+            push(i)
         all_regressions = [self]
-        while True:
-            min_rss = float('inf')
-            min_i = -1
-            new_reg = deepcopy(all_regressions[-1])
-            if len(new_reg.segments) <= 1:
-                break
-            for i in range(len(new_reg.segments)-1):
-                (left_min, left_max), left_leaf = new_reg.segments[i]
-                (right_min, right_max), right_leaf = new_reg.segments[i+1]
-                rss_diff = RSS(left_leaf + right_leaf) - (RSS(left_leaf) + RSS(right_leaf))
-                if rss_diff < min_rss:
-                    min_rss = rss_diff
-                    min_i = i
-            (left_min, left_max), left_leaf = new_reg.segments[min_i]
-            (right_min, right_max), right_leaf = new_reg.segments[min_i+1]
-            new_reg.segments.pop(min_i+1)
-            new_reg.segments[min_i] = (left_min, right_max), (left_leaf + right_leaf)
-            all_regressions.append(new_reg)
-        result = [{'regression': reg,
-                   'RSS': reg.RSS,
-                   'BIC': reg.BIC,
-                   'AIC': reg.AIC,
-                   'BIClog': reg.compute_BIClog(),
-                   'RSSlog': reg.compute_RSSlog(),
-                   'weighted_RSS': reg.compute_weighted_RSS(),
-                   'weighted_BIC': reg.compute_weighted_BIC(),
-                   'nb_breakpoints': len(reg.breakpoints)}
-                  for reg in all_regressions]
+        while heap:
+            _, i, version_i, version_j = heapq.heappop(heap)
+            if i not in next_id or version[i] != version_i or version[next_id[i]] != version_j:
+                continue
+            j = next_id.pop(i)
+            leaves[i] = candidates.pop(i)
+            rss[i] = RSS(leaves[i])
+            intervals[i] = intervals[i][0], intervals[j][1]
+            version[i] += 1
+            for d in (leaves, rss, intervals, version, candidates, previous_id):
+                d.pop(j, None)
+            if j in next_id:
+                next_id[i] = next_id.pop(j)
+                push(i)
+                previous_id[next_id[i]] = i
+            if i in previous_id:
+                push(previous_id[i])
+            ids = sorted(leaves)
+            all_regressions.append(FlatRegression.from_leaves([leaves[k] for k in ids],
+                                                              [intervals[k][1] for k in ids[:-1]]))
+        RSSlog_cache: Dict[int, float] = {}
+        weighted_RSS_cache: Dict[int, ExtNumber] = {}
+        result = []
+        for reg in all_regressions:
+            reg_leaves = reg._leaves()
+            for leaf in reg_leaves:
+                if id(leaf) not in RSSlog_cache:
+                    RSSlog_cache[id(leaf)] = leaf.compute_RSSlog()
+                    weighted_RSS_cache[id(leaf)] = leaf.compute_weighted_RSS()
+            reg_RSSlog = sum(RSSlog_cache[id(leaf)] for leaf in reg_leaves)
+            weighted_RSS = sum(weighted_RSS_cache[id(leaf)] for leaf in reg_leaves)
+            result.append({'regression': reg,
+                           'RSS': reg.RSS,
+                           'BIC': reg.BIC,
+                           'AIC': reg.AIC,
+                           'BIClog': reg._BIClog(reg_RSSlog),
+                           'RSSlog': reg_RSSlog,
+                           'weighted_RSS': weighted_RSS,
+                           'weighted_BIC': reg._weighted_BIC(weighted_RSS),
+                           'nb_breakpoints': len(reg.breakpoints)})
         return result
 
     def simplify(self, RSSlog=False):
@@ -1148,17 +2909,20 @@ class FlatRegression(AbstractReg[Number]):
             return result
 
     def auto_simplify(self, RSSlog=False):
-        def err(x):
-            if RSSlog:
-                return x.compute_BIClog()
+        def err(res):
+            # the error of the regression, taken from the metrics already computed by __simplify
+            if RSSlog or self.config.mode == 'log':
+                return res['BIClog']
+            elif self.config.mode == 'weighted':
+                return res['weighted_BIC']
             else:
-                return x.error
+                return res[self.config.mode]
         result = self.__simplify(RSSlog=RSSlog)
         min_error = float('inf')
         min_reg = None
         for res in result:
             reg = res['regression']
-            new_error = err(reg)
+            new_error = err(res)
             if min_error > new_error or reg.error_equal(min_error, new_error):
                 min_error = new_error
                 min_reg = reg
@@ -1168,27 +2932,511 @@ class FlatRegression(AbstractReg[Number]):
         return self
 
 
-def compute_regression(x, y=None, *, breakpoints=None, mode='BIC', epsilon=None):
+def predict_segments(breakpoints, coeffs, intercepts, xs, undefined):
+    '''Return the predictions of the piecewise linear regression given by its sorted breakpoints and the parameters of
+    its segments for all the variables x of the given sequence (see AbstractReg.predict_many). The segments whose
+    parameters are None are undefined, the function undefined(i, x) is called for the x in the i-th such segment.'''
+    if numpy is not None and isinstance(xs, numpy.ndarray):
+        if xs.dtype.kind in 'iuf':
+            index = numpy.searchsorted(numpy.array(breakpoints, dtype=float), xs, side='left')
+            coeffs = numpy.array([numpy.nan if c is None else float(c) for c in coeffs])
+            intercepts = numpy.array([numpy.nan if i is None else float(i) for i in intercepts])
+            return coeffs[index]*xs + intercepts[index]
+        return numpy.array(predict_segments(breakpoints, coeffs, intercepts, list(xs), undefined))
+    bisect_left = bisect.bisect_left
+    result = []
+    for x in xs:
+        i = bisect_left(breakpoints, x)  # x belongs to the segment ]breakpoints[i-1], breakpoints[i]]
+        if coeffs[i] is None:
+            result.append(undefined(i, x))
+        else:
+            result.append(coeffs[i]*x + intercepts[i])
+    return result
+
+
+class FrozenRegression:
+    '''Immutable and compact version of a fitted regression (see the freeze method of Leaf, Node and FlatRegression).
+    It only holds the breakpoints, the summaries of the segments (with their parameters, computed once and for all) and
+    the summary of the whole regression, not the data. The predictions do not modify anything, so they can be done
+    concurrently from several threads without any lock. Instances can be pickled.'''
+    __slots__ = ('config', 'breakpoints', 'segments', 'coeffs', 'intercepts', '_summary')
+    config: Config
+    breakpoints: Tuple[Any, ...]
+    segments: Tuple[Summary, ...]
+    coeffs: Tuple[Any, ...]
+    intercepts: Tuple[Any, ...]
+    _summary: Summary
+
+    def __init__(self, config: Config, breakpoints: List[Number], segments: List[Summary], summary: Summary) -> None:
+        assert len(segments) == len(breakpoints) + 1
+        object.__setattr__(self, 'config', config)
+        object.__setattr__(self, 'breakpoints', tuple(breakpoints))
+        object.__setattr__(self, 'segments', tuple(segments))
+        object.__setattr__(self, 'coeffs', tuple(segment.coeff for segment in segments))
+        object.__setattr__(self, 'intercepts', tuple(segment.intercept for segment in segments))
+        object.__setattr__(self, '_summary', summary)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s objects are immutable.' % self.__class__.__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s objects are immutable.' % self.__class__.__name__)
+
+    def __reduce__(self):
+        return (self.__class__, (self.config, self.breakpoints, self.segments, self._summary))
+
+    def __repr__(self) -> str:
+        bounds = [-float('inf')] + list(self.breakpoints) + [float('inf')]
+        result = []
+        for min_x, max_x, coeff, intercept in zip(bounds, bounds[1:], self.coeffs, self.intercepts):
+            condition = '%.3e < x ≤ %.3e' % (float(min_x), float(max_x))
+            if coeff is None:
+                result.append('%s\n\t⊥' % condition)
+            else:
+                result.append('%s\n\ty ~ %.3ex + %.3e' % (condition, float(coeff), float(intercept)))
+        return '\n'.join(result)
+
+    def __len__(self) -> int:
+        return self._summary.nb_points
+
+    @property
+    def error(self) -> float:
+        return self._summary.error
+
+    def summary(self) -> Summary:
+        return self._summary
+
+    def freeze(self) -> 'FrozenRegression':
+        return self
+
+    def __undefined(self, i: int, x: Number) -> Number:
+        raise ValueError('Undefined regression for x=%s (not enough points in the segment).' % x)
+
+    def predict(self, x: Number) -> Number:
+        '''Return a prediction of y for the variable x by using the piecewise linear regression.'''
+        i = bisect.bisect_left(self.breakpoints, x)
+        coeff = self.coeffs[i]
+        if coeff is None:
+            return self.__undefined(i, x)
+        return coeff*x + self.intercepts[i]
+
+    def predict_many(self, xs):
+        '''Return the predictions of y for all the variables x of the given sequence (see AbstractReg.predict_many).'''
+        return predict_segments(self.breakpoints, self.coeffs, self.intercepts, xs, self.__undefined)
+
+
+def _columns(names: List[str]) -> Tuple[int, int]:
+    '''Return the indices of the columns x and y among the given column names: the columns named x and y if they exist,
+    the first two columns otherwise.'''
+    names = list(names)
+    if 'x' in names and 'y' in names:
+        return names.index('x'), names.index('y')
+    assert len(names) >= 2
+    return 0, 1
+
+
+def _append_chunk(x: array, y: array, chunk) -> None:
+    '''Append the pairs of the given chunk (a sequence of pairs (x, y), a numpy array with two columns or with fields
+    x and y, or a pandas DataFrame) to the arrays x and y, as floats.'''
+    if pandas is not None and isinstance(chunk, pandas.DataFrame):
+        i, j = _columns(chunk.columns)
+        chunk = chunk.iloc[:, [i, j]].to_numpy(dtype=float)
+    if numpy is not None and isinstance(chunk, numpy.ndarray):
+        if chunk.dtype.names is not None:
+            i, j = _columns(chunk.dtype.names)
+            x_values, y_values = chunk[chunk.dtype.names[i]], chunk[chunk.dtype.names[j]]
+        else:
+            x_values, y_values = chunk[:, 0], chunk[:, 1]
+        x.frombytes(memoryview(numpy.ascontiguousarray(x_values, dtype=float)).cast('B'))
+        y.frombytes(memoryview(numpy.ascontiguousarray(y_values, dtype=float)).cast('B'))
+        return
+    for xx, yy in chunk:
+        x.append(float(xx))
+        y.append(float(yy))
+
+
+def read_dataset(source, chunk_size: int = 1 << 16) -> Tuple[array, array]:
+    '''Read the pairs (x, y) of the given source and return them as two arrays of doubles, sorted by x (then y).
+    The source can be:
+    - the path of a CSV file, whose first row may be a header (the columns named x and y are used if they exist, the
+      first two columns otherwise, e.g. size and duration for the files of test_data),
+    - the path of a .npy file, holding an array with two columns or with fields x and y, which is memory-mapped and
+      read by chunks of chunk_size rows,
+    - an iterable of chunks, each one being a sequence of pairs (x, y), a numpy array (as above) or a pandas DataFrame
+      (e.g. pandas.read_csv(path, chunksize=...)).
+    The values are converted to floats and stored in compact arrays (16 bytes per pair), they are never held as a list
+    of Python objects. With numpy, the sort only needs an additional array of indices, without numpy it needs a
+    temporary list of the pairs.'''
+    x, y = array('d'), array('d')
+    if isinstance(source, (str, os.PathLike)) and os.fspath(source).endswith('.npy'):
+        if numpy is None:
+            raise ImportError('No module named "numpy".')
+        data = numpy.load(source, mmap_mode='r')
+        for start in range(0, len(data), chunk_size):
+            _append_chunk(x, y, data[start:start+chunk_size])
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                raise ValueError('Empty file %s.' % source)
+            i, j = 0, 1
+            try:
+                first_x, first_y = float(header[i]), float(header[j])
+            except ValueError:  # not numbers, this is a header
+                i, j = _columns(header)
+            else:
+                x.append(first_x)
+                y.append(first_y)
+            _append_chunk(x, y, ((row[i], row[j]) for row in reader))
+    else:
+        for chunk in source:
+            _append_chunk(x, y, chunk)
+    if numpy is None:
+        pairs = sorted(zip(x, y))
+        return array('d', (p[0] for p in pairs)), array('d', (p[1] for p in pairs))
+    x_values, y_values = numpy.frombuffer(x, dtype=float), numpy.frombuffer(y, dtype=float)
+    order = numpy.lexsort((y_values, x_values))
+    sorted_x, sorted_y = array('d'), array('d')
+    sorted_x.frombytes(memoryview(x_values[order]).cast('B'))
+    sorted_y.frombytes(memoryview(y_values[order]).cast('B'))
+    return sorted_x, sorted_y
+
+
+def optimal_breakpoints(x: List[Number], y: List[Number], config: Config,
+                        penalty: Union[None, float] = None) -> List[Number]:
+    '''Return the breakpoints of the segmented regression of the given points (sorted by x) that minimizes exactly the
+    sum of the RSS of its segments plus the given penalty per segment. Each segment has at least two distinct x values.
+    In weighted mode, the sum of the squared weighted residuals ((y-αx-β)/x)² is minimized: with u = 1/x and v = y/x,
+    this is the RSS of the regression of v over u. Note that the segments of the returned regression are then fitted
+    with the weights 1/x (see Leaf.compute_weighted_parameters): the cost of their best fit is not subadditive, which
+    the pruning requires. The log mode is not supported.
+    The dynamic program is done on the groups of points sharing the same x, with the pruning of the PELT algorithm
+    (Killick et al., 2012, https://arxiv.org/abs/1101.1438): since splitting a segment never increases the RSS, a
+    start s such that F(s) + RSS(s, t) > F(t) can never be the start of the last segment of an optimal solution ending
+    after t+1 (F being the optimal cost of the prefixes). The RSS of each segment is obtained in constant time from the
+    cumulative sums of the (centered) values, as floats. The duration is linear when the number of breakpoints grows
+    with the number of points, quadratic in the worst case (a single segment).
+    Without a penalty, the error of the mode (N*log(RSS/N) plus log(N) or 2 per parameter) is minimized instead, by
+    majorization-minimization: the logarithm being concave, N*log(RSS) is at most N*log(R) + N*(RSS-R)/R, so the
+    segmentation minimizing RSS plus a penalty R/N*log(N) (or 2*R/N) per parameter, where R is the RSS of the current
+    segmentation, has a lower error. The dynamic program is repeated, starting with a single segment, until the
+    breakpoints do not change. This is a local minimum, the penalty of the true minimum is not known in advance.'''
+    if config.mode == 'log':
+        raise ValueError('The optimal segmentation is not available in log mode.')
+    if config.mode == 'weighted':
+        if 0 in x:
+            raise ValueError('The weighted mode is undefined for x=0.')
+        a = [1/float(xx) for xx in x]
+        b = [float(yy)/float(xx) for xx, yy in zip(x, y)]
+    else:
+        a = [float(xx) for xx in x]
+        b = [float(yy) for yy in y]
+    n = len(a)
+    starts = [i for i in range(n) if i == 0 or x[i] != x[i-1]]  # first point of each group
+    nb_groups = len(starts)
+    starts.append(n)
+    if nb_groups < 4:  # at least two groups per segment
+        return []
+    mean_a = math.fsum(a) / n
+    mean_b = math.fsum(b) / n
+    a = [aa - mean_a for aa in a]
+    b = [bb - mean_b for bb in b]
+    sums = [[0.] + list(itertools.accumulate(values)) for values in
+            (a, b, (aa*aa for aa in a), (aa*bb for aa, bb in zip(a, b)), (bb*bb for bb in b))]
+    if numpy is not None:  # the candidate starts of the last segment are evaluated in a single vectorized pass
+        sums = [numpy.array(values) for values in sums]
+        starts = numpy.array(starts)
+    sum_a, sum_b, sum_aa, sum_ab, sum_bb = sums
+
+    def RSS(s, t):
+        '''RSS of the regression of the groups s to t-1 (s can be an array of starts, with numpy).'''
+        i, j = starts[s], starts[t]
+        size = j - i
+        A = sum_a[j] - sum_a[i]
+        B = sum_b[j] - sum_b[i]
+        M2_a = sum_aa[j] - sum_aa[i] - A*A/size
+        M2_b = sum_bb[j] - sum_bb[i] - B*B/size
+        C_ab = sum_ab[j] - sum_ab[i] - A*B/size
+        return M2_b - C_ab*C_ab/M2_a
+
+    def segmentation(penalty):
+        '''Return the first group of each segment (except the first one) of the optimal segmentation.'''
+        cost = [math.inf]*(nb_groups+1)  # cost[t]: optimal cost of the groups 0 to t-1
+        cost[0] = -penalty
+        last_start = [0]*(nb_groups+1)
+        # the candidates are sorted, the last one is t-1, whose segment [t-1, t[ would have a single group
+        candidates = [0, 1]
+        dominated = [False]*(nb_groups+1)
+        if numpy is not None:
+            cost = numpy.array(cost)
+            candidates = numpy.array(candidates)
+            dominated = numpy.array(dominated)
+            for t in range(2, nb_groups+1):
+                evaluated = candidates[:-1]
+                values = cost[evaluated] + numpy.maximum(RSS(evaluated, t), 0.)
+                k = values.argmin()
+                last_start[t] = int(evaluated[k])
+                cost[t] = values[k] + penalty
+                # a start dominated at t-1 is still needed at t, since the segment [t-1, t[ has a single group
+                candidates = numpy.append(candidates[~dominated[candidates]], t)
+                dominated[evaluated[values > cost[t]]] = True
+        else:
+            for t in range(2, nb_groups+1):
+                evaluated = candidates[:-1]
+                values = [cost[s] + max(RSS(s, t), 0.) for s in evaluated]
+                k = min(range(len(values)), key=values.__getitem__)
+                last_start[t] = evaluated[k]
+                cost[t] = values[k] + penalty
+                candidates = [s for s in candidates if not dominated[s]] + [t]
+                for s, value in zip(evaluated, values):
+                    dominated[s] = value > cost[t]
+        bounds = []
+        t = last_start[nb_groups]
+        while t > 0:
+            bounds.append(t)
+            t = last_start[t]
+        bounds.reverse()
+        return bounds
+
+    if penalty is not None:
+        bounds = segmentation(penalty)
+    else:
+        leaf = leaf_class(x, y, config)([], [], config=config)
+        nb_params = leaf.nb_params + 1  # the parameters of the leaf and the breakpoint
+        param_penalty = 2 if config.mode == 'AIC' else math.log(n)
+        min_RSS = float(config.epsilon)**2  # see information_criteria
+        bounds, new_bounds = [], None
+        while new_bounds != bounds:
+            if new_bounds is not None:
+                bounds = new_bounds
+            segments = [0] + bounds + [nb_groups]
+            total_RSS = sum(max(RSS(s, t), 0.) for s, t in zip(segments, segments[1:]))
+            new_bounds = segmentation(nb_params * param_penalty * max(total_RSS, min_RSS) / n)
+    return [x[starts[t]-1] for t in bounds]
+
+
+def compute_regression(x, y=None, *, breakpoints=None, mode='BIC', epsilon=None, engine='python',
+                       log_solver='gradient', n_jobs=1, executor=None, nb_chunks=1, aggregate=False, nb_bins=None,
+                       binning='quantile', refine=False, optimal=False, penalty=None, max_depth=None,
+                       min_points_per_segment=None, min_distinct_x_per_segment=None, max_breakpoints=None,
+                       order='depth', profile=False):
     '''Compute a segmented linear regression.
     The data can be given either as a tuple of two lists, or a list of tuples (each one of size 2).
     The first values represent the x, the second values represent the y.
+    With engine='numpy', the errors of all the splits are computed in a single vectorized pass (AIC and BIC modes
+    only, the other modes are not affected). This requires numpy and uses floating point arithmetic.
+    In log mode, log_solver='lm' fits the parameters of each segment with the Levenberg-Marquardt algorithm instead of a
+    gradient descent, which is much faster.
+    When all the values are floats (or integers exactly representable as floats), they are converted to floats and the
+    regression uses the specialized FloatLeaf class. Otherwise (e.g. Fraction or Decimal), the generic Leaf class is
+    used, with the arithmetic of the given numbers.
+    With n_jobs > 1, the independent subtrees are fitted in parallel by a pool of n_jobs processes. Alternatively, an
+    executor from concurrent.futures can be given (e.g. a ProcessPoolExecutor shared between several calls). The
+    resulting regression is the same.
+    With nb_chunks > 1 (and n_jobs > 1 or an executor), the split candidates of the root are also divided in nb_chunks
+    contiguous chunks evaluated in parallel, which is useful for the log and weighted modes, where the evaluation of
+    each candidate is O(n). This is not supported with log_solver='lm'.
+    With aggregate=True, the pairs sharing the same x are collapsed into groups that are moved as a whole during the
+    split search (see GroupedLeaf), so that the cost depends on the number of distinct x values instead of the number
+    of pairs. This is useful when each x is measured many times. The regression is the same, up to rounding errors.
+    With nb_bins, the search of each split is approximate: the error is only evaluated for at most nb_bins-1
+    candidates, the x values at the quantiles of the dataset (binning='quantile') or at log-spaced bounds
+    (binning='log', for sizes sampled on an exponential scale). With refine=True, all the splits between the two
+    candidates adjacent to the best one are then evaluated. The elements are not moved one group at a time: the dataset
+    is cut into blocks at the candidates, so the search costs O(n) to build them plus a number of error evaluations
+    that depends on the number of bins instead of n.
+    The greedy search can be bounded: the nodes deeper than max_depth are not split, the splits leaving less than
+    min_points_per_segment points or min_distinct_x_per_segment distinct x values on a side are not considered (and
+    not evaluated), and at most max_breakpoints breakpoints are made (the nodes searched once they are all used are
+    left unsplit). With extend, the subtrees that are fitted again get their own max_depth and max_breakpoints. These
+    limits do not apply to optimal=True.
+    The tree is built without recursion, the nodes are searched in the given order: 'depth' (depth-first), 'breadth'
+    (level by level) or 'largest' (the nodes with the most points first). The tree is the same for all the orders,
+    except with max_breakpoints, which gives the breakpoints to the first nodes in this order.
+    With optimal=True, the greedy search is replaced by an exact dynamic program, which returns the FlatRegression that
+    minimizes the RSS (weighted RSS in weighted mode) plus the given penalty per segment, or a penalty derived from the
+    mode and from an estimate of the noise by default (see optimal_breakpoints). It is not affected by the bad choices
+    of the top-level splits of the greedy search, but it does not support the log mode.
+    The data can also be given as the path of a CSV or .npy file, or as an iterator of chunks (see read_dataset). The
+    pairs are then read as floats in compact arrays, sorted, and added to the regression directly from these arrays,
+    so that the whole dataset is never held as Python objects.
+    With profile=True, the operations of the fit are counted and timed in a Profile, available as the profile attribute
+    of the resulting regression (a Profile can also be given, to accumulate the operations of several fits, and None
+    is the same as False). Only the fit is profiled, not the later operations on the regression. This is not supported
+    with n_jobs > 1 or an executor, the operations of the other processes could not be counted.
     '''
-    if y is not None:
-        assert len(x) == len(y)
-        dataset = list(zip(x, y))
+    if profile is True:
+        profile = Profile()
+    elif profile is False:
+        profile = None
+    elif profile is not None and not isinstance(profile, Profile):
+        raise ValueError('The profile must be a boolean, None or a Profile, got %r.' % (profile,))
+    if profile is not None and (executor is not None or n_jobs > 1):
+        raise ValueError('The profiling is not supported with n_jobs > 1 or an executor.')
+    if nb_chunks > 1 and mode == 'log' and log_solver == 'lm':
+        raise ValueError('The chunked split search is not supported with the lm solver.')
+    if isinstance(x, (str, os.PathLike)) or (y is None and iter(x) is x):
+        # path or iterator of chunks: compact arrays of floats, already sorted
+        x, y = read_dataset(x)
     else:
-        dataset = x
-    assert all([len(d) == 2 for d in dataset])
-    dataset = sorted(dataset)
-    x = [d[0] for d in dataset]
-    y = [d[1] for d in dataset]
+        if y is not None:
+            assert len(x) == len(y)
+            dataset = list(zip(x, y))
+        else:
+            dataset = x
+        assert all([len(d) == 2 for d in dataset])
+        dataset = sorted(dataset)
+        x = [d[0] for d in dataset]
+        y = [d[1] for d in dataset]
+        del dataset
+        # only floats and integers that are exactly representable as floats: use the specialized FloatLeaf
+        x, y = convert_floats(x, y)
     if epsilon:
         assert epsilon > 0
     else:
-        epsilon = min([abs(yy) for yy in y])
-    config = Config(mode, epsilon)
+        epsilon = min(abs(yy) for yy in y)
+    config = Config(mode, epsilon, engine, log_solver, aggregate, nb_bins, binning, refine, max_depth,
+                    min_points_per_segment, min_distinct_x_per_segment, max_breakpoints, order, profile)
     if breakpoints is not None:
-        return FlatRegression(x, y, config=config, breakpoints=breakpoints)
-    reg = Node(Leaf(x, y, config=config), Leaf(
-        [], [], config=config)).compute_best_fit()
+        reg = FlatRegression(x, y, config=config, breakpoints=breakpoints)
+    elif optimal:
+        reg = FlatRegression(x, y, config=config, breakpoints=optimal_breakpoints(x, y, config, penalty))
+    else:
+        leaf_cls = leaf_class(x, y, config)
+        root = Node(leaf_cls(x, y, config=config), leaf_cls([], [], config=config))
+        if executor is not None:
+            return root.compute_best_fit_parallel(executor, nb_chunks=nb_chunks)
+        if n_jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                return root.compute_best_fit_parallel(executor, nb_chunks=nb_chunks)
+        reg = root.compute_best_fit()
+    if profile is not None:
+        config.profile = None  # the fit is done, see Profile
+        reg.profile = profile
     return reg
+
+
+class WindowedRegression:
+    '''Segmented linear regression of the last size pairs (x, y) of a stream, e.g. to monitor the drift of a running
+    benchmark. The oldest pair is removed when a new pair is added to a full window.
+    The breakpoints are computed by compute_regression (with the given keyword arguments) only when refit is called,
+    or on the first query. In between, they are kept and each segment is updated in constant amortized time: it is a
+    queue made of two leaves, the new pairs are added to the back leaf and the oldest ones are popped from the front
+    leaf, which is refilled from the back leaf (in reverse order) when it is empty. Each pair is therefore added and
+    removed at most twice, with the exact pop of Moments.
+    With refit_every, a query also refits the regression when at least refit_every pairs were added since the last fit.
+    '''
+
+    def __init__(self, size: int, *, refit_every: Union[None, int] = None, **kwargs) -> None:
+        assert size > 0
+        self.size = size
+        self.refit_every = refit_every
+        self.kwargs = kwargs
+        self.points: deque = deque()
+        self.config: Union[None, Config] = None
+        self.__breakpoints: List[Any] = []
+        self.__segments: List[Tuple[Leaf, Leaf]] = []  # (front, back) for each segment
+        self.__nb_added = 0  # number of pairs added since the last fit
+        self.__frozen: Union[None, FrozenRegression] = None
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def __iter__(self) -> Generator[Tuple[Any, Any], None, None]:
+        '''Iterate over the pairs (x, y) of the window, from the oldest to the newest.'''
+        yield from self.points
+
+    def add(self, x: Number, y: Number) -> None:
+        '''Add the pair (x, y) to the window, and remove the oldest pair if the window was full.'''
+        (x,), (y,) = convert_floats([x], [y])
+        self.points.append((x, y))
+        self.__nb_added += 1
+        self.__frozen = None
+        if self.config is not None:
+            if self.__segments[0][1].__class__ is FloatLeaf and leaf_class([x], [y]) is not FloatLeaf:
+                self.__fill_segments(Leaf)  # not only floats anymore
+            else:
+                self.__segments[bisect.bisect_left(self.__breakpoints, x)][1].add(x, y)
+        if len(self.points) > self.size:
+            old_x, old_y = self.points.popleft()
+            if self.config is not None:
+                front, back = self.__segments[bisect.bisect_left(self.__breakpoints, old_x)]
+                if len(front) == 0:  # the oldest pairs of the segment are at the bottom of the back leaf
+                    while len(back) > 0:
+                        front.add(*back.pop())
+                front.pop()
+
+    def extend(self, points) -> None:
+        '''Add the given pairs (x, y) to the window, in this order.'''
+        for x, y in points:
+            self.add(x, y)
+
+    def __fill_segments(self, leaf_cls: type) -> None:
+        '''Create the segments of the current breakpoints with the pairs of the window, in their order of arrival.'''
+        assert self.config is not None
+        self.__segments = [(leaf_cls([], [], config=self.config), leaf_cls([], [], config=self.config))
+                           for _ in range(len(self.__breakpoints)+1)]
+        for x, y in self.points:
+            self.__segments[bisect.bisect_left(self.__breakpoints, x)][1].add(x, y)
+
+    def refit(self) -> None:
+        '''Compute the breakpoints of the regression of the pairs of the window.'''
+        if len(self.points) == 0:
+            raise ValueError('Cannot fit an empty window.')
+        reg = compute_regression(list(self.points), **self.kwargs)
+        self.config = reg.config
+        self.__breakpoints = reg.breakpoints
+        x = [p[0] for p in self.points]
+        y = [p[1] for p in self.points]
+        self.__fill_segments(leaf_class(x, y, self.config))
+        self.__nb_added = 0
+        self.__frozen = None
+
+    def __check_fit(self) -> None:
+        if self.config is None or (self.refit_every is not None and self.__nb_added >= self.refit_every):
+            self.refit()
+
+    @property
+    def breakpoints(self) -> List[Number]:
+        '''Return the breakpoints of the last fit.'''
+        self.__check_fit()
+        return list(self.__breakpoints)
+
+    def _leaves(self) -> List[Leaf]:
+        '''Return the current leaves of the segments (their pairs are not sorted). The statistics of the two parts of
+        each segment are combined in constant time, only the pairs are copied.'''
+        self.__check_fit()
+        return [front + back for front, back in self.__segments]
+
+    def flatify(self) -> FlatRegression:
+        '''Return a FlatRegression of the pairs of the window, with the breakpoints of the last fit.'''
+        leaves = self._leaves()
+        for leaf in leaves:
+            leaf.stats.sort()
+        return FlatRegression.from_leaves(leaves, self.__breakpoints)
+
+    def freeze(self) -> FrozenRegression:
+        '''Return the current regression (the breakpoints of the last fit and the current parameters of the segments),
+        as a FrozenRegression. It is cached until the next pair is added.'''
+        self.__check_fit()
+        if self.__frozen is None:
+            self.__frozen = FlatRegression.from_leaves(self._leaves(), self.__breakpoints).freeze()
+        return self.__frozen
+
+    @property
+    def segments(self) -> Tuple[Summary, ...]:
+        '''Return the summaries of the segments, with their current parameters (see Leaf.summary).'''
+        return self.freeze().segments
+
+    @property
+    def error(self) -> float:
+        return self.freeze().error
+
+    def predict(self, x: Number) -> Number:
+        '''Return a prediction of y for the variable x by using the current regression.'''
+        return self.freeze().predict(x)
+
+    def predict_many(self, xs):
+        '''Return the predictions of y for all the variables x of the given sequence (see AbstractReg.predict_many).'''
+        return self.freeze().predict_many(xs)
@@ -1,19 +1,32 @@
 #! /usr/bin/env python3
 
 import unittest
+import itertools
+import inspect
+import math
 import random
+import csv
+import pickle
+import copy
+import tempfile
+import concurrent.futures
+from array import array
 import numpy
 from decimal import Decimal
 from fractions import Fraction
 import graphviz
+import pandas
 import mock
 import os
+import sys
 import matplotlib as mpl
 # Needed for running the tests on Travis:
 if os.environ.get('DISPLAY', '') == '':
     print('No display found. Using non-interactive Agg backend.')
     mpl.use('Agg')
-from pycewise import Node, Leaf, IncrementalStat, compute_regression, Config, FlatRegression # noqa: 402
+from pycewise import Node, Leaf, FloatLeaf, GroupedLeaf, IncrementalStat, Moments, FloatMoments, GroupedMoments, \
+    compute_regression, Config, Profile, FlatRegression, FrozenRegression, WindowedRegression, read_dataset  # noqa: 402
+from pycewise.reg import Group, StatisticsLeaf  # noqa: 402
 
 DEFAULT_MODE = 'BIC'
 
@@ -33,6 +46,16 @@ def generate_dataset(intercept, coeff, size, min_x, max_x, cls=float, repeat=1):
     return dataset
 
 
+def read_csv(filename):
+    with open(os.path.join(os.path.dirname(__file__), 'test_data', filename)) as f:
+        reader = csv.DictReader(f)
+        x, y = [], []
+        for row in reader:
+            x.append(float(row['size']))
+            y.append(float(row['duration']))
+    return x, y
+
+
 class IncrementalStatTest(unittest.TestCase):
     def test_basic(self):
         size = random.randint(50, 100)
@@ -67,6 +90,71 @@ class IncrementalStatTest(unittest.TestCase):
             self.assertEqual(numpy.var(values, ddof=1),  stats.var)
             self.assertEqual(sum(values),        stats.sum)
 
+    def test_insert(self):
+        for cls, moments_cls in [(float, Moments), (Fraction, Moments), (float, FloatMoments),
+                                 (Fraction, GroupedMoments)]:
+            for weighted, reverse in itertools.product([False, True], repeat=2):
+                pairs = [(cls(random.randint(1, 20)), cls(random.uniform(1, 100))) for _ in range(60)]
+                stats, expected = moments_cls(weighted=weighted), moments_cls(weighted=weighted)
+                for xx, yy in sorted(pairs[:30], reverse=reverse):
+                    stats.add(xx, yy)
+                for xx, yy in pairs[30:]:
+                    stats.insert(xx, yy, reverse=reverse)
+                for xx, yy in sorted(pairs, reverse=reverse):
+                    expected.add(xx, yy)
+                self.assertEqual(list(stats), list(expected))
+                names = Moments.statistics + (Moments.weighted_statistics if weighted else ())
+                for name in names:
+                    self.assertAlmostEqual(float(getattr(stats, name)), float(getattr(expected, name)), delta=1e-6)
+                # the history is rebuilt when the pairs are removed
+                for _ in range(30):
+                    self.assertEqual(stats.pop(), expected.pop())
+                for name in names:
+                    self.assertAlmostEqual(float(getattr(stats, name)), float(getattr(expected, name)), delta=1e-6)
+
+    def test_compact_storage(self):
+        stats = IncrementalStat()
+        values = [random.uniform(0, 100) for _ in range(50)]
+        for val in values:
+            stats.add(val)
+        self.assertIsInstance(stats.values, array)
+        self.assertEqual(list(stats), values)
+        self.assertAlmostEqual(numpy.var(values, ddof=1), stats.var)
+        # adding an exact number switches back to the generic storage
+        values.append(Fraction(1, 3))
+        stats.add(values[-1])
+        self.assertIsInstance(stats.values, list)
+        self.assertEqual(stats.last, Fraction(1, 3))
+        self.assertAlmostEqual(numpy.var([float(v) for v in values], ddof=1), float(stats.var))
+        while len(stats) > 0:
+            self.assertEqual(stats.pop(), values.pop())
+        stats.add(1.5)
+        self.assertIsInstance(stats.values, array)
+        self.assertEqual(stats.mean, 1.5)
+
+    def test_add(self):
+        for cls in [float, Fraction]:
+            values1 = [cls(random.uniform(0, 100)) for _ in range(random.randint(0, 50))]
+            values2 = [cls(random.uniform(0, 100)) for _ in range(random.randint(2, 50))]
+            stats1, stats2 = IncrementalStat(), IncrementalStat()
+            for val in values1:
+                stats1.add(val)
+            for val in values2:
+                stats2.add(val)
+            values = values1 + values2
+            stats = stats1 + stats2
+            self.assertEqual(list(stats), values)
+            self.assertEqual(list(stats1), values1)
+            self.assertAlmostEqual(float(stats.mean), numpy.mean([float(v) for v in values]))
+            self.assertAlmostEqual(float(stats.var), numpy.var([float(v) for v in values], ddof=1))
+            stats.add(cls(3))
+            self.assertEqual(stats.pop(), cls(3))
+            # the history of the aggregated values is rebuilt when needed
+            while len(values) > 2:
+                self.assertEqual(stats.pop(), values.pop())
+                self.assertAlmostEqual(float(stats.mean), numpy.mean([float(v) for v in values]))
+                self.assertAlmostEqual(float(stats.var), numpy.var([float(v) for v in values], ddof=1))
+
     def test_func(self):
         def f(x): return x**2 - x + 4
         size = random.randint(50, 100)
@@ -89,6 +177,143 @@ class IncrementalStatTest(unittest.TestCase):
             self.assertAlmostEqual(sum(values),        stats.sum)
 
 
+class MomentsTest(unittest.TestCase):
+    def generic_test(self, cls, weighted, moments_cls=Moments):
+        size = random.randint(50, 100)
+        x = [cls(random.uniform(1, 100)) for _ in range(size)]
+        y = [cls(random.uniform(1, 100)) for _ in range(size)]
+        stats = moments_cls(weighted=weighted)
+        states = []
+        for xx, yy in zip(x, y):
+            states.append(dict(vars(stats)))
+            stats.add(xx, yy)
+        self.assertEqual(list(stats), list(zip(x, y)))
+        fx = numpy.array([float(xx) for xx in x])
+        fy = numpy.array([float(yy) for yy in y])
+        u = 1/fx
+        v = fy/fx
+        self.assertAlmostEqual(float(stats.mean_x), numpy.mean(fx))
+        self.assertAlmostEqual(float(stats.mean_y), numpy.mean(fy))
+        self.assertAlmostEqual(float(stats.M2_x), numpy.var(fx)*size, delta=1e-6)
+        self.assertAlmostEqual(float(stats.M2_y), numpy.var(fy)*size, delta=1e-6)
+        self.assertAlmostEqual(float(stats.C_xy), numpy.cov(fx, fy, ddof=0)[0, 1]*size, delta=1e-6)
+        if weighted:
+            self.assertAlmostEqual(float(stats.mean_u), numpy.mean(u))
+            self.assertAlmostEqual(float(stats.M2_v), numpy.var(v)*size, delta=1e-6)
+            self.assertAlmostEqual(float(stats.C_xu), numpy.cov(fx, u, ddof=0)[0, 1]*size, delta=1e-6)
+            self.assertAlmostEqual(float(stats.C_yu), numpy.cov(fy, u, ddof=0)[0, 1]*size, delta=1e-6)
+            self.assertAlmostEqual(float(stats.C_uv), numpy.cov(u, v, ddof=0)[0, 1]*size, delta=1e-6)
+        # removing the pairs restores exactly the previous states
+        while len(stats) > 0:
+            self.assertEqual(stats.pop(), (x.pop(), y.pop()))
+            state = states.pop()
+            for name in state:
+                if name.startswith('mean') or name.startswith('M2') or name.startswith('C_'):
+                    self.assertEqual(getattr(stats, name), state[name])
+
+    def test_float(self):
+        self.generic_test(float, weighted=False)
+        self.generic_test(float, weighted=True)
+
+    def test_fraction(self):
+        self.generic_test(Fraction, weighted=False)
+        self.generic_test(Fraction, weighted=True)
+
+    def test_float_moments(self):
+        self.generic_test(float, weighted=False, moments_cls=FloatMoments)
+        self.generic_test(float, weighted=True, moments_cls=FloatMoments)
+        # same operations than the generic implementation, hence the same statistics
+        for weighted in [False, True]:
+            stats, float_stats = Moments(weighted=weighted), FloatMoments(weighted=weighted)
+            for _ in range(100):
+                xx, yy = random.uniform(1, 100), random.uniform(1, 100)
+                stats.add(xx, yy)
+                float_stats.add(xx, yy)
+            self.assertEqual(vars(stats)['C_xy'], vars(float_stats)['C_xy'])
+            self.assertEqual(vars(stats)['M2_y'], vars(float_stats)['M2_y'])
+            if weighted:
+                self.assertEqual(vars(stats)['C_uv'], vars(float_stats)['C_uv'])
+
+    def test_grouped_moments(self):
+        for weighted in [False, True]:
+            self.generic_test(float, weighted, moments_cls=GroupedMoments)
+            self.generic_test(Fraction, weighted, moments_cls=GroupedMoments)
+            # the groups give exactly the statistics of the pairs
+            stats, grouped = Moments(weighted=weighted), GroupedMoments(weighted=weighted)
+            groups, states = [], []
+            for _ in range(30):
+                x = Fraction(random.randint(1, 1000), 10)
+                y_values = [Fraction(random.randint(1, 1000), 10) for _ in range(random.randint(1, 5))]
+                groups.append(Group(x, y_values, None, None))
+                states.append({name: getattr(grouped, name) for name in Moments.statistics})
+                for y in y_values:
+                    stats.add(x, y)
+                grouped.add_group(groups[-1])
+                for name in Moments.statistics + (Moments.weighted_statistics if weighted else ()):
+                    self.assertEqual(getattr(grouped, name), getattr(stats, name))
+            self.assertEqual(list(grouped), list(stats))
+            self.assertEqual(len(grouped), len(stats))
+            # a single pair can still be removed, the rest of its group stays
+            last = groups[-1]
+            self.assertEqual(grouped.pop(), stats.pop())
+            if len(last.y_values) > 1:
+                self.assertEqual(grouped.pop_group(len(last.y_values)-1).y_values, last.y_values[-2::-1])
+            states.pop()
+            groups.pop()
+            while groups:
+                group = groups.pop()
+                popped = grouped.pop_group(len(group.y_values))
+                self.assertEqual((popped.x, popped.y_values), (group.x, group.y_values[::-1]))
+                self.assertEqual(popped.mean_y, sum(group.y_values)/len(group.y_values))
+                state = states.pop()
+                for name in Moments.statistics:
+                    self.assertEqual(getattr(grouped, name), state[name])
+            self.assertEqual(len(grouped), 0)
+
+    def generic_test_combine(self, cls, weighted, moments_cls=Moments):
+        x = [cls(random.uniform(1, 100)) for _ in range(random.randint(50, 100))]
+        y = [cls(random.uniform(1, 100)) for _ in range(len(x))]
+        limit = random.randint(0, len(x))
+        stats1, stats2, expected = moments_cls(weighted=weighted), moments_cls(weighted=weighted), \
+            moments_cls(weighted=weighted)
+        for xx, yy in zip(x[:limit], y[:limit]):
+            stats1.add(xx, yy)
+        for xx, yy in zip(reversed(x[limit:]), reversed(y[limit:])):
+            stats2.add(xx, yy)
+        for xx, yy in zip(x, y):
+            expected.add(xx, yy)
+        stats = stats1.combine(stats2, 1, -1)
+        self.assertEqual(list(stats), list(zip(x, y)))
+        self.assertEqual(stats.x_values.__class__, expected.x_values.__class__)
+        names = Moments.statistics + (Moments.weighted_statistics if weighted else ())
+        for name in names:
+            if cls is Fraction:
+                self.assertEqual(getattr(stats, name), getattr(expected, name))
+            else:
+                self.assertAlmostEqual(getattr(stats, name), getattr(expected, name), delta=1e-6)
+        # the history is rebuilt when the pairs are removed
+        stats.add(cls(3), cls(4))
+        self.assertEqual(stats.pop(), (cls(3), cls(4)))
+        for _ in range(len(x)//2):
+            self.assertEqual(stats.pop(), expected.pop())
+            for name in names:
+                self.assertAlmostEqual(float(getattr(stats, name)), float(getattr(expected, name)), delta=1e-6)
+
+    def test_combine(self):
+        for weighted in [False, True]:
+            self.generic_test_combine(float, weighted)
+            self.generic_test_combine(Fraction, weighted)
+            self.generic_test_combine(float, weighted, moments_cls=FloatMoments)
+
+    def test_compact_storage(self):
+        stats = Moments()
+        stats.add(1.5, 2.5)
+        self.assertIsInstance(stats.x_values, array)
+        stats.add(Fraction(1, 2), Fraction(3, 2))
+        self.assertIsInstance(stats.x_values, list)
+        self.assertEqual(list(stats), [(1.5, 2.5), (Fraction(1, 2), Fraction(3, 2))])
+
+
 class LeafTest(unittest.TestCase):
     def setUp(self):
         self.coeff = random.uniform(0, 100)
@@ -129,11 +354,11 @@ class LeafTest(unittest.TestCase):
             node = Leaf(x, y, config=self.config)
             self.perform_tests(x, y, node, noise > 0)
 
-    def perform_test_other_modes(self, mode):
+    def perform_test_other_modes(self, mode, **kwargs):
         for noise in [0, 1, 2, 4, 8]:
             x = [d[0] for d in self.data]
             y = [d[1] + random.gauss(0, noise) for d in self.data]
-            config = Config(mode=mode, epsilon=1e-6)
+            config = Config(mode=mode, epsilon=1e-6, **kwargs)
             node = Leaf(x, y, config=config)
             self.assertAlmostEqual(node.coeff,     self.coeff,      delta=1)
             self.assertAlmostEqual(node.intercept, self.intercept,  delta=3*(noise+0.001))
@@ -150,6 +375,50 @@ class LeafTest(unittest.TestCase):
     def test_log(self):
         self.perform_test_other_modes('log')
 
+    def test_log_lm(self):
+        self.perform_test_other_modes('log', log_solver='lm')
+        x = [d[0] for d in self.data]
+        y = [d[1] * random.lognormvariate(0, 0.1) for d in self.data]
+        node = Leaf(x, y, config=Config(mode='log', epsilon=1e-6))
+        start_coeff = abs(node._compute_classical_coeff())
+        start_intercept = abs(node._compute_classical_intercept())
+        gradient = node._compute_log_parameters(start_coeff=start_coeff, start_intercept=start_intercept,
+                                                eps=1e-15, return_search=True)
+        lm = node._compute_log_parameters_lm(start_coeff=start_coeff, start_intercept=start_intercept,
+                                             return_search=True)
+        self.assertLessEqual(len(lm), 20)
+        self.assertLessEqual(lm.error.iloc[-1], gradient.error.iloc[-1] + 1e-9)
+        self.assertGreater(lm.coefficient.iloc[-1], 0)
+        self.assertGreater(lm.intercept.iloc[-1], 0)
+        # warm start: removing a few points gives the same fit than a fit from scratch
+        node = Leaf(x, y, config=Config(mode='log', epsilon=1e-6, log_solver='lm'))
+        for _ in range(3):
+            node.compute_log_parameters()
+            node.pop()
+            expected = Leaf(*zip(*node), config=node.config)
+            RSSlog = expected.compute_RSSlog()
+            self.assertAlmostEqual(node.compute_RSSlog(), RSSlog, delta=RSSlog*1e-6)
+        # the unconstrained optimum has a negative intercept, it has to stay positive
+        y = [10*xx - 5 for xx in range(1, 20)]
+        node = Leaf(list(range(1, 20)), y, config=Config(mode='log', epsilon=1e-6, log_solver='lm'))
+        self.assertGreater(node.intercept, 0)
+        self.assertGreater(node.coeff, 0)
+
+    def test_weighted_incremental(self):
+        config = Config(mode='weighted', epsilon=1e-6)
+        x = [d[0] for d in self.data]
+        y = [d[1] + random.gauss(0, 4) for d in self.data]
+        node = Leaf(x, y, config=config)
+        for _ in range(self.size - 2):
+            coeff, intercept = node._compute_weighted_parameters([1/xx for xx in node.x])
+            self.assertAlmostEqual(node.coeff, coeff)
+            self.assertAlmostEqual(node.intercept, intercept)
+            WRSS = sum(((yy - node.predict(xx))/xx)**2 for xx, yy in node)
+            self.assertAlmostEqual(node.compute_weighted_RSS(), WRSS)
+            node.pop()
+        node.add(0, 1)
+        self.assertEqual(node.error, float('inf'))
+
     def test_add_remove(self):
         for noise in [0, 1, 2, 4, 8]:
             x = [d[0] for d in self.data]
@@ -180,6 +449,31 @@ class LeafTest(unittest.TestCase):
             self.assertAlmostEqual(leaf.MSE, 0)
             self.assertEqual(leaf.x.values, list(sorted(l1.x.values + l2.x.values)))
             self.assertEqual(leaf.x.values, list(sorted(l1.y.values + l2.y.values)))
+            leaf = l2 + l1
+            self.assertEqual(list(leaf), list(sorted(l2)) + list(l1))
+        for mode in ['BIC', 'weighted']:
+            config = Config(mode=mode, epsilon=1e-6)
+            x = [d[0] for d in self.data]
+            y = [d[1] + random.gauss(0, 4) for d in self.data]
+            limit = self.size // 3
+            expected = FloatLeaf(x, y, config=config)
+            leaf = FloatLeaf(x[:limit], y[:limit], config=config) + \
+                FloatLeaf(x[:limit-1:-1], y[:limit-1:-1], config=config)
+            self.assertIsInstance(leaf, FloatLeaf)
+            self.assertEqual(list(leaf), list(expected))
+            self.assertAlmostEqual(leaf.coeff, expected.coeff)
+            self.assertAlmostEqual(leaf.intercept, expected.intercept)
+            self.assertAlmostEqual(leaf.RSS, expected.RSS, delta=1e-6)
+            # the weighted statistics lose some precision when x is close to 0, in both computations
+            self.assertAlmostEqual(leaf.error, expected.error, delta=abs(expected.error)*1e-4)
+            with self.assertRaises(AttributeError):
+                leaf.counter_y
+            self.assertEqual(leaf.counter_x, expected.counter_x)
+            # the merged leaf can be modified like any other leaf
+            for _ in range(limit):
+                self.assertEqual(leaf.pop(), expected.pop())
+                self.assertAlmostEqual(leaf.error, expected.error, delta=abs(expected.error)*1e-4)
+            self.assertEqual(leaf.counter_x, expected.counter_x)
 
     def assert_equal_reg(self, dataset1, dataset2):
         leaf1 = Leaf([d[0] for d in dataset1], [d[1]
@@ -222,6 +516,24 @@ class NodeTest(unittest.TestCase):
         self.assertEqual(reg.breakpoints, [])
         self.assertEqual(list(reg), list(sorted(dataset)))
 
+    def test_nosplit_summary(self):
+        config = Config(mode='BIC', epsilon=1)
+        x, y = zip(*generate_dataset(intercept=3, coeff=2, size=50, min_x=0, max_x=100))
+        leaf = Leaf(sorted(x), [2*xx + 3 for xx in sorted(x)], config=config)
+        expected = (leaf.error, leaf.mean_x, leaf.mean_y, leaf.std_x, leaf.cov)
+        node = Node(leaf, Leaf([], [], config=config))
+        self.assertNotIsInstance(node.nosplit, Leaf)
+        self.assertEqual(node.nosplit.error, leaf.error)
+        self.assertEqual(node.nosplit.nb_points, len(leaf))
+        self.assertAlmostEqual(node.nosplit.coeff, 2)
+        self.assertAlmostEqual(node.nosplit.intercept, 3)
+        self.assertEqual(node.nosplit.stats[0], len(leaf))
+        # no split: the leaf is given back, in the same state
+        reg = node.compute_best_fit()
+        self.assertIs(reg, leaf)
+        self.assertEqual((leaf.error, leaf.mean_x, leaf.mean_y, leaf.std_x, leaf.cov), expected)
+        self.assertEqual(list(reg), list(zip(sorted(x), [2*xx + 3 for xx in sorted(x)])))
+
     def test_singlesplit(self):
         intercept_1 = random.uniform(0, 50)
         coeff_1 = random.uniform(0, 50)
@@ -326,6 +638,385 @@ class NodeTest(unittest.TestCase):
         self.maxDiff = None
         self.assertEqual(str(dot), expected)
 
+    def assert_same_fit(self, reg1, reg2):
+        self.assertEqual(reg1.breakpoints, reg2.breakpoints)
+        self.assertEqual(list(reg1), list(reg2))
+        self.assertEqual([d[0] for d in reg1.errors.split], [d[0] for d in reg2.errors.split])
+        for (_, err1), (_, err2) in zip(reg1.errors.split, reg2.errors.split):
+            if err1 != err2:  # infinite errors
+                self.assertTrue(reg1.error_equal(err1, err2))
+
+    def test_numpy_engine(self):
+        for mode in ['AIC', 'BIC']:
+            for repeat in [1, 5]:
+                all_datasets = [generate_dataset(intercept=i, coeff=i, size=50, min_x=(
+                    i-1)*10, max_x=i*10, repeat=repeat) for i in range(1, 9)]
+                dataset = [(x, y + random.gauss(0, 1)) for x, y in sum(all_datasets, [])]
+                self.assert_same_fit(compute_regression(dataset, mode=mode),
+                                     compute_regression(dataset, mode=mode, engine='numpy'))
+            x, y = read_csv('pingpong_remote_small.csv')
+            self.assert_same_fit(compute_regression(x, y, mode=mode),
+                                 compute_regression(x, y, mode=mode, engine='numpy'))
+        with self.assertRaises(ValueError):
+            compute_regression(dataset, engine='foo')
+
+    def test_parallel(self):
+        for mode in ['BIC', 'weighted']:
+            all_datasets = [generate_dataset(intercept=i, coeff=i, size=50, min_x=(
+                i-1)*10, max_x=i*10) for i in range(1, 9)]
+            dataset = [(x, y + random.gauss(0, 1)) for x, y in sum(all_datasets, [])]
+            reg = compute_regression(dataset, mode=mode)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                regressions = [compute_regression(dataset, mode=mode, executor=executor)]
+            regressions.append(compute_regression(dataset, mode=mode, n_jobs=2))
+            for parallel_reg in regressions:
+                self.assertEqual(str(parallel_reg), str(reg))
+                self.assertEqual(parallel_reg.breakpoints, reg.breakpoints)
+                self.assertEqual(parallel_reg.errors, reg.errors)
+                self.assertEqual(list(parallel_reg), list(reg))
+                for leaf, parallel_leaf in zip(reg._leaves(), parallel_reg._leaves()):
+                    self.assertEqual(leaf.errors, parallel_leaf.errors)
+        # no split at all
+        reg = compute_regression([1, 2, 3, 4], [2, 3, 4, 5], n_jobs=2)
+        self.assertIsInstance(reg, Leaf)
+        self.assertEqual(list(reg), [(1, 2), (2, 3), (3, 4), (4, 5)])
+
+    def test_chunked_split_search(self):
+        for mode in ['BIC', 'weighted', 'log']:
+            all_datasets = [generate_dataset(intercept=i, coeff=i, size=20, min_x=(
+                i-1)*10, max_x=i*10, repeat=random.choice([1, 3])) for i in range(1, 5)]
+            x, y = zip(*sorted((x, y + random.uniform(0, 1)) for x, y in sum(all_datasets, [])))
+            config = Config(mode=mode, epsilon=1e-6)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+                for left_to_right in [True, False]:
+                    def new_node():
+                        if left_to_right:
+                            return Node(FloatLeaf(x, y, config=config), FloatLeaf([], [], config=config))
+                        return Node(FloatLeaf([], [], config=config), FloatLeaf(x[::-1], y[::-1], config=config))
+                    reg = new_node().find_split()
+                    for nb_chunks in [2, 3, 7]:
+                        chunked_reg = new_node().find_split(executor=executor, nb_chunks=nb_chunks)
+                        # exactly the same errors, hence the same split
+                        self.assertEqual(chunked_reg.errors, reg.errors)
+                        self.assertEqual(chunked_reg.split, reg.split)
+                        self.assertEqual(list(chunked_reg.left), list(reg.left))
+                        self.assertEqual(list(chunked_reg.right), list(reg.right))
+                        self.assertEqual(chunked_reg.left.RSS, reg.left.RSS)
+                        self.assertEqual(chunked_reg.right.RSS, reg.right.RSS)
+            if mode != 'log':
+                self.assertEqual(str(compute_regression(x, y, mode=mode, n_jobs=2, nb_chunks=4)),
+                                 str(compute_regression(x, y, mode=mode)))
+        # the fits of the lm solver start from the previous one, a chunk would not start from the same fit
+        config = Config(mode='log', epsilon=1e-6, log_solver='lm')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            with self.assertRaises(ValueError):
+                Node(FloatLeaf(x, y, config=config), FloatLeaf([], [], config=config)).find_split(executor, nb_chunks=2)
+        with self.assertRaises(ValueError):
+            compute_regression(x, y, mode='log', log_solver='lm', n_jobs=2, nb_chunks=2)
+
+    def test_extend(self):
+        all_datasets = [generate_dataset(intercept=i, coeff=i, size=100, min_x=(
+            i-1)*10, max_x=i*10) for i in range(1, 5)]
+        dataset = sum(all_datasets, [])
+        random.shuffle(dataset)
+        old, new = dataset[:300], dataset[300:]
+        reg = compute_regression(old)
+        flat = reg.flatify()
+        old_leaves = [list(leaf) for leaf in reg._leaves()]
+        new_reg = reg.extend(new)
+        self.assertIs(new_reg, reg)  # the splits are still justified, the tree is updated in place
+        self.assertEqual(list(new_reg), sorted(dataset))
+        self.assertAlmostIncluded(range(10, 40, 10), new_reg.breakpoints, epsilon=2)
+        for x, y in dataset:
+            self.assertAlmostEqual(new_reg.predict(x), y)
+        # the leaves shared with the flat regression have not been modified
+        self.assertEqual([list(leaf) for leaf in flat._leaves()], old_leaves)
+        # a single point following the regression of its leaf is inserted without searching the leaf again
+        x, y = dataset[0][0] + 1e-3, dataset[0][1]
+        leaves = new_reg._leaves()
+        tail_sizes = [len(leaf.tail) for leaf in leaves if leaf.tail is not None]
+        new_reg = new_reg.update(x, y)
+        self.assertIn((x, y), list(new_reg))
+        self.assertEqual(len(new_reg), len(dataset) + 1)
+        self.assertEqual(new_reg._leaves(), leaves)
+        self.assertEqual(sum(len(leaf.tail) for leaf in leaves if leaf.tail is not None), sum(tail_sizes) + 1)
+        # a leaf whose new points justify a split becomes a node
+        leaf = compute_regression(all_datasets[0])
+        self.assertIsInstance(leaf, Leaf)
+        node = leaf.extend(all_datasets[1])
+        self.assertIsInstance(node, Node)
+        self.assertEqual(list(node), sorted(all_datasets[0] + all_datasets[1]))
+        self.assertAlmostIncluded([10], node.breakpoints, epsilon=1)
+        # also when they are added one at a time: the new regime is detected from the first ones, long before the
+        # leaf has grown by search_growth
+        reg = compute_regression(all_datasets[0])
+        for x, y in all_datasets[1][:5]:
+            reg = reg.update(x, y)
+        self.assertIsInstance(reg, Node)
+        self.assertAlmostIncluded([10], reg.breakpoints, epsilon=1)
+        # the points of a flat regression given by the tree do not move to other segments
+        dataset = [(float(x), float(x if x < 100 else 200 - x)) for x in range(1, 200)]
+        new = [(float(x), float(2*x)) for x in range(200, 300)]
+        reg = compute_regression(dataset)
+        flat = reg.flatify()
+        predictions = [flat.predict(x) for x in range(0, 300, 10)]
+        new_reg = reg.extend(new)
+        self.assertEqual([flat.predict(x) for x in range(0, 300, 10)], predictions)
+        self.assertEqual(list(flat), dataset)
+        self.assertEqual(list(new_reg), dataset + new)
+        # the new points make the split useless, the subtree is fitted again
+        old = [(x, x + (3 if x > 15 else 0)) for x in range(1, 30)]
+        new = [(x + 0.5, x + 0.5 + (3 if x < 15 else 0)) for x in range(1, 30)]
+        reg = compute_regression(old)
+        self.assertEqual(reg.breakpoints, [15])
+        new_reg = reg.extend(new)
+        self.assertIsInstance(new_reg, Leaf)
+        self.assertEqual(str(new_reg), str(compute_regression(old + new)))
+
+    def test_statistics_leaf(self):
+        for mode in ['AIC', 'BIC', 'weighted']:
+            config = Config(mode=mode, epsilon=1e-6)
+            for zero in [False, True]:
+                dataset = generate_dataset(intercept=3, coeff=2, size=90, min_x=1, max_x=30)
+                dataset = sorted([(x, y + random.gauss(0, 1)) for x, y in dataset] + ([(0.0, 3.0)] if zero else []))
+                leaves = [Leaf([x for x, _ in chunk], [y for _, y in chunk], config=config)
+                          for chunk in (dataset[:20], dataset[20:50], dataset[50:])]
+                merged = leaves[0] + leaves[1] + leaves[2]
+                stats_leaf = StatisticsLeaf(leaves)
+                self.assertEqual(len(stats_leaf), len(dataset))
+                self.assertAlmostEqual(stats_leaf.error, merged.error)
+                self.assertAlmostEqual(StatisticsLeaf([StatisticsLeaf(leaves[:2]), leaves[2]]).error, merged.error)
+                if mode == 'weighted' and zero:
+                    self.assertEqual(stats_leaf.error, float('inf'))
+
+    def test_float_leaf(self):
+        for mode in ['AIC', 'BIC', 'weighted']:
+            config = Config(mode=mode, epsilon=1e-6)
+            all_datasets = [generate_dataset(intercept=i, coeff=i, size=50, min_x=(
+                i-1)*10, max_x=i*10, repeat=random.choice([1, 3])) for i in range(1, 9)]
+            x, y = zip(*sorted((x, y + random.gauss(0, 1)) for x, y in sum(all_datasets, [])))
+            reg = Node(Leaf(x, y, config=config), Leaf([], [], config=config)).compute_best_fit()
+            float_reg = Node(FloatLeaf(x, y, config=config), FloatLeaf([], [], config=config)).compute_best_fit()
+            leaf = float_reg
+            while isinstance(leaf, Node):
+                leaf = leaf.left
+            self.assertIsInstance(leaf, FloatLeaf)
+            # same operations, hence exactly the same errors and breakpoints
+            self.assertEqual(reg.breakpoints, float_reg.breakpoints)
+            self.assertEqual(reg.errors, float_reg.errors)
+            self.assertEqual(list(reg), list(float_reg))
+        # the specialized class is used only with floats (integers are converted)
+        self.assertIsInstance(compute_regression([1.5, 2.5, 3.5], [2.0, 3.0, 4.0]), FloatLeaf)
+        reg = compute_regression([1, 2, 3], [2, 3, 4])
+        self.assertIsInstance(reg, FloatLeaf)
+        self.assertEqual(list(reg), [(1.0, 2.0), (2.0, 3.0), (3.0, 4.0)])
+        for cls in [Fraction, Decimal]:
+            reg = compute_regression([cls(1), cls(2), cls(3)], [cls(2), cls(3), cls(4)])
+            self.assertNotIsInstance(reg, FloatLeaf)
+            self.assertIsInstance(reg.coeff, cls)
+        self.assertNotIsInstance(compute_regression([1, 2**60+1, 3], [2, 3, 4]), FloatLeaf)
+
+    def test_aggregate(self):
+        for mode in ['BIC', 'weighted']:
+            all_datasets = [generate_dataset(intercept=i, coeff=i, size=20, min_x=(i-1)*10, max_x=i*10,
+                                             cls=Fraction, repeat=random.randint(1, 5)) for i in range(1, 5)]
+            x, y = zip(*((x, y + Fraction(random.randint(-100, 100), 100)) for x, y in sum(all_datasets, [])))
+            reg = compute_regression(x, y, mode=mode)
+            grouped_reg = compute_regression(x, y, mode=mode, aggregate=True)
+            self.assertIsInstance(grouped_reg._leaves()[0], GroupedLeaf)
+            self.assertEqual(grouped_reg.config, Config(mode, reg.config.epsilon, aggregate=True))
+            # exact arithmetic, hence exactly the same regression
+            self.assertEqual(reg.breakpoints, grouped_reg.breakpoints)
+            self.assertEqual(reg.errors, grouped_reg.errors)
+            self.assertEqual(reg.error, grouped_reg.error)
+            self.assertEqual(list(reg), list(grouped_reg))
+            self.assertEqual([leaf.summary() for leaf in reg._leaves()],
+                             [leaf.summary() for leaf in grouped_reg._leaves()])
+            new_points = [(Fraction(25), Fraction(80)), (Fraction(25), Fraction(81)), (Fraction(55), Fraction(10))]
+            self.assertEqual(reg.extend(new_points).breakpoints, grouped_reg.extend(new_points).breakpoints)
+            self.assertIsInstance(grouped_reg._leaves()[0], GroupedLeaf)
+        x, y = read_csv('pingpong_remote_small.csv')
+        for mode in ['BIC', 'weighted']:
+            reg = compute_regression(x, y, mode=mode)
+            grouped_reg = compute_regression(x, y, mode=mode, aggregate=True)
+            self.assertEqual(reg.breakpoints, grouped_reg.breakpoints)
+            self.assertAlmostEqual(reg.error, grouped_reg.error, delta=1e-6)
+            flat_reg = compute_regression(x, y, mode=mode, aggregate=True, breakpoints=reg.breakpoints)
+            self.assertAlmostEqual(flat_reg.error, grouped_reg.flatify().error, delta=1e-6)
+
+    def test_binned_search(self):
+        all_datasets = [generate_dataset(intercept=i, coeff=i, size=100, min_x=(i-1)*10, max_x=i*10)
+                        for i in range(1, 5)]
+        dataset = [(x, y + random.gauss(0, 0.1)) for x, y in sum(all_datasets, [])]
+        reg = compute_regression(dataset)
+        self.assertAlmostIncluded([10, 20, 30], reg.breakpoints, epsilon=1)
+        all_errors = dict(reg.errors.split)
+        # one bin per point: all the splits are candidates
+        self.assertEqual(compute_regression(dataset, nb_bins=len(dataset)).breakpoints, reg.breakpoints)
+        binned_reg = compute_regression(dataset, nb_bins=8)
+        self.assertEqual(binned_reg.config, Config('BIC', reg.config.epsilon, nb_bins=8))
+        self.assertEqual(len(binned_reg.errors.split), 7)
+        for split, error in binned_reg.errors.split:
+            self.assertAlmostEqual(error, all_errors[split])
+        # all the splits between the candidates adjacent to the best one are evaluated
+        refined_reg = compute_regression(dataset, nb_bins=8, refine=True)
+        self.assertAlmostIncluded([10, 20, 30], refined_reg.breakpoints, epsilon=1)
+        refined_errors = refined_reg.errors.split
+        for split, error in refined_errors:
+            self.assertAlmostEqual(error, all_errors[split])
+        self.assertEqual([split for split, _ in refined_errors], sorted([split for split, _ in refined_errors],
+                                                                        reverse=True))
+        self.assertLess(len(refined_errors), len(reg.errors.split)/2)
+        best = min(binned_reg.errors.split, key=lambda e: e[1])[0]
+        splits = [split for split, _ in binned_reg.errors.split]
+        neighbors = splits[max(splits.index(best)-1, 0)], splits[min(splits.index(best)+1, len(splits)-1)]
+        self.assertEqual({split for split, _ in refined_errors},
+                         set(splits) | {split for split in all_errors if neighbors[1] < split < neighbors[0]})
+        self.assertEqual(refined_reg.errors.minsplit, min(error for _, error in refined_errors))
+        # log-spaced bins, for sizes sampled on an exponential scale
+        x = [2**random.uniform(0, 20) for _ in range(300)]
+        y = [xx*(1 if xx < 2**10 else 3)*random.gauss(1, 0.01) for xx in x]
+        log_reg = compute_regression(x, y, mode='weighted', nb_bins=20, binning='log', refine=True)
+        low = max(xx for xx in x if xx < 2**10)
+        high = min(xx for xx in x if xx >= 2**10)
+        self.assertTrue(any(low <= b <= high for b in log_reg.breakpoints))
+        with self.assertRaises(ValueError):
+            compute_regression(dataset, nb_bins=8, binning='foo')
+        with self.assertRaises(ValueError):
+            compute_regression([(x-1, y) for x, y in dataset], nb_bins=8, binning='log')
+
+    def test_stopping_criteria(self):
+        all_datasets = [generate_dataset(intercept=i, coeff=i, size=50, min_x=(
+            i-1)*10, max_x=i*10, repeat=2) for i in range(1, 9)]
+        dataset = [(x, y + random.gauss(0, 1)) for x, y in sum(all_datasets, [])]
+        x = sorted(d[0] for d in dataset)
+        reg = compute_regression(dataset)
+        self.assertGreater(len(reg.breakpoints), 3)
+        # the nodes below max_depth are not searched
+        self.assertIsInstance(compute_regression(dataset, max_depth=0), Leaf)
+        for max_depth in [1, 2]:
+            bounded_reg = compute_regression(dataset, max_depth=max_depth)
+            self.assertLessEqual(len(bounded_reg.breakpoints), 2**max_depth - 1)
+            self.assertTrue(set(bounded_reg.breakpoints) <= set(reg.breakpoints))
+        # the first splits of the unbounded search, in depth-first order
+        bounded_reg = compute_regression(dataset, max_breakpoints=3)
+        self.assertEqual(bounded_reg.breakpoints, [reg.left.left.split, reg.left.split, reg.split])
+        for executor_cls in [concurrent.futures.ThreadPoolExecutor, concurrent.futures.ProcessPoolExecutor]:
+            with executor_cls(max_workers=4) as executor:
+                for order in Config.allowed_orders:
+                    parallel_reg = compute_regression(dataset, max_breakpoints=3, order=order, executor=executor)
+                    self.assertEqual(parallel_reg.breakpoints,
+                                     compute_regression(dataset, max_breakpoints=3, order=order).breakpoints)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            parallel_reg = compute_regression(dataset, max_depth=2, executor=executor)
+            self.assertEqual(parallel_reg.breakpoints, compute_regression(dataset, max_depth=2).breakpoints)
+        # the infeasible splits are not evaluated, the others have the same errors
+        for kwargs, feasible in [({'min_points_per_segment': 120}, lambda n, d: n >= 120),
+                                 ({'min_distinct_x_per_segment': 60}, lambda n, d: d >= 60),
+                                 ({'min_points_per_segment': 150, 'min_distinct_x_per_segment': 80},
+                                  lambda n, d: n >= 150 and d >= 80)]:
+            def is_feasible(split):
+                left = [xx for xx in x if xx <= split]
+                right = [xx for xx in x if xx > split]
+                return feasible(len(left), len(set(left))) and feasible(len(right), len(set(right)))
+            bounded_reg = compute_regression(dataset, **kwargs)
+            self.assertEqual(bounded_reg.errors.split, [e for e in reg.errors.split if is_feasible(e[0])])
+            for leaf in bounded_reg._leaves():
+                xs = [p[0] for p in leaf]
+                self.assertTrue(feasible(len(xs), len(set(xs))))
+            self.assertEqual(compute_regression(dataset, engine='numpy', **kwargs).breakpoints,
+                             bounded_reg.breakpoints)
+            self.assertEqual(str(compute_regression(dataset, n_jobs=2, nb_chunks=3, **kwargs)), str(bounded_reg))
+            binned_reg = compute_regression(dataset, nb_bins=16, refine=True, **kwargs)
+            self.assertTrue(all(is_feasible(split) for split, _ in binned_reg.errors.split))
+        with self.assertRaises(ValueError):
+            compute_regression(dataset, min_points_per_segment=0)
+
+    def test_search_orders(self):
+        all_datasets = [generate_dataset(intercept=i, coeff=i, size=50, min_x=(
+            i-1)*10, max_x=i*10) for i in range(1, 9)]
+        dataset = [(x, y + random.gauss(0, 1)) for x, y in sum(all_datasets, [])]
+        reg = compute_regression(dataset)
+        for order in ['breadth', 'largest']:
+            ordered_reg = compute_regression(dataset, order=order)
+            self.assertEqual(str(ordered_reg), str(reg))
+            self.assertEqual(ordered_reg.errors, reg.errors)
+            for leaf, ordered_leaf in zip(reg._leaves(), ordered_reg._leaves()):
+                self.assertEqual(leaf.errors, ordered_leaf.errors)
+        # with max_breakpoints, the breakpoints go to the first nodes in the order
+        breadth_reg = compute_regression(dataset, order='breadth', max_breakpoints=3)
+        self.assertEqual(breadth_reg.breakpoints, [reg.left.split, reg.split, reg.right.split])
+        largest_reg = compute_regression(dataset, order='largest', max_breakpoints=2)
+        largest = max([reg.left, reg.right], key=len)
+        self.assertEqual(sorted(largest_reg.breakpoints), sorted([reg.split, largest.split]))
+        with self.assertRaises(ValueError):
+            compute_regression(dataset, order='foo')
+
+    def test_deep_tree(self):
+        # each segment is much larger than the previous ones, so most splits isolate the last segment: the tree is
+        # deeper than what the recursion limit would allow
+        nb_segments = 120
+        x = [i + j/4 for i in range(nb_segments) for j in range(4)]
+        y = [10**(xx//1) * (xx % 1 + 1) for xx in x]
+        headroom = 100
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(len(inspect.stack()) + headroom)
+        try:
+            reg = compute_regression(x, y)
+            depth = 0
+            stack = [(reg, 0)]
+            while stack:
+                node, node_depth = stack.pop()
+                depth = max(depth, node_depth)
+                if isinstance(node, Node):
+                    stack.extend([(node.left, node_depth+1), (node.right, node_depth+1)])
+            self.assertGreater(depth, headroom)
+            breakpoints = reg.breakpoints
+            self.assertEqual(breakpoints, sorted(breakpoints))
+            self.assertEqual(len(reg), len(x))
+            self.assertEqual(list(reg), list(zip(x, y)))
+            self.assertEqual(len(reg._leaves()), len(breakpoints) + 1)
+            self.assertEqual(reg.nb_params, 4*len(reg._leaves()) - 1)
+            for xx in x:
+                reg.predict(xx)
+            self.assertEqual(reg.flatify().breakpoints, breakpoints)
+            self.assertEqual(len(reg.merge()), len(x))
+            self.assertEqual(len(str(reg).split('\n')), 2*len(breakpoints) + 1)
+            self.assertEqual(len(reg.to_graphviz().body), 4*len(breakpoints) + 1)
+            for other in [copy.deepcopy(reg), pickle.loads(pickle.dumps(reg))]:
+                self.assertEqual(str(other), str(reg))
+                self.assertEqual(list(other), list(reg))
+                self.assertEqual(other.errors, reg.errors)
+            # a point on the deep side of the tree
+            reg = reg.extend([(0.1, 1.05)])
+            self.assertEqual(len(reg), len(x) + 1)
+            self.assertEqual(list(reg), sorted(list(zip(x, y)) + [(0.1, 1.05)]))
+        finally:
+            sys.setrecursionlimit(limit)
+
+    def test_predict_many(self):
+        for cls in [float, Fraction]:
+            all_datasets = [generate_dataset(intercept=i, coeff=i, size=20, min_x=(
+                i-1)*10, max_x=i*10, cls=cls) for i in range(1, 5)]
+            x, y = zip(*sum(all_datasets, []))
+            reg = compute_regression(x, y)
+            regressions = [reg, reg.flatify(), compute_regression(x, y, breakpoints=[cls(15), cls(25)]),
+                           compute_regression(x[:20], y[:20])]
+            for reg in regressions:
+                xs = list(x) + reg.breakpoints + [cls(-5), cls(0), cls(100)]
+                random.shuffle(xs)
+                self.assertEqual(reg.predict_many(xs), [reg.predict(xx) for xx in xs])
+                predictions = reg.predict_many(numpy.array([float(xx) for xx in xs]))
+                self.assertIsInstance(predictions, numpy.ndarray)
+                for xx, prediction in zip(xs, predictions):
+                    self.assertAlmostEqual(prediction, float(reg.predict(xx)))
+        # segment without any point
+        reg = compute_regression(x, y, breakpoints=[cls(-10)])
+        self.assertTrue(numpy.isnan(reg.predict_many(numpy.array([-20.0]))[0]))
+        self.assertEqual(reg.predict_many([cls(5)]), [reg.predict(cls(5))])
+        with self.assertRaises(AssertionError):
+            reg.predict_many([cls(-20)])
+
     @mock.patch("matplotlib.pyplot.show")
     def test_plot_dataset(self, mock_show):
         all_datasets = [generate_dataset(intercept=i, coeff=i, size=50, min_x=(
@@ -351,10 +1042,32 @@ class NodeTest(unittest.TestCase):
         reg.plot_error(log=True)
         reg.plot_error(log_x=True)
         reg.plot_error(log_y=True)
+        leaf = compute_regression(dataset, max_depth=0)  # not searched
+        self.assertIsInstance(leaf, Leaf)
+        self.assertEqual(leaf.errors.split, [])
+        with self.assertRaises(ValueError):
+            leaf.plot_error()
+        with self.assertRaises(ValueError):
+            reg.flatify().plot_error()
 
 
 class FlatRegressionTest(unittest.TestCase):
 
+    def test_extend(self):
+        all_datasets = [generate_dataset(intercept=i, coeff=i, size=50, min_x=(
+            i-1)*10, max_x=i*10) for i in range(1, 5)]
+        dataset = sum(all_datasets, [])
+        random.shuffle(dataset)
+        reg = compute_regression(dataset[:100], breakpoints=[10, 20, 30])
+        reg.extend(dataset[100:] + [(15, Fraction(1, 3))])
+        expected = compute_regression(dataset + [(15, Fraction(1, 3))], breakpoints=[10, 20, 30])
+        self.assertEqual(list(reg), list(expected))
+        self.assertEqual(reg.breakpoints, [10, 20, 30])
+        for (interval, leaf), (expected_interval, expected_leaf) in zip(reg.segments, expected.segments):
+            self.assertEqual(interval, expected_interval)
+            self.assertAlmostEqual(leaf.coeff, expected_leaf.coeff)
+            self.assertAlmostEqual(leaf.intercept, expected_leaf.intercept)
+
     def assertAlmostIncluded(self, sub_sequence, sequence, epsilon=1e-2):
         for elt in sub_sequence:
             is_in = False
@@ -387,6 +1100,12 @@ class FlatRegressionTest(unittest.TestCase):
             self.assertAlmostEqual(y, prediction)
         other_flat = compute_regression(dataset, breakpoints=flat_reg.breakpoints)
         self.assertEqual(str(other_flat), str(flat_reg))
+        self.assertEqual(list(other_flat), list(flat_reg))
+        # the leaves of the tree are reused, not copied
+        for (_, leaf), (_, other_leaf) in zip(flat_reg.segments, other_flat.segments):
+            self.assertIn(leaf, reg._leaves())
+            self.assertEqual(list(leaf.sorted_iter()), list(other_leaf))
+            self.assertTrue(flat_reg.rss_equal(leaf.RSS, other_leaf.RSS))
 
     def test_multiple_splits(self):
         self.generic_multiplesplits(float, 1)
@@ -472,6 +1191,109 @@ class FlatRegressionTest(unittest.TestCase):
             self.assertEqual(row['RSS'], leaf.RSS)
             self.assertEqual(row['MSE'], leaf.MSE)
 
+    @staticmethod
+    def naive_simplify(reg, RSSlog=False):
+        '''Reference implementation of simplify: merge the adjacent pair with the lowest RSS increase, recomputing all
+        the costs from scratch at each step. Return the successive lists of breakpoints.'''
+        def RSS(x):
+            if RSSlog or x.config.mode == 'log':
+                return x.compute_RSSlog()
+            elif x.config.mode == 'weighted':
+                return x.compute_weighted_RSS()
+            return x.RSS
+        segments = [(list(leaf.sorted_iter()), max_x) for (_, max_x), leaf in reg.segments]
+        result = [reg.breakpoints]
+        while len(segments) > 1:
+            def leaf(points):
+                return Leaf([p[0] for p in points], [p[1] for p in points], config=reg.config)
+            costs = [RSS(leaf(segments[i][0] + segments[i+1][0])) - RSS(leaf(segments[i][0])) -
+                     RSS(leaf(segments[i+1][0])) for i in range(len(segments)-1)]
+            i = costs.index(min(costs))
+            segments[i:i+2] = [(segments[i][0] + segments[i+1][0], segments[i+1][1])]
+            result.append([max_x for _, max_x in segments[:-1]])
+        return result
+
+    def test_simplify_reference(self):
+        for mode in ['BIC', 'AIC', 'weighted', 'log']:
+            x = [random.uniform(1, 100) for _ in range(300)]
+            y = [xx*random.uniform(1, 3) + random.uniform(1, 3) for xx in x]
+            breakpoints = sorted(random.sample(sorted(x)[5:-5:6], 20))
+            reg = compute_regression(x, y, breakpoints=breakpoints, mode=mode, log_solver='lm')
+            for RSSlog in ([False, True] if mode == 'BIC' else [False]):
+                result = reg.simplify(RSSlog=RSSlog)
+                self.assertEqual(list(result.regression[0].breakpoints), breakpoints)
+                self.assertEqual([new_reg.breakpoints for new_reg in result.regression],
+                                 self.naive_simplify(reg, RSSlog=RSSlog))
+                for _, row in result.iterrows():
+                    new_reg = row['regression']
+                    self.assertEqual(list(new_reg), list(reg))
+                    self.assertEqual(row['RSS'], new_reg.RSS)
+                    self.assertAlmostEqual(row['RSSlog'], new_reg.compute_RSSlog())
+                    self.assertAlmostEqual(row['BIClog'], new_reg.compute_BIClog())
+                    self.assertAlmostEqual(row['weighted_RSS'], new_reg.compute_weighted_RSS())
+                    self.assertAlmostEqual(row['weighted_BIC'], new_reg.compute_weighted_BIC())
+                if not RSSlog:
+                    simple_reg = reg.auto_simplify()
+                    self.assertIn(simple_reg.breakpoints, [new_reg.breakpoints for new_reg in result.regression])
+
+    def generic_optimal(self, cls, repeat):
+        all_datasets = [generate_dataset(intercept=i, coeff=i, size=50, min_x=(
+            i-1)*10, max_x=i*10, cls=cls, repeat=repeat) for i in range(1, 9)]
+        dataset = sum(all_datasets, [])
+        reg = compute_regression(dataset, optimal=True)
+        self.assertIsInstance(reg, FlatRegression)
+        self.assertEqual(list(reg), list(sorted(dataset)))
+        self.assertTrue(reg.null_RSS)
+        # unlike the greedy algorithm, no spurious breakpoint
+        self.assertEqual(len(reg.breakpoints), 7)
+        self.assertAlmostIncluded(range(10, 80, 10), reg.breakpoints, epsilon=2)
+
+    def test_optimal(self):
+        self.generic_optimal(float, 1)
+        self.generic_optimal(float, 10)
+        self.generic_optimal(Fraction, 1)
+        self.generic_optimal(Decimal, 1)
+        with self.assertRaises(ValueError):
+            compute_regression(generate_dataset(intercept=1, coeff=1, size=50, min_x=1, max_x=10), mode='log',
+                               optimal=True)
+        # without penalty, the segmentation is optimal for the penalty derived from its own RSS
+        x = [random.uniform(0, 100) for _ in range(500)]
+        y = [xx*(1 if xx < 50 else 3) + random.gauss(0, 1) for xx in x]
+        for mode, param_penalty in [('BIC', math.log(len(x))), ('AIC', 2)]:
+            reg = compute_regression(x, y, mode=mode, optimal=True)
+            self.assertAlmostIncluded([50], reg.breakpoints, epsilon=1)
+            penalty = param_penalty * (reg.segments[0][1].nb_params + 1) * reg.RSS / len(x)
+            self.assertEqual(compute_regression(x, y, mode=mode, optimal=True, penalty=penalty).breakpoints,
+                             reg.breakpoints)
+
+    def test_optimal_exhaustive(self):
+        for mode in ['BIC', 'weighted']:
+            x = [random.choice(range(1, 15)) for _ in range(30)]
+            y = [xx*(1 if xx < 8 else 3) + random.gauss(0, 1) for xx in x]
+            distinct_x = sorted(set(x))
+            penalty = random.uniform(0, 20)
+
+            def RSS(leaf):
+                if mode == 'weighted':  # weighted least squares, the weights being 1/x²
+                    coeff, intercept = leaf._compute_weighted_parameters([1/xx**2 for xx, _ in leaf])
+                    return sum([((yy - coeff*xx - intercept)/xx)**2 for xx, yy in leaf])
+                return max(leaf.RSS, 0)
+
+            def cost(reg):
+                return sum(RSS(leaf) for leaf in reg._leaves()) + penalty*len(reg.segments)
+            best = float('inf')
+            # all the segmentations with at least two distinct x per segment
+            for nb_breakpoints in range(len(distinct_x)//2):
+                for breakpoints in itertools.combinations(distinct_x[1:-2], nb_breakpoints):
+                    indices = [-1] + [distinct_x.index(b) for b in breakpoints] + [len(distinct_x)-1]
+                    if all(j - i >= 2 for i, j in zip(indices, indices[1:])):
+                        best = min(best, cost(compute_regression(x, y, mode=mode, breakpoints=list(breakpoints))))
+            reg = compute_regression(x, y, mode=mode, optimal=True, penalty=penalty)
+            self.assertAlmostEqual(cost(reg), best)
+            with mock.patch('pycewise.reg.numpy', None):
+                python_reg = compute_regression(x, y, mode=mode, optimal=True, penalty=penalty)
+            self.assertAlmostEqual(cost(python_reg), best)
+
     def test_multiple_splits_simplify(self):
         self.generic_multiplesplits_simplify(float, 1)
 
@@ -482,5 +1304,243 @@ class FlatRegressionTest(unittest.TestCase):
         self.generic_multiplesplits_simplify(Fraction, 1)
 
 
+class ReadDatasetTest(unittest.TestCase):
+    def test_sources(self):
+        filename = 'pingpong_remote_small.csv'
+        path = os.path.join(os.path.dirname(__file__), 'test_data', filename)
+        x, y = read_csv(filename)
+        expected = sorted(zip(x, y))
+        data = numpy.array(list(zip(x, y)))
+        structured = numpy.array(list(zip(y, x)), dtype=[('y', float), ('x', float)])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            npy_path = os.path.join(tmpdir, 'data.npy')
+            numpy.save(npy_path, data)
+            structured_path = os.path.join(tmpdir, 'structured.npy')
+            numpy.save(structured_path, structured)
+            csv_path = os.path.join(tmpdir, 'no_header.csv')
+            with open(csv_path, 'w') as f:
+                f.writelines('%r,%r\n' % pair for pair in zip(x, y))
+            sources = [path, csv_path, npy_path, structured_path,
+                       iter([list(zip(x[:10], y[:10])), list(zip(x[10:], y[10:]))]),
+                       iter([data[:10], data[10:]]),
+                       pandas.read_csv(path, chunksize=7, float_precision='round_trip')]
+            for source in sources:
+                new_x, new_y = read_dataset(source, chunk_size=8)
+                self.assertIsInstance(new_x, array)
+                self.assertEqual(list(zip(new_x, new_y)), expected)
+            reg = compute_regression(x, y)
+            for source in [path, npy_path, iter([data[:10], data[10:]])]:
+                new_reg = compute_regression(source)
+                self.assertEqual(new_reg.breakpoints, reg.breakpoints)
+                self.assertEqual(new_reg.error, reg.error)
+                self.assertIsInstance(new_reg._leaves()[0], FloatLeaf)
+
+
+class FrozenRegressionTest(unittest.TestCase):
+    def test_freeze(self):
+        for mode, kwargs in [('BIC', {}), ('weighted', {}), ('log', {'log_solver': 'lm'})]:
+            all_datasets = [generate_dataset(intercept=i, coeff=i, size=30, min_x=(
+                i-1)*10+1, max_x=i*10, cls=Fraction if mode == 'BIC' else float) for i in range(1, 5)]
+            x, y = zip(*sum(all_datasets, []))
+            y = [yy*random.uniform(0.99, 1.01) for yy in y]
+            for reg in [compute_regression(x, y, mode=mode, **kwargs),
+                        compute_regression(x, y, mode=mode, breakpoints=[10, 20, 30], **kwargs)]:
+                frozen = reg.freeze()
+                self.assertIsInstance(frozen, FrozenRegression)
+                self.assertIs(frozen.freeze(), frozen)
+                self.assertEqual(frozen.breakpoints, tuple(reg.breakpoints))
+                self.assertEqual(len(frozen), len(reg))
+                self.assertEqual(frozen.summary(), reg.summary())
+                self.assertEqual(frozen.error, reg.error)
+                self.assertEqual(len(frozen.segments), len(reg.breakpoints)+1)
+                xs = list(x) + reg.breakpoints + [0, 100]
+                self.assertEqual([frozen.predict(xx) for xx in xs], [reg.predict(xx) for xx in xs])
+                self.assertEqual(frozen.predict_many(xs), reg.predict_many(xs))
+                self.assertEqual(pickle.loads(pickle.dumps(frozen)).predict_many(xs), frozen.predict_many(xs))
+                with self.assertRaises(AttributeError):
+                    frozen.breakpoints = ()
+                with self.assertRaises(AttributeError):
+                    frozen.foo = 42
+                with self.assertRaises(AttributeError):
+                    del frozen.coeffs
+        frozen = compute_regression(x, y, breakpoints=[-10]).freeze()
+        self.assertEqual(frozen.segments[0].nb_points, 0)
+        with self.assertRaises(ValueError):
+            frozen.predict(-20)
+        self.assertTrue(numpy.isnan(frozen.predict_many(numpy.array([-20.0]))[0]))
+
+    def test_concurrent_predictions(self):
+        x, y = read_csv('pingpong_remote_small.csv')
+        frozen = compute_regression(x, y, mode='log', log_solver='lm').freeze()
+        expected = [frozen.predict(xx) for xx in x]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: [frozen.predict(xx) for xx in x], range(8)))
+        for result in results:
+            self.assertEqual(result, expected)
+
+
+class WindowedRegressionTest(unittest.TestCase):
+    def stream(self, size, cls):
+        # the breakpoint moves from x=10 to x=20 after the first half of the stream
+        for i in range(size):
+            x = cls(random.randint(1, 300))/10
+            split = 10 if i < size//2 else 20
+            y = 2*x + 1 if x <= split else 5*x - 2*split + 1
+            yield x, y * (1 + cls(random.randint(-10, 10))/1000)
+
+    def assert_equal_window(self, window, points, exact):
+        self.assertEqual(list(window), points)
+        expected_reg = compute_regression(points, breakpoints=window.breakpoints, **window.kwargs)
+        expected = expected_reg.freeze()
+        frozen = window.freeze()
+        self.assertEqual(frozen.breakpoints, expected.breakpoints)
+        self.assertEqual(len(frozen), len(expected))
+        for segment, expected_segment, leaf in zip(frozen.segments, expected.segments, expected_reg._leaves()):
+            self.assertEqual(segment.nb_points, expected_segment.nb_points)
+            # the error of a segment whose regression is exact only depends on the rounding of its null RSS
+            try:
+                exact_fit = abs(leaf.compute_weighted_RSS() if leaf.config.mode == 'weighted' else leaf.RSS) < 1e-9
+            except ZeroDivisionError:
+                exact_fit = False
+            attrs = ['coeff', 'intercept'] if exact_fit else ['coeff', 'intercept', 'error']
+            for attr in attrs:
+                if exact:
+                    self.assertEqual(getattr(segment, attr), getattr(expected_segment, attr))
+                else:
+                    self.assertAlmostEqual(getattr(segment, attr), getattr(expected_segment, attr), delta=1e-6)
+        self.assertAlmostEqual(frozen.error, expected.error, delta=1e-6)
+        self.assertEqual(list(window.flatify()), sorted(points))
+
+    def test_window(self):
+        for cls, mode in [(float, 'BIC'), (Fraction, 'BIC'), (float, 'weighted')]:
+            points = list(self.stream(1000, cls))
+            window = WindowedRegression(300, mode=mode, epsilon=1e-3)
+            window.extend(points[:400])
+            self.assert_equal_window(window, points[100:400], cls is Fraction)
+            self.assert_breakpoints([10], window.breakpoints, 1)
+            breakpoints = window.breakpoints
+            window.extend(points[400:900])
+            self.assertEqual(len(window), 300)
+            # the breakpoints are kept until the next fit, only the parameters of the segments are updated
+            self.assertEqual(window.breakpoints, breakpoints)
+            self.assert_equal_window(window, points[600:900], cls is Fraction)
+            window.refit()
+            self.assertEqual(window.breakpoints, compute_regression(points[600:900], mode=mode,
+                                                                    epsilon=1e-3).breakpoints)
+            self.assert_breakpoints([20], window.breakpoints, 1)
+            self.assertAlmostEqual(window.predict(25), 5*25 - 2*20 + 1, delta=0.5)
+            window.extend(points[900:])
+            self.assert_equal_window(window, points[700:], cls is Fraction)
+
+    def test_refit_every(self):
+        points = list(self.stream(1000, float))
+        window = WindowedRegression(300, refit_every=100)
+        window.extend(points[:800])
+        self.assert_breakpoints([20], window.breakpoints, 1)
+        window.extend(points[800:850])
+        self.assertEqual(window.breakpoints, compute_regression(points[500:800]).breakpoints)
+        window.extend(points[850:900])
+        self.assertEqual(window.breakpoints, compute_regression(points[600:900]).breakpoints)
+        # a pair that is not a float
+        window.add(Fraction(1, 3), Fraction(5, 3))
+        self.assert_equal_window(window, points[601:900] + [(Fraction(1, 3), Fraction(5, 3))], False)
+
+    def assert_breakpoints(self, expected, actual, epsilon):
+        for x in expected:
+            self.assertTrue(any(abs(x - y) < epsilon for y in actual), '%s not in %s' % (x, actual))
+
+
+class ProfileTest(unittest.TestCase):
+    def test_counts(self):
+        x, y = read_csv('memcpy_small.csv')
+        for mode in ['AIC', 'BIC', 'weighted']:
+            reg = compute_regression(x, y, mode=mode, profile=True)
+            profile = reg.profile
+            self.assertIsInstance(profile, Profile)
+            self.assertIsNone(compute_regression(x, y, mode=mode).profile)
+            self.assertEqual(reg.breakpoints, compute_regression(x, y, mode=mode).breakpoints)
+            nb_breakpoints = len(reg.breakpoints)
+            # the root and its two leaves, then two nodes with an empty leaf for each split
+            self.assertEqual(profile.counts['node'], 1 + 2*nb_breakpoints)
+            self.assertEqual(profile.counts['leaf'], 2 + 2*nb_breakpoints)
+            # each point is moved at least once by the search of the root, one group at a time
+            self.assertGreaterEqual(profile.counts['move'], len(set(x)) - 1)
+            self.assertEqual(profile.counts['points moved'], profile.counts['move'])  # all the x are distinct
+            self.assertGreater(profile.counts['error %s' % mode], profile.counts['move']/2)
+            self.assertGreater(profile.times['move'], 0)
+            self.assertGreater(profile.times['error %s' % mode], 0)
+            self.assertEqual(sorted(profile.levels), list(range(len(profile.levels))))
+            self.assertEqual(profile.level_counts[0], 1)
+            self.assertEqual(sum(profile.level_counts.values()), 1 + 2*nb_breakpoints)
+            self.assertEqual(set(profile.counts) - {'node', 'leaf', 'move', 'points moved'}, {'error %s' % mode})
+            df = profile.to_pandas()
+            levels = ['level %d' % depth for depth in range(len(profile.levels))]
+            self.assertEqual(list(df['name'][-len(levels):]), levels)
+            self.assertIn(str(profile.counts['move']), repr(profile))
+
+    def test_log(self):
+        x, y = read_csv('memcpy_small.csv')
+        for solver in ['gradient', 'lm']:
+            reg = compute_regression(x[:50], y[:50], mode='log', log_solver=solver, profile=True)
+            profile = reg.profile
+            self.assertGreater(profile.counts['log parameters'], 0)
+            self.assertGreaterEqual(profile.counts['log iterations'], profile.counts['log parameters'])
+            self.assertGreaterEqual(profile.counts['log line search steps'], profile.counts['log iterations'])
+            self.assertGreater(profile.times['log parameters'], 0)
+
+    def test_accumulate(self):
+        x, y = read_csv('memcpy_small.csv')
+        profile = Profile()
+        reg = compute_regression(x, y, profile=profile)
+        self.assertIs(reg.profile, profile)
+        nb_moves = profile.counts['move']
+        compute_regression(x, y, profile=profile)
+        self.assertEqual(profile.counts['move'], 2*nb_moves)
+        self.assertEqual(profile.level_counts[0], 2)
+
+    def test_detached(self):
+        x, y = read_csv('memcpy_small.csv')
+        for kwargs in [{}, {'breakpoints': [1e4]}, {'optimal': True}]:
+            reg = compute_regression(x, y, profile=True, **kwargs)
+            self.assertIsNone(reg.config.profile)
+            counts = dict(reg.profile.counts)
+            self.assertGreater(counts['leaf'], 0)
+            # the operations made after the fit are not counted
+            reg.error
+            reg = reg.extend([(x[0], y[0])])
+            self.assertEqual(dict(reg.profile.counts), counts)
+        for profile in [1, 'yes', Profile]:
+            with self.assertRaises(ValueError):
+                compute_regression(x, y, profile=profile)
+        for profile in [False, None]:
+            self.assertIsNone(compute_regression(x, y, profile=profile).profile)
+
+    def test_parallel(self):
+        x, y = read_csv('memcpy_small.csv')
+        with self.assertRaises(ValueError):
+            compute_regression(x, y, n_jobs=2, profile=True)
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            with self.assertRaises(ValueError):
+                compute_regression(x, y, executor=executor, profile=True)
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_run(self):
+        import benchmark
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'bench.csv')
+            benchmark.main(['--datasets', 'ringrong_remote_small', 'synthetic', '--sizes', '200', '--modes', 'BIC',
+                            'weighted', '--repeat', '2', '--option', 'engine="python"', '-o', filename])
+            with open(filename) as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 2*2*len(benchmark.OPERATIONS))
+        self.assertEqual({row['dataset'] for row in rows}, {'ringrong_remote_small', 'synthetic_200'})
+        for row in rows:
+            self.assertEqual(row['options'], "engine='python'")
+            self.assertLessEqual(float(row['time_min']), float(row['time_median']))
+            self.assertLessEqual(float(row['time_median']), float(row['time_max']))
+            self.assertGreater(int(row['peak_memory']), 0)
+
+
 if __name__ == "__main__":
     unittest.main()